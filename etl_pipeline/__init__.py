@@ -2,8 +2,17 @@ import logging
 from extract import *
 from transform import *
 from load import * 
-
-from datetime import datetime
+from incremental import *
+from scheduler import *
+from risk_scores import *
+from staging_schema import *
+from elt import *
+from checkpoints import *
+
+import os
+import shutil
+import tempfile
+from datetime import datetime, date, timedelta
 
 # Set up logging
 logging.basicConfig(filename='etl_logs.log', 
@@ -12,9 +21,55 @@ logging.basicConfig(filename='etl_logs.log',
 
 logger = logging.getLogger(__name__)
 
+# How the warehouse tables are loaded: 'copy' (streamed COPY) or 'insert' (executemany)
+LOAD_METHOD = os.getenv('LOAD_METHOD', 'copy')
+
+# 'typed' infers column types and casts the CSV on the server (failing rows go to <staging>_rejects), 'text' stages everything as TEXT
+STAGING_SCHEMA = os.getenv('STAGING_SCHEMA', 'typed')
+
+# 'full' reloads today's extraction, 'incremental' only processes rows staged after the last high-water mark
+ETL_MODE = os.getenv('ETL_MODE', 'full')
+
+# 'pandas' transforms and splits the rows in Python, 'sql' (ELT, full mode only) does it with set-based SQL inside the warehouse
+TRANSFORM_ENGINE = os.getenv('TRANSFORM_ENGINE', 'pandas')
+
+# 'range' fills dim_dates with every day between the first and last date, 'referenced' only with the dates the facts use
+DATE_DIMENSION_MODE = os.getenv('DATE_DIMENSION_MODE', 'range')
+
+STAGING_TABLE = 'staging_disasters'
+SOURCE_FILE = r"C:\Users\Legion\Desktop\official_data\1900_2021_DISASTERS.csv"
+
 if __name__ == "__main__":
 
+    high_water_mark = None
+    dimension_rows = None
+    spill_dir = None
+    loaded_in_db = False
+    use_checkpoints = False
+    already_loaded = False
+
+    columns_to_remove = ['year','Year','local_time', 'river_basin', 'admin1_code', 'admin2_code', 'geo_locations',
+                         'start_year','start_month', 'start_day', 'end_year', 'end_month', 'end_day'
+                         ]
+
     try:
+        # Stage outputs are checkpointed under keys of what they depend on (source file content, staging schema,
+        # transform columns), so an unchanged input skips the stage and a failed load resumes from the transformed rows.
+        # Only for full pandas runs: incremental runs depend on the staging state, ELT runs stay in the database.
+        use_checkpoints = bool(CHECKPOINT_DIR) and ETL_MODE == 'full' and TRANSFORM_ENGINE == 'pandas'
+        if use_checkpoints:
+            extract_checkpoint = StageCheckpoint('extract', stage_key(file_digest(SOURCE_FILE), STAGING_SCHEMA, TRANSFORM_VERSION))
+            transform_checkpoint = StageCheckpoint('transform', stage_key(extract_checkpoint.key, columns_to_remove))
+            load_checkpoint = StageCheckpoint('load', transform_checkpoint.key)
+            if load_checkpoint.is_complete():
+                # the load only counts while the warehouse still holds its facts (it may have been reset since)
+                dwh_conn = connect_db('disasters_dwh')
+                already_loaded = dwh_conn is not None and count_facts(dwh_conn) >= load_checkpoint.info().get('facts', 1)
+                if dwh_conn is not None:
+                    dwh_conn.close()
+                if not already_loaded:
+                    logger.warning("The last load checkpoint is not in the warehouse (fact_disasters is missing rows). Loading again.")
+
         ###########
         # Extract #
         ###########
@@ -22,12 +77,23 @@ if __name__ == "__main__":
         logger.info("Starting extraction process...")
 
         # Connect to database
-        conn = connect_db('staging_disasters')
-        if conn:
+        skip_extract = use_checkpoints and (already_loaded or transform_checkpoint.is_complete() or extract_checkpoint.is_complete())
+        conn = None if skip_extract else connect_db('staging_disasters')
+        if skip_extract:
+            logger.info("Source file unchanged since the last checkpoint. Skipping extraction process.")
+        elif conn:
             cursor = conn.cursor()
 
-            # Process CSV file and load data into staging table
-            process_csv_to_staging(cursor, "staging_disasters", r"C:\Users\Legion\Desktop\official_data\1900_2021_DISASTERS.csv")
+            if ETL_MODE == 'incremental':
+                # Stage only the new or changed rows and resume after the last high-water mark
+                stage_new_rows(cursor, STAGING_TABLE, SOURCE_FILE, typed=STAGING_SCHEMA == 'typed')
+                high_water_mark = get_watermark(cursor, STAGING_TABLE)
+            else:
+                # Process CSV file and load data into staging table
+                if STAGING_SCHEMA == 'typed':
+                    process_csv_to_typed_staging(cursor, STAGING_TABLE, SOURCE_FILE)
+                else:
+                    process_csv_to_staging(cursor, STAGING_TABLE, SOURCE_FILE)
 
             conn.commit()
             cursor.close()
@@ -45,23 +111,69 @@ if __name__ == "__main__":
 
         logger.info("Starting transformation process...")
 
-        disasters = get_data_from_db(f""" --sql
-                SELECT * FROM staging_disasters 
-                WHERE TO_CHAR(extraction_time, 'YYYYMMDD') = '{datetime.now().strftime("%Y%m%d")}';
-            """, 'staging_disasters')
-
-        columns_to_remove = ['year','Year','local_time', 'river_basin', 'admin1_code', 'admin2_code', 'geo_locations',
-                             'start_year','start_month', 'start_day', 'end_year', 'end_month', 'end_day','longitude','latitude'
-                             ]
-        if disasters is not None:
-            disasters=remove_columns(disasters,['Year'],'disasters')
-            transformed_disasters = transform_data(disasters, columns_to_remove)
-            transformed_disasters=rename_column(transformed_disasters,"insured_damages_('000_us$)",'insured_damages')
-            transformed_disasters=rename_column(transformed_disasters,"total_damages_('000_us$)","total_damages")
-            logger.info("Transformation completed successfully.")
-            print(transformed_disasters.columns)
+        if ETL_MODE == 'incremental':
+            query, params = get_delta_query(STAGING_TABLE, since=high_water_mark)
+        else:
+            # Range on extraction_time rather than TO_CHAR so the extraction_time index can be used
+            today = datetime.combine(date.today(), datetime.min.time())
+            query, params = f""" --sql
+                SELECT * FROM {STAGING_TABLE} 
+                WHERE extraction_time >= %(start)s AND extraction_time < %(end)s;
+            """, {'start': today, 'end': today + timedelta(days=1)}
+
+        if already_loaded:
+            logger.info("Source file and transformation unchanged since the last load. Skipping transformation process.")
+        elif TRANSFORM_ENGINE == 'sql' and ETL_MODE == 'full':
+            # ELT: the staging rows are copied to the warehouse and transformed, split and loaded there
+            staging_conn = connect_db(STAGING_TABLE)
+            dwh_conn = connect_db('disasters_dwh')
+            run_elt(query, params, staging_conn, dwh_conn, columns_to_remove, DATE_DIMENSION_MODE)
+            refresh_country_impacts(dwh_conn)
+            staging_conn.close()
+            dwh_conn.close()
+            loaded_in_db = True
+            logger.info("Transformation and load completed in the data warehouse.")
         else:
-            logger.warning("No data found for transformation.")
+            # The transformed chunks are spilled to disk (into the transform checkpoint when there is one) as they pass,
+            # and only their dimension inputs are held: the fact load reads the chunks back one at a time
+            if use_checkpoints and transform_checkpoint.is_complete():
+                logger.info("Reading the transformed rows from the last checkpoint.")
+                transformed_parts = transform_checkpoint
+                transformed = transformed_parts.read_chunks()
+            else:
+                # Staging is streamed through a server-side cursor and transformed chunk by chunk,
+                # so only one raw chunk is held at a time next to the (narrower) transformed rows
+                if use_checkpoints and extract_checkpoint.is_complete():
+                    logger.info("Reading the staged rows from the last checkpoint.")
+                    chunks = extract_checkpoint.read_chunks()
+                else:
+                    # categories and nullable integers from the first read on: the transform, the dimension split
+                    # and the load then work on compact columns
+                    chunks = (optimize_dtypes(chunk) for chunk in iter_data_from_db(query, STAGING_TABLE, params))
+                    if use_checkpoints:
+                        chunks = extract_checkpoint.write_chunks(chunks)
+                chunks = (remove_columns(chunk, ['Year'], 'disasters') for chunk in chunks)
+                transformed = transform_chunks(chunks, columns_to_remove)
+                if use_checkpoints:
+                    transformed_parts = transform_checkpoint
+                else:
+                    spill_dir = tempfile.mkdtemp(prefix='etl_transformed_')
+                    transformed_parts = StageCheckpoint('transform', 'batch', spill_dir)
+                transformed = transformed_parts.write_chunks(transformed)
+
+            input_chunks, high_water_marks = [], []
+            for chunk in transformed:
+                if not chunk.empty:
+                    input_chunks.append(dimension_inputs(chunk))
+                    high_water_marks.append(chunk['extraction_time'].max())
+
+            if input_chunks:
+                dimension_rows = concat_chunks(input_chunks)
+                del input_chunks
+                batch_high_water_mark = max(high_water_marks)
+                logger.info(f"Transformation completed successfully ({len(dimension_rows)} rows).")
+            else:
+                logger.warning("No data found for transformation.")
 
     except Exception as e:
             logger.error(f"Error occurred: {e}")
@@ -74,7 +186,16 @@ if __name__ == "__main__":
         logger.info("Starting load process...")
 
         # Connect to the data warehouse
-        dwh_conn = connect_db('disasters_dwh')
+        if loaded_in_db:
+            dwh_conn = None
+        elif already_loaded:
+            logger.info("These transformed rows are already in the warehouse. Skipping load process.")
+            dwh_conn = None
+        elif dimension_rows is None:
+            logger.warning("No transformed data to load. Skipping load process.")
+            dwh_conn = None
+        else:
+            dwh_conn = connect_db('disasters_dwh')
         if dwh_conn:
             logger.info("Connected to the data warehouse successfully.")
             
@@ -85,81 +206,71 @@ if __name__ == "__main__":
 
             # Generate dimensions
             logger.info("Generating dimension tables...")
-            fact_disasters, dim_disaster_types, dim_disaster_groups, dim_associated_distructions, dim_locations, dim_disaster_names, dim_ofda_responses, dim_appeals, dim_declarations, dim_mag_scales, dim_adm_levels, dim_disasters_origin, dim_dates = generate_dimensions(transformed_disasters)
+            if ETL_MODE == 'incremental':
+                # Existing members keep their IDs, only new members are loaded
+                fact_disasters, dim_disaster_types, dim_disaster_groups, dim_associated_distructions, dim_locations, dim_disaster_names, dim_ofda_responses, dim_appeals, dim_declarations, dim_mag_scales, dim_adm_levels, dim_disasters_origin, dim_dates = generate_incremental_dimensions(dimension_rows, dwh_conn, date_mode=DATE_DIMENSION_MODE)
+            else:
+                fact_disasters, dim_disaster_types, dim_disaster_groups, dim_associated_distructions, dim_locations, dim_disaster_names, dim_ofda_responses, dim_appeals, dim_declarations, dim_mag_scales, dim_adm_levels, dim_disasters_origin, dim_dates = generate_dimensions(dimension_rows, date_mode=DATE_DIMENSION_MODE)
             logger.info("Dimension tables generated successfully.")
             fact_disasters=remove_columns(fact_disasters,['starting_date','ending_date'],'disasters')
-
-            # Load dim_disaster_types
-            logger.info("Loading dim_disaster_types...")
-            load_dim_disaster_types(dim_disaster_types, dwh_conn)
-            logger.info("dim_disaster_types loaded successfully.")
-
-            # Load dim_disaster_groups
-            logger.info("Loading dim_disaster_groups...")
-            load_dim_disaster_groups(dim_disaster_groups, dwh_conn)
-            logger.info("dim_disaster_groups loaded successfully.")
-
-            # Load dim_associated_distructions
-            logger.info("Loading dim_associated_distructions...")
-            load_dim_associated_distructions(dim_associated_distructions, dwh_conn)
-            logger.info("dim_associated_distructions loaded successfully.")
-
-            # Load dim_locations
-            logger.info("Loading dim_locations...")
-            load_dim_locations(dim_locations, dwh_conn)
-            logger.info("dim_locations loaded successfully.")
-
-            # Load dim_disaster_names
-            logger.info("Loading dim_disaster_names...")
-            load_dim_disaster_names(dim_disaster_names, dwh_conn)
-            logger.info("dim_disaster_names loaded successfully.")
-
-            # Load dim_ofda_responses
-            logger.info("Loading dim_ofda_responses...")
-            load_dim_ofda_responses(dim_ofda_responses, dwh_conn)
-            logger.info("dim_ofda_responses loaded successfully.")
-
-            # Load dim_appeals
-            logger.info("Loading dim_appeals...")
-            load_dim_appeals(dim_appeals, dwh_conn)
-            logger.info("dim_appeals loaded successfully.")
-
-            # Load dim_declarations
-            logger.info("Loading dim_declarations...")
-            load_dim_declarations(dim_declarations, dwh_conn)
-            logger.info("dim_declarations loaded successfully.")
-
-            # Load dim_mag_scales
-            logger.info("Loading dim_mag_scales...")
-            load_dim_mag_scales(dim_mag_scales, dwh_conn)
-            logger.info("dim_mag_scales loaded successfully.")
-
-            # Load dim_adm_levels
-            logger.info("Loading dim_adm_levels...")
-            load_dim_adm_levels(dim_adm_levels, dwh_conn)
-            logger.info("dim_adm_levels loaded successfully.")
-
-            # Load dim_disasters_origin
-            logger.info("Loading dim_disasters_origin...")
-            load_dim_disasters_origin(dim_disasters_origin, dwh_conn)
-            logger.info("dim_disasters_origin loaded successfully.")
-
-            # Load dim_dates
-            logger.info("Loading dim_dates...")
-            load_dim_dates(dim_dates, dwh_conn)
-            logger.info("dim_dates loaded successfully.")
-            
-            # Load fact_disasters
-            logger.info("Loading fact_disasters...")
-            load_fact_disasters(fact_disasters, dwh_conn)
-            logger.info("fact_disasters loaded successfully.")
-
+            del dimension_rows
+
+            # The other fact columns are joined back chunk by chunk from the transformed rows on disk
+            transformed_chunks = (rename_column(rename_column(chunk, "insured_damages_('000_us$)", 'insured_damages'),
+                                                "total_damages_('000_us$)", 'total_damages')
+                                  for chunk in transformed_parts.read_chunks())
+
+            # Load the dimensions side by side, then fact_disasters, following the REFERENCES between the tables
+            tables = {
+                'dim_disaster_types': dim_disaster_types,
+                'dim_disaster_groups': dim_disaster_groups,
+                'dim_associated_distructions': dim_associated_distructions,
+                'dim_locations': dim_locations,
+                'dim_disaster_names': dim_disaster_names,
+                'dim_ofda_responses': dim_ofda_responses,
+                'dim_appeals': dim_appeals,
+                'dim_declarations': dim_declarations,
+                'dim_mag_scales': dim_mag_scales,
+                'dim_adm_levels': dim_adm_levels,
+                'dim_disasters_origin': dim_disasters_origin,
+                'dim_dates': dim_dates,
+                'fact_disasters': iter_fact_chunks(fact_disasters, transformed_chunks),
+            }
+            skip_existing = [table for table in tables if table.startswith('dim_')] if ETL_MODE == 'incremental' else []
+
+            # Edited records replace their earlier version under the same fact ID, within the fact load's transaction
+            replaced_groups = replaced_fact_groups(dwh_conn, fact_disasters) if ETL_MODE == 'incremental' else None
+            replace_existing = ['fact_disasters'] if ETL_MODE == 'incremental' else []
+
+            dwh_pool = create_connection_pool('disasters_dwh')
+            try:
+                load_tables(tables, dwh_pool, LOAD_METHOD, skip_existing, replace_existing=replace_existing)
+            finally:
+                dwh_pool.closeall()
+
+            # Per-country summaries read by the dashboards: only the groups of the new and replaced facts are recomputed in incremental mode
+            refresh_country_impacts(dwh_conn, fact_disasters['id'] if ETL_MODE == 'incremental' else None, replaced_groups)
+            if use_checkpoints:
+                load_checkpoint.complete(facts=len(fact_disasters))
+
+            # Move the high-water mark only once the batch is in the warehouse
+            if ETL_MODE == 'incremental':
+                conn = connect_db(STAGING_TABLE)
+                cursor = conn.cursor()
+                set_watermark(cursor, STAGING_TABLE, batch_high_water_mark)
+                conn.commit()
+                cursor.close()
+                conn.close()
 
             # Close the connection
             dwh_conn.close()
             logger.info("Data warehouse connection closed.")
-        else:
+        elif dimension_rows is not None:
             logger.error("Data warehouse connection failed.")
 
     except Exception as e:
-        logger.error(f"Error occurred during loading process: {e}")
\ No newline at end of file
+        logger.error(f"Error occurred during loading process: {e}")
+    finally:
+        # the spilled chunks of a run without checkpoints are not kept
+        if spill_dir:
+            shutil.rmtree(spill_dir, ignore_errors=True)
\ No newline at end of file
@@ -0,0 +1,102 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+from datetime import datetime
+import pyarrow as pa
+from pyarrow import feather
+
+
+__all__ = [
+    'CHECKPOINT_DIR',
+    'file_digest',
+    'stage_key',
+    'StageCheckpoint',
+]
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_DIR = os.getenv('ETL_CHECKPOINTS', '.etl_checkpoints')  # stage outputs kept between runs, empty to disable
+COMPLETE_MARKER = '_complete.json'
+
+
+# Keys of the stage inputs: the source file content and the stage configuration
+################################################################################
+def file_digest(path, block_size=1 << 20):
+    """
+    SHA-256 of the file content, read block by block.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def stage_key(*parts):
+    # short hash of everything a stage output depends on (digests, column lists, modes)
+    return hashlib.sha256(json.dumps(parts, default=str).encode()).hexdigest()[:16]
+
+
+# Stage outputs on disk, so a re-run or a failed load resumes from the last good stage
+#######################################################################################
+class StageCheckpoint:
+    """
+    The output of one pipeline stage for one input key, kept as numbered chunks in {directory}/{stage}/{key}/,
+    so it can be written and read back chunk by chunk. The chunks are uncompressed Arrow IPC (Feather) files
+    with their pandas dtypes, read back memory-mapped rather than copied into a buffer first.
+    A checkpoint only counts once its marker is written: a stage that failed halfway is run again.
+    Completing a checkpoint removes the older ones of the same stage.
+    """
+    def __init__(self, stage, key, directory=CHECKPOINT_DIR):
+        self.stage = stage
+        self.key = key
+        self.stage_dir = os.path.join(directory, stage)
+        self.path = os.path.join(self.stage_dir, key)
+
+    def is_complete(self):
+        return os.path.exists(os.path.join(self.path, COMPLETE_MARKER))
+
+    def info(self):
+        # what complete() recorded about the checkpoint
+        with open(os.path.join(self.path, COMPLETE_MARKER)) as f:
+            return json.load(f)
+
+    def parts(self):
+        return sorted(name for name in os.listdir(self.path) if name.startswith('part-'))
+
+    def write_chunks(self, chunks):
+        """
+        Writes every chunk as it passes through and yields it on unchanged.
+        The checkpoint is completed once chunks are exhausted, unless they held no rows at all
+        (more likely a failed upstream stage than an output worth resuming from). An error raised
+        by chunks leaves it incomplete.
+        """
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.makedirs(self.path)
+        rows = 0
+        for position, chunk in enumerate(chunks):
+            table = pa.Table.from_pandas(chunk)
+            feather.write_feather(table, os.path.join(self.path, f'part-{position:05d}.arrow'), compression='uncompressed')
+            rows += len(chunk)
+            yield chunk
+        if rows:
+            self.complete(rows=rows)
+
+    def read_chunks(self):
+        for name in self.parts():
+            yield feather.read_table(os.path.join(self.path, name), memory_map=True).to_pandas()
+
+    def complete(self, **info):
+        """
+        Marks the checkpoint as good (with info about it) and removes the other checkpoints of the stage.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        info = {'stage': self.stage, 'key': self.key, 'completed': datetime.now().isoformat(), **info}
+        with open(os.path.join(self.path, COMPLETE_MARKER), 'w') as f:
+            json.dump(info, f, default=str)
+        for key in os.listdir(self.stage_dir):
+            if key != self.key:
+                shutil.rmtree(os.path.join(self.stage_dir, key), ignore_errors=True)
+        logger.info(f"Checkpoint {self.stage}/{self.key} completed: {info}")
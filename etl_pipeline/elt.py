@@ -0,0 +1,280 @@
+import logging
+import re
+import tempfile
+import time
+from psycopg2 import sql
+
+from load import DATE_DIMENSION_BOUNDS, create_disaster_tables
+from staging_schema import STAGED_DATES, date_expression
+
+
+__all__ = [
+    'land_staging',
+    'transform_in_db',
+    'load_star_schema',
+    'run_elt',
+]
+
+logger = logging.getLogger(__name__)
+
+LANDING_SPOOL_SIZE = 64 * 1024 * 1024  # bytes of staging rows kept in memory on their way to the warehouse, the rest spills to disk
+
+# Column renames the pandas path applies after clean_column_names
+COLUMN_RENAMES = {"insured_damages_('000_us$)": 'insured_damages', "total_damages_('000_us$)": 'total_damages'}
+
+# The splits of load.generate_dimensions, in the same order: (table, source columns, id column)
+HIERARCHIES = [
+    ('dim_disaster_types', ['disaster_type', 'disaster_subtype', 'disaster_subsubtype'], 'type_id'),
+    ('dim_disaster_groups', ['disaster_group', 'disaster_subgroup'], 'group_id'),
+    ('dim_associated_distructions', ['associated_dis', 'associated_dis2'], 'associated_dis_id'),
+]
+COMBINATIONS = [
+    ('dim_locations', ['country', 'iso', 'region', 'continent', 'location'], 'location_id'),
+    ('dim_disaster_names', ['event_name'], 'name_id'),
+    ('dim_ofda_responses', ['ofda_response'], 'ofda_resp_id'),
+    ('dim_appeals', ['appeal'], 'appeal_id'),
+    ('dim_declarations', ['declaration'], 'declaration_id'),
+    ('dim_mag_scales', ['dis_mag_scale'], 'dis_mag_scale_id'),
+    ('dim_adm_levels', ['adm_level'], 'adm_level_id'),
+    ('dim_disasters_origin', ['origin'], 'origin_id'),
+]
+
+NUMERIC_TYPES = ('smallint', 'integer', 'bigint', 'double precision', 'real', 'numeric')
+
+
+def warehouse_column(col):
+    # clean_column_names, the renames of the driver, then the sanitizing of load_dataframe_to_db
+    col = col.lower().replace(' ', '_')
+    return re.sub(r"[^\w]", "_", COLUMN_RENAMES.get(col, col))
+
+
+# Extract: staging rows copied as they are into a landing table of the warehouse session
+#########################################################################################
+def land_staging(staging_conn, dwh_conn, query, params=None, landing_table='elt_landing'):
+    """
+    Streams the result of the staging query into a temporary landing table of the warehouse connection
+    (COPY TO STDOUT on one side, COPY FROM STDIN on the other), keeping the staging column types and
+    numbering the rows in the order the query returns them. Returns {warehouse column: type}.
+    """
+    with staging_conn.cursor() as cur:
+        query_sql = cur.mogrify(query, params).decode().strip().rstrip(';')
+        cur.execute(f"SELECT * FROM ({query_sql}) AS staged LIMIT 0;")
+        oids = [column.type_code for column in cur.description]
+        names = [column.name for column in cur.description]
+        cur.execute("SELECT oid, format_type(oid, NULL) FROM pg_type WHERE oid = ANY(%s);", (oids,))
+        type_names = dict(cur.fetchall())
+
+        with tempfile.SpooledTemporaryFile(max_size=LANDING_SPOOL_SIZE, mode='w+b') as spool:
+            cur.copy_expert(f"COPY ({query_sql}) TO STDOUT WITH (FORMAT CSV)", spool)
+            spool.seek(0)
+
+            columns = {warehouse_column(name): type_names[oid] for name, oid in zip(names, oids)}
+            with dwh_conn.cursor() as dwh_cur:
+                dwh_cur.execute(sql.SQL("DROP TABLE IF EXISTS {};").format(sql.Identifier(landing_table)))
+                dwh_cur.execute(sql.SQL("CREATE TEMP TABLE {} (row_number BIGSERIAL, {});").format(
+                    sql.Identifier(landing_table),
+                    sql.SQL(', ').join(sql.SQL("{} {}").format(sql.Identifier(col), sql.SQL(type_name)) for col, type_name in columns.items())))
+                copy_query = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT CSV)").format(
+                    sql.Identifier(landing_table), sql.SQL(', ').join(sql.Identifier(col) for col in columns))
+                dwh_cur.copy_expert(copy_query.as_string(dwh_conn), spool)
+                logger.info(f"Landed {dwh_cur.rowcount} staging rows in {landing_table}")
+    return columns
+
+
+# Transform: deduplication, dates, duration and coordinates as one set-based statement
+#######################################################################################
+def coordinate_expression(col, type_name):
+    # transform.coordinates_to_number: signed degrees, a trailing S or W makes the value negative
+    if type_name in NUMERIC_TYPES:
+        return sql.SQL("{}::DOUBLE PRECISION").format(sql.Identifier(col))
+    text = sql.SQL("UPPER({}::TEXT)").format(sql.Identifier(col))
+    return sql.SQL("""CASE WHEN {text} ~ {pattern} THEN
+            CASE WHEN {text} ~ '[SW]\\s*$' THEN -ABS(SUBSTRING({text} FROM '[+-]?\\d+(?:\\.\\d*)?')::DOUBLE PRECISION)
+                 ELSE SUBSTRING({text} FROM '[+-]?\\d+(?:\\.\\d*)?')::DOUBLE PRECISION END
+        END""").format(text=text, pattern=sql.Literal(r'^\s*[+-]?\d+(\.\d*)?\s*°?\s*[NSEW]?\s*$'))
+
+
+def transform_in_db(conn, columns, columns_to_remove=(), landing_table='elt_landing', table='elt_disasters'):
+    """
+    The SQL counterpart of transform_data on the landing table: duplicates removed (the first copy is kept),
+    start and end dates assembled from their parts unless staging already holds them, duration in days,
+    coordinates as signed degrees, and the columns_to_remove left out. Rows are numbered 1..n in
+    first-appearance order, as add_id_column numbers them. Returns {column: type} of the result.
+    """
+    # the driver drops Year before deduplicating
+    raw = [col for col in columns if col != 'year']
+    removed = {warehouse_column(col) for col in columns_to_remove}
+
+    select, result = [sql.SQL("ROW_NUMBER() OVER (ORDER BY first_row) AS id")], {'id': 'bigint'}
+    for col in raw:
+        if col in removed or col in STAGED_DATES:
+            continue
+        if col in ('latitude', 'longitude'):
+            select.append(sql.SQL("{} AS {}").format(coordinate_expression(col, columns[col]), sql.Identifier(col)))
+            result[col] = 'double precision'
+        else:
+            select.append(sql.Identifier(col))
+            result[col] = columns[col]
+    for date_col, parts in STAGED_DATES.items():
+        value = sql.Identifier(date_col) if date_col in columns else date_expression(*parts)
+        select.append(sql.SQL("{} AS {}").format(value, sql.Identifier(date_col)))
+        result[date_col] = 'date'
+    result['duration_days'] = 'integer'
+
+    with conn.cursor() as cur:
+        cur.execute(sql.SQL("DROP TABLE IF EXISTS {};").format(sql.Identifier(table)))
+        cur.execute(sql.SQL("""--sql
+            CREATE TEMP TABLE {table} AS
+            SELECT *, ending_date - starting_date AS duration_days FROM (
+                SELECT {select} FROM (
+                    SELECT {raw}, MIN(row_number) AS first_row FROM {landing} GROUP BY {raw}
+                ) AS deduplicated
+            ) AS transformed;
+        """).format(table=sql.Identifier(table), select=sql.SQL(', ').join(select),
+                    raw=sql.SQL(', ').join(sql.Identifier(col) for col in raw), landing=sql.Identifier(landing_table)))
+        logger.info(f"Transformed {cur.rowcount} deduplicated rows in the database")
+    return result
+
+
+# Dimension splits: members grouped with their first row, surrogate keys in first-appearance order
+###################################################################################################
+def same_member(columns, left, right):
+    # NULL-safe equality that still allows hash joins (IS NOT DISTINCT FROM does not): NULL is its own member
+    return sql.SQL(' AND ').join(
+        sql.SQL("({l}.{c} IS NULL) = ({r}.{c} IS NULL) AND COALESCE({l}.{c}::TEXT, '') = COALESCE({r}.{c}::TEXT, '')").format(
+            l=sql.Identifier(left), r=sql.Identifier(right), c=sql.Identifier(col)) for col in columns)
+
+
+def create_members(cur, member_table, key_cols, id_col, offset=0, table='elt_disasters'):
+    # GROUP BY keeps NULL as a group, like factorize and merge do; IDs follow the first row of every member
+    cur.execute(sql.SQL("DROP TABLE IF EXISTS {};").format(sql.Identifier(member_table)))
+    cur.execute(sql.SQL("""--sql
+        CREATE TEMP TABLE {members} AS
+        SELECT {offset} + ROW_NUMBER() OVER (ORDER BY first_row) AS {id_col}, {cols}, first_row
+        FROM (SELECT {cols}, MIN(id) AS first_row FROM {table} GROUP BY {cols}) AS grouped;
+    """).format(members=sql.Identifier(member_table), offset=sql.Literal(offset), id_col=sql.Identifier(id_col),
+                cols=sql.SQL(', ').join(sql.Identifier(col) for col in key_cols), table=sql.Identifier(table)))
+    created = cur.rowcount
+    # temporary tables have no statistics until analyzed, without them the fact joins are planned for millions of members
+    cur.execute(sql.SQL("ANALYZE {};").format(sql.Identifier(member_table)))
+    return created
+
+
+def load_star_schema(conn, columns, table='elt_disasters', bounds=DATE_DIMENSION_BOUNDS, date_mode='range'):
+    """
+    The SQL counterpart of generate_dimensions followed by the load, on the transformed table.
+    Members are numbered in order of first appearance, hierarchy levels continue each other's numbering,
+    the parent of a member is the previous level on its first row, and a row takes the ID of its deepest
+    non-null level. Rows whose start or end date is missing or outside bounds are not loaded as facts;
+    dim_dates covers every day between the first and last date of the loaded facts (date_mode='range')
+    or only the dates they use (date_mode='referenced').
+    Returns the number of facts loaded.
+    """
+    lower = sql.Literal(bounds[0]) if bounds[0] is not None else sql.SQL('CURRENT_DATE')
+    upper = sql.Literal(bounds[1]) if bounds[1] is not None else sql.SQL('CURRENT_DATE')
+    in_bounds = sql.SQL(' AND ').join(sql.SQL("f.{col} BETWEEN {lower} AND {upper}").format(
+        col=sql.Identifier(date_col), lower=lower, upper=upper) for date_col in STAGED_DATES)
+    start = time.perf_counter()
+
+    with conn.cursor() as cur:
+        create_disaster_tables(conn)
+        joins, fact_columns, fact_values = [], [], []
+
+        for dim_table, levels, id_col in HIERARCHIES:
+            offset = 0
+            for position, level in enumerate(levels):
+                members = f"elt_{id_col}_{position}"
+                created = create_members(cur, members, [level], 'id', offset, table)
+                parent, parent_join = sql.SQL("NULL"), sql.SQL("")
+                if position:
+                    previous = f"elt_{id_col}_{position - 1}"
+                    parent = sql.SQL("CASE WHEN m.{} IS NOT NULL THEN p.id END").format(sql.Identifier(level))
+                    parent_join = sql.SQL("JOIN {table} f ON f.id = m.first_row JOIN {previous} p ON {same}").format(
+                        table=sql.Identifier(table), previous=sql.Identifier(previous), same=same_member([levels[position - 1]], 'p', 'f'))
+                cur.execute(sql.SQL("""--sql
+                    INSERT INTO {dim} (id, name, parent_id)
+                    SELECT m.id, m.{level}, {parent} FROM {members} m {parent_join} ORDER BY m.id;
+                """).format(dim=sql.Identifier(dim_table), level=sql.Identifier(level), parent=parent,
+                            members=sql.Identifier(members), parent_join=parent_join))
+                joins.append(sql.SQL("JOIN {members} {alias} ON {same}").format(
+                    members=sql.Identifier(members), alias=sql.Identifier(members), same=same_member([level], members, 'f')))
+                offset += created
+            fact_columns.append(id_col)
+            fact_values.append(sql.SQL("CASE {} END").format(sql.SQL(' ').join(
+                sql.SQL("WHEN f.{} IS NOT NULL THEN {}.id").format(sql.Identifier(level), sql.Identifier(f"elt_{id_col}_{position}"))
+                for position, level in reversed(list(enumerate(levels))))))
+
+        for dim_table, key_cols, id_col in COMBINATIONS:
+            members = f"elt_{id_col}"
+            create_members(cur, members, key_cols, id_col, 0, table)
+            cur.execute(sql.SQL("INSERT INTO {dim} ({id_col}, {cols}) SELECT {id_col}, {cols} FROM {members} ORDER BY {id_col};").format(
+                dim=sql.Identifier(dim_table), id_col=sql.Identifier(id_col), cols=sql.SQL(', ').join(sql.Identifier(col) for col in key_cols),
+                members=sql.Identifier(members)))
+            joins.append(sql.SQL("JOIN {members} {alias} ON {same}").format(
+                members=sql.Identifier(members), alias=sql.Identifier(members), same=same_member(key_cols, members, 'f')))
+            fact_columns.append(id_col)
+            fact_values.append(sql.SQL("{}.{}").format(sql.Identifier(members), sql.Identifier(id_col)))
+
+        if date_mode == 'referenced':
+            days = sql.SQL("""(SELECT f.starting_date AS day FROM {table} f WHERE {in_bounds}
+                               UNION SELECT f.ending_date FROM {table} f WHERE {in_bounds}) AS referenced""")
+        else:
+            days = sql.SQL("""(SELECT LEAST(MIN(f.starting_date), MIN(f.ending_date)) AS first_day,
+                                GREATEST(MAX(f.starting_date), MAX(f.ending_date)) AS last_day
+                         FROM {table} f WHERE {in_bounds}) AS span,
+                        generate_series(span.first_day, span.last_day, INTERVAL '1 day') AS day""")
+        cur.execute(sql.SQL("""--sql
+            INSERT INTO dim_dates (date, date_id, year, quarter, month, iso_week)
+            SELECT day::DATE, TO_CHAR(day, 'YYYYMMDD')::INTEGER, EXTRACT(YEAR FROM day), EXTRACT(QUARTER FROM day),
+                   EXTRACT(MONTH FROM day), EXTRACT(WEEK FROM day)
+            FROM {days};
+        """).format(days=days.format(table=sql.Identifier(table), in_bounds=in_bounds)))
+
+        # facts: the remaining columns cast to the warehouse types (COPY parses the text the pandas path writes,
+        # and staging may hold numbers as TEXT), the dimension IDs and the YYYYMMDD keys of in-bounds dates
+        cur.execute("""--sql
+            SELECT attname, format_type(atttypid, atttypmod) FROM pg_attribute
+            WHERE attrelid = 'fact_disasters'::regclass AND attnum > 0 AND NOT attisdropped;
+        """)
+        fact_types = dict(cur.fetchall())
+        dimension_columns = {col for _, cols, _ in HIERARCHIES + COMBINATIONS for col in cols} | set(STAGED_DATES)
+        values = [col for col in columns if col not in dimension_columns]
+        fact_values = [sql.SQL("CAST(f.{} AS {})").format(sql.Identifier(col), sql.SQL(fact_types[col])) if col in fact_types
+                       else sql.SQL("f.{}").format(sql.Identifier(col)) for col in values] + fact_values
+        fact_columns = values + fact_columns
+        for date_col in STAGED_DATES:
+            fact_columns.append(f"{date_col}_id")
+            fact_values.append(sql.SQL("TO_CHAR(f.{}, 'YYYYMMDD')::INTEGER").format(sql.Identifier(date_col)))
+
+        # the NULL-safe join conditions defeat the row estimates and the planner falls back to nested loops
+        # (one pass over the facts per dimension member), the member tables are small enough to hash
+        cur.execute("SET LOCAL enable_nestloop = off;")
+        cur.execute(sql.SQL("""--sql
+            INSERT INTO fact_disasters ({columns})
+            SELECT {values} FROM {table} f {joins}
+            WHERE {in_bounds} ORDER BY f.id;
+        """).format(columns=sql.SQL(', ').join(sql.Identifier(col) for col in fact_columns), values=sql.SQL(', ').join(fact_values),
+                    table=sql.Identifier(table), joins=sql.SQL(' ').join(joins), in_bounds=in_bounds))
+        facts = cur.rowcount
+        cur.execute("RESET enable_nestloop;")
+        cur.execute(sql.SQL("SELECT COUNT(*) FROM {};").format(sql.Identifier(table)))
+        rows = cur.fetchone()[0]
+        if facts < rows:
+            logger.warning(f"Dropped {rows - facts} of {rows} rows without a valid starting_date and ending_date")
+
+    conn.commit()
+    logger.info(f"Loaded the star schema in the database: {facts} facts in {time.perf_counter() - start:.2f}s")
+    return facts
+
+
+def run_elt(query, params, staging_conn, dwh_conn, columns_to_remove=(), date_mode='range'):
+    """
+    ELT mode: lands the staging rows selected by query in the warehouse, then transforms and splits them
+    into the star schema with set-based SQL inside the warehouse. Returns the number of facts loaded.
+    """
+    start = time.perf_counter()
+    columns = land_staging(staging_conn, dwh_conn, query, params)
+    columns = transform_in_db(dwh_conn, columns, columns_to_remove)
+    facts = load_star_schema(dwh_conn, columns, date_mode=date_mode)
+    logger.info(f"ELT completed in {time.perf_counter() - start:.2f}s")
+    return facts
@@ -1,9 +1,9 @@
 import psycopg2
 from psycopg2 import sql
-import io
 import csv
 import logging
 import os
+import time
 
 
 __all__ = [
@@ -16,6 +16,9 @@ __all__ = [
 
 logger = logging.getLogger(__name__)
 
+COPY_READ_SIZE = 1024 * 1024  # characters handed to COPY per read
+PROGRESS_LOG_INTERVAL = 5  # seconds between progress log lines
+
 # # directory where the script is located
 # script_dir = os.getcwd()
 # # logs folder
@@ -90,22 +93,63 @@ def create_staging_table(cursor, table_name, columns):
         )
         
         cursor.execute(create_table_query)
+
+        # Range predicates on extraction_time (daily and incremental selections) can use this index
+        cursor.execute(sql.SQL("""--sql
+            CREATE INDEX IF NOT EXISTS {} ON {} (extraction_time);
+        """).format(
+            sql.Identifier(f"{table_name}_extraction_time_idx"),
+            sql.Identifier(table_name)
+        ))
         logger.info(f"Created staging table {table_name} successfully")
     except Exception as error:
         logger.error(f"Error creating table {table_name}: {error}")
 
 
+# File adapter that reports COPY progress while streaming
+########################################################
+class ProgressFileReader:
+    """
+    Wraps an open text file so COPY reads it directly in blocks instead of from an in-memory copy.
+    Logs how many bytes have been read and the throughput every log_interval seconds.
+    """
+    def __init__(self, file, total_bytes, log_interval=PROGRESS_LOG_INTERVAL):
+        self.file = file
+        self.total_bytes = total_bytes
+        self.log_interval = log_interval
+        self.start_time = time.perf_counter()
+        self.last_log_time = self.start_time
+
+    def bytes_read(self):
+        # position in the underlying binary stream, the text layer may hold a small decoded read-ahead
+        return self.file.buffer.tell()
+
+    def log_progress(self, message):
+        elapsed = max(time.perf_counter() - self.start_time, 1e-9)
+        done = self.bytes_read()
+        percent = 100 * done / self.total_bytes if self.total_bytes else 100
+        logger.info(f"{message}: {done} of {self.total_bytes} bytes ({percent:.1f}%), {done / elapsed / 1e6:.2f} MB/s")
+
+    def read(self, size=-1):
+        data = self.file.read(size)
+        now = time.perf_counter()
+        if now - self.last_log_time >= self.log_interval:
+            self.log_progress(f"Streaming {self.file.name}")
+            self.last_log_time = now
+        return data
+
+    def readline(self, size=-1):
+        return self.file.readline(size)
+
+
 # Loading the raw data into staging area
 ########################################
 def load_data_into_staging(cursor, table_name, file_path, columns):
     """
     Loads data from a CSV file into the staging table.
+    The file is streamed to COPY in blocks of COPY_READ_SIZE characters, so memory does not grow with the file size.
     """
     try:
-        with open(file_path, 'r', encoding='utf-8', errors='replace') as file:
-            file_content = file.read()
-        
-        file_like_object = io.StringIO(file_content)
         columns_list = ', '.join([f'"{col}"' for col in columns])
 
         copy_query = sql.SQL("""--sql
@@ -115,7 +159,11 @@ def load_data_into_staging(cursor, table_name, file_path, columns):
             sql.SQL(columns_list)
         )
         
-        cursor.copy_expert(sql=copy_query, file=file_like_object)
+        with open(file_path, 'r', encoding='utf-8', errors='replace') as file:
+            reader = ProgressFileReader(file, os.path.getsize(file_path))
+            cursor.copy_expert(sql=copy_query, file=reader, size=COPY_READ_SIZE)
+            reader.log_progress(f"Finished streaming {file_path}")
+
         logger.info(f"Data loaded into staging table {table_name} successfully")
     except Exception as error:
         logger.error(f"Error loading data into staging table {table_name}: {error}")
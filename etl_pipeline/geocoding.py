@@ -0,0 +1,154 @@
+import logging
+import os
+import sqlite3
+import time
+import numpy as np
+import pandas as pd
+import reverse_geocode
+
+
+__all__ = [
+    'ReverseGeocoder',
+    'GEOCODE_COLUMNS',
+    'ISO3_CODES',
+]
+
+logger = logging.getLogger(__name__)
+
+GEOCODE_COLUMNS = ['country', 'country_code', 'city', 'state']
+GEOCODE_CACHE = os.getenv('GEOCODE_CACHE', '.geocode_cache.sqlite')
+GEOCODE_GRID = 0.01  # degrees, coordinates are snapped to this grid before lookup (about 1 km)
+GEOCODE_BATCH_SIZE = 50000  # coordinates sent to reverse_geocode at a time
+GEOCODE_MAX_ENTRIES = 1000000  # least recently used entries are evicted past this size
+
+# ISO 3166 alpha-3 codes (the warehouse 'iso' column) of the alpha-2 country_code that reverse_geocode returns
+ISO3_CODES = """
+    AD AND AE ARE AF AFG AG ATG AI AIA AL ALB AM ARM AO AGO AQ ATA AR ARG AS ASM AT AUT AU AUS AW ABW AX ALA AZ AZE
+    BA BIH BB BRB BD BGD BE BEL BF BFA BG BGR BH BHR BI BDI BJ BEN BL BLM BM BMU BN BRN BO BOL BQ BES BR BRA BS BHS
+    BT BTN BV BVT BW BWA BY BLR BZ BLZ CA CAN CC CCK CD COD CF CAF CG COG CH CHE CI CIV CK COK CL CHL CM CMR CN CHN
+    CO COL CR CRI CU CUB CV CPV CW CUW CX CXR CY CYP CZ CZE DE DEU DJ DJI DK DNK DM DMA DO DOM DZ DZA EC ECU EE EST
+    EG EGY EH ESH ER ERI ES ESP ET ETH FI FIN FJ FJI FK FLK FM FSM FO FRO FR FRA GA GAB GB GBR GD GRD GE GEO GF GUF
+    GG GGY GH GHA GI GIB GL GRL GM GMB GN GIN GP GLP GQ GNQ GR GRC GS SGS GT GTM GU GUM GW GNB GY GUY HK HKG HM HMD
+    HN HND HR HRV HT HTI HU HUN ID IDN IE IRL IL ISR IM IMN IN IND IO IOT IQ IRQ IR IRN IS ISL IT ITA JE JEY JM JAM
+    JO JOR JP JPN KE KEN KG KGZ KH KHM KI KIR KM COM KN KNA KP PRK KR KOR KW KWT KY CYM KZ KAZ LA LAO LB LBN LC LCA
+    LI LIE LK LKA LR LBR LS LSO LT LTU LU LUX LV LVA LY LBY MA MAR MC MCO MD MDA ME MNE MF MAF MG MDG MH MHL MK MKD
+    ML MLI MM MMR MN MNG MO MAC MP MNP MQ MTQ MR MRT MS MSR MT MLT MU MUS MV MDV MW MWI MX MEX MY MYS MZ MOZ NA NAM
+    NC NCL NE NER NF NFK NG NGA NI NIC NL NLD NO NOR NP NPL NR NRU NU NIU NZ NZL OM OMN PA PAN PE PER PF PYF PG PNG
+    PH PHL PK PAK PL POL PM SPM PN PCN PR PRI PS PSE PT PRT PW PLW PY PRY QA QAT RE REU RO ROU RS SRB RU RUS RW RWA
+    SA SAU SB SLB SC SYC SD SDN SE SWE SG SGP SH SHN SI SVN SJ SJM SK SVK SL SLE SM SMR SN SEN SO SOM SR SUR SS SSD
+    ST STP SV SLV SX SXM SY SYR SZ SWZ TC TCA TD TCD TF ATF TG TGO TH THA TJ TJK TK TKL TL TLS TM TKM TN TUN TO TON
+    TR TUR TT TTO TV TUV TW TWN TZ TZA UA UKR UG UGA UM UMI US USA UY URY UZ UZB VA VAT VC VCT VE VEN VG VGB VI VIR
+    VN VNM VU VUT WF WLF WS WSM XK XKX YE YEM YT MYT ZA ZAF ZM ZMB ZW ZWE
+""".split()
+ISO3_CODES = dict(zip(ISO3_CODES[::2], ISO3_CODES[1::2]))
+
+
+class ReverseGeocoder:
+    """
+    Reverse geocoding (country, country_code, city, state) with deduplication and a persistent cache.
+    Coordinates are snapped to a grid of grid degrees, each distinct grid cell is looked up once,
+    and results are kept in a SQLite file between runs with least-recently-used eviction.
+    """
+    def __init__(self, cache_path=GEOCODE_CACHE, grid=GEOCODE_GRID, batch_size=GEOCODE_BATCH_SIZE, max_entries=GEOCODE_MAX_ENTRIES):
+        self.cache_path = cache_path
+        self.grid = grid
+        self.batch_size = batch_size
+        self.max_entries = max_entries
+
+        self.conn = sqlite3.connect(cache_path)
+        self.conn.execute("""--sql
+            CREATE TABLE IF NOT EXISTS geocode_cache (
+                grid REAL,
+                lat_key INTEGER,
+                lon_key INTEGER,
+                country TEXT,
+                country_code TEXT,
+                city TEXT,
+                state TEXT,
+                last_used REAL,
+                PRIMARY KEY (grid, lat_key, lon_key)
+            );
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS geocode_cache_last_used ON geocode_cache (last_used);")
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def cached(self, cells):
+        """
+        Reads the cached results of the given grid cells in one join through a temporary table.
+        """
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS wanted_cells (lat_key INTEGER, lon_key INTEGER);")
+        self.conn.execute("DELETE FROM wanted_cells;")
+        self.conn.executemany("INSERT INTO wanted_cells VALUES (?, ?);", cells[['lat_key', 'lon_key']].itertuples(index=False, name=None))
+        hits = pd.read_sql_query("""--sql
+            SELECT c.lat_key, c.lon_key, c.country, c.country_code, c.city, c.state
+            FROM geocode_cache c JOIN wanted_cells w ON c.lat_key = w.lat_key AND c.lon_key = w.lon_key
+            WHERE c.grid = ?;
+        """, self.conn, params=(self.grid,))
+
+        # refresh the hits so eviction keeps what is still in use
+        self.conn.execute("""--sql
+            UPDATE geocode_cache SET last_used = ?
+            WHERE grid = ? AND (lat_key, lon_key) IN (SELECT lat_key, lon_key FROM wanted_cells);
+        """, (time.time(), self.grid))
+        self.conn.commit()
+        return hits
+
+    def geocode(self, cells):
+        """
+        Looks the grid cells up with reverse_geocode in batches and stores the results in the cache.
+        """
+        results = []
+        for start in range(0, len(cells), self.batch_size):
+            batch = cells.iloc[start:start + self.batch_size]
+            coords = list(zip(batch['lat_key'] * self.grid, batch['lon_key'] * self.grid))
+            found = pd.DataFrame(reverse_geocode.search(coords)).reindex(columns=GEOCODE_COLUMNS)
+            results.append(pd.concat([batch[['lat_key', 'lon_key']].reset_index(drop=True), found], axis=1))
+        results = pd.concat(results, ignore_index=True)
+
+        now = time.time()
+        self.conn.executemany("INSERT OR REPLACE INTO geocode_cache VALUES (?, ?, ?, ?, ?, ?, ?, ?);", [
+            (self.grid, int(lat_key), int(lon_key), country, country_code, city, state, now)
+            for lat_key, lon_key, country, country_code, city, state in results.itertuples(index=False, name=None)
+        ])
+        self.evict()
+        self.conn.commit()
+        return results
+
+    def evict(self):
+        count = self.conn.execute("SELECT COUNT(*) FROM geocode_cache;").fetchone()[0]
+        if count > self.max_entries:
+            self.conn.execute("""--sql
+                DELETE FROM geocode_cache WHERE rowid IN (
+                    SELECT rowid FROM geocode_cache ORDER BY last_used LIMIT ?
+                );
+            """, (count - self.max_entries,))
+            logger.info(f"Evicted {count - self.max_entries} entries from the geocode cache")
+
+    def lookup(self, lat, lon):
+        """
+        Returns a DataFrame with GEOCODE_COLUMNS for every coordinate pair, aligned with the index of lat
+        (or numbered from 0 for plain arrays). Missing coordinates give missing values.
+        """
+        index = lat.index if isinstance(lat, pd.Series) else pd.RangeIndex(len(lat))
+        keys = pd.DataFrame({
+            'lat_key': np.round(pd.to_numeric(np.asarray(lat), errors='coerce') / self.grid),
+            'lon_key': np.round(pd.to_numeric(np.asarray(lon), errors='coerce') / self.grid),
+        }).dropna().astype('int64')
+
+        cells = keys.drop_duplicates().reset_index(drop=True)
+        found = self.cached(cells) if len(cells) else pd.DataFrame(columns=['lat_key', 'lon_key'] + GEOCODE_COLUMNS)
+        missing = cells.merge(found[['lat_key', 'lon_key']].astype('int64'), how='left', indicator=True)
+        missing = missing[missing['_merge'] == 'left_only'].drop(columns='_merge')
+        if len(missing):
+            found = pd.concat([found, self.geocode(missing)], ignore_index=True)
+        logger.info(f"Reverse geocoded {len(index)} coordinates: {len(cells)} distinct cells, {len(cells) - len(missing)} from cache")
+
+        # a left merge keeps the order of keys, so results go back to the rows by position
+        matched = keys.merge(found.astype({'lat_key': 'int64', 'lon_key': 'int64'}), on=['lat_key', 'lon_key'], how='left')
+        result = pd.DataFrame(None, index=pd.RangeIndex(len(index)), columns=GEOCODE_COLUMNS, dtype=object)
+        result.iloc[keys.index.to_numpy(), :] = matched[GEOCODE_COLUMNS].to_numpy()
+        result.index = index
+        return result
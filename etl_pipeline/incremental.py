@@ -0,0 +1,305 @@
+import logging
+import pandas as pd
+from psycopg2 import sql
+
+from extract import get_columns_from_csv, create_staging_table, load_data_into_staging
+from load import generate_dimensions
+from key_registry import KeyRegistry, encode_natural_keys
+from risk_scores import impact_groups
+from staging_schema import prepare_staging_types, create_typed_staging_table, load_typed_rows, staged_date_parts
+
+
+__all__ = [
+    'create_watermark_table',
+    'get_watermark',
+    'set_watermark',
+    'stage_new_rows',
+    'get_delta_query',
+    'fetch_dimension',
+    'align_dimension',
+    'align_hierarchy',
+    'check_registry_members',
+    'generate_incremental_dimensions',
+    'replaced_fact_groups',
+]
+
+logger = logging.getLogger(__name__)
+
+STAGING_KEY = 'Dis No'  # natural key of a disaster record in staging (dis_no in fact_disasters)
+
+# Warehouse dimensions in the order generate_dimensions returns them:
+# (table, fact columns holding its ids, id column, natural key columns, how IDs are kept stable)
+# 'registry' dimensions get durable IDs from the KeyRegistry, 'smart_key' IDs are derived from the value itself
+# (YYYYMMDD dates) and 'hierarchy' dimensions are aligned with the warehouse after the split
+DIMENSIONS = [
+    ('dim_disaster_types', ['type_id'], 'id', ['name', 'parent_id'], 'hierarchy'),
+    ('dim_disaster_groups', ['group_id'], 'id', ['name', 'parent_id'], 'hierarchy'),
+    ('dim_associated_distructions', ['associated_dis_id'], 'id', ['name', 'parent_id'], 'hierarchy'),
+    ('dim_locations', ['location_id'], 'location_id', ['country', 'iso', 'region', 'continent', 'location'], 'registry'),
+    ('dim_disaster_names', ['name_id'], 'name_id', ['event_name'], 'registry'),
+    ('dim_ofda_responses', ['ofda_resp_id'], 'ofda_resp_id', ['ofda_response'], 'registry'),
+    ('dim_appeals', ['appeal_id'], 'appeal_id', ['appeal'], 'registry'),
+    ('dim_declarations', ['declaration_id'], 'declaration_id', ['declaration'], 'registry'),
+    ('dim_mag_scales', ['dis_mag_scale_id'], 'dis_mag_scale_id', ['dis_mag_scale'], 'registry'),
+    ('dim_adm_levels', ['adm_level_id'], 'adm_level_id', ['adm_level'], 'registry'),
+    ('dim_disasters_origin', ['origin_id'], 'origin_id', ['origin'], 'registry'),
+    ('dim_dates', ['starting_date_id', 'ending_date_id'], 'date_id', ['date'], 'smart_key'),
+]
+
+
+# Persisted high-water mark of the last extraction_time loaded into the warehouse
+##################################################################################
+def create_watermark_table(cursor):
+    """
+    Creates the table that keeps one high-water mark per staging table.
+    """
+    cursor.execute("""--sql
+        CREATE TABLE IF NOT EXISTS etl_watermarks (
+            table_name TEXT PRIMARY KEY,
+            high_water_mark TIMESTAMP NOT NULL
+        );
+    """)
+
+
+def get_watermark(cursor, table_name):
+    """
+    Returns the last extraction_time processed for the staging table, or None on the first run.
+    """
+    create_watermark_table(cursor)
+    cursor.execute("SELECT high_water_mark FROM etl_watermarks WHERE table_name = %s;", (table_name,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def set_watermark(cursor, table_name, high_water_mark):
+    """
+    Records the extraction_time up to which the staging table has been loaded into the warehouse.
+    """
+    create_watermark_table(cursor)
+    cursor.execute("""--sql
+        INSERT INTO etl_watermarks (table_name, high_water_mark) VALUES (%s, %s)
+        ON CONFLICT (table_name) DO UPDATE SET high_water_mark = GREATEST(etl_watermarks.high_water_mark, EXCLUDED.high_water_mark);
+    """, (table_name, high_water_mark))
+    logger.info(f"High-water mark for {table_name} set to {high_water_mark}")
+
+
+# Staging only the rows that are new or changed since previous extractions
+###########################################################################
+def stage_new_rows(cursor, table_name, file_path, typed=False):
+    """
+    Copies the CSV file into a temporary table and appends to the staging table only the rows
+    that are not already staged with identical values. Returns the number of rows appended.
+    With typed=True the staging table is typed (see staging_schema) and the file is cast on the way in.
+    """
+    columns = get_columns_from_csv(file_path)
+    if not columns:
+        logger.warning(f"No columns found for file {file_path}. Skipping processing.")
+        return 0
+
+    if typed:
+        types = prepare_staging_types(cursor, table_name, file_path)
+        create_typed_staging_table(cursor, table_name, types)
+    else:
+        create_staging_table(cursor, table_name, columns)
+
+    incoming_table = f"{table_name}_incoming"
+    cursor.execute(sql.SQL("""--sql
+        CREATE TEMP TABLE {} (LIKE {} INCLUDING DEFAULTS) ON COMMIT DROP;
+    """).format(sql.Identifier(incoming_table), sql.Identifier(table_name)))
+    if typed:
+        load_typed_rows(cursor, table_name, file_path, columns, types, target_table=incoming_table)
+        columns = columns + list(staged_date_parts(columns))
+    else:
+        load_data_into_staging(cursor, incoming_table, file_path, columns)
+
+    columns_sql = sql.SQL(', ').join(sql.Identifier(col) for col in columns)
+    cursor.execute(sql.SQL("""--sql
+        INSERT INTO {staging} ({columns})
+        SELECT {columns} FROM {incoming}
+        EXCEPT
+        SELECT {columns} FROM {staging};
+    """).format(staging=sql.Identifier(table_name), incoming=sql.Identifier(incoming_table), columns=columns_sql))
+
+    appended = cursor.rowcount
+    logger.info(f"Appended {appended} new or changed rows from {file_path} to {table_name}")
+    return appended
+
+
+def get_delta_query(table_name, since=None, until=None, key_column=STAGING_KEY):
+    """
+    Builds a sargable query on extraction_time: rows after the high-water mark `since`
+    and, optionally, before `until`. Returns the query and its parameters.
+    An edited record is staged again as a new row, so only its latest version per key_column is kept.
+    Rows come ordered by extraction_time and key_column, which the new surrogate IDs follow.
+    (ctid order is not kept once rows are updated or vacuumed)
+    """
+    conditions = [f"""NOT EXISTS (SELECT 1 FROM {table_name} newer
+                       WHERE newer."{key_column}" = staged."{key_column}" AND newer.extraction_time > staged.extraction_time)"""]
+    params = {}
+    if since is not None:
+        conditions.append("extraction_time > %(since)s")
+        params['since'] = since
+    if until is not None:
+        conditions.append("extraction_time < %(until)s")
+        params['until'] = until
+
+    query = f"""--sql
+        SELECT * FROM {table_name} staged
+        WHERE {' AND '.join(conditions)}
+        ORDER BY staged.extraction_time, staged."{key_column}";
+    """
+    return query, params
+
+
+# Appending new dimension members with IDs that do not collide with the warehouse
+##################################################################################
+def fetch_dimension(conn, table_name):
+    """
+    Reads the current members of a warehouse dimension.
+    """
+    return pd.read_sql_query(f"SELECT * FROM {table_name};", conn)
+
+
+def as_ids(values):
+    """
+    Converts an ID column to Python ints with None for missing values, the form psycopg2 can send.
+    """
+    ids = pd.to_numeric(values).astype('Int64').astype(object)
+    return ids.where(ids.notna(), None)
+
+
+def align_dimension(batch_dim, existing_dim, id_col, key_cols, next_id):
+    """
+    Matches the members of a batch dimension to the existing warehouse members on their natural key.
+    Members that already exist keep their warehouse ID, new members get IDs from next_id upward.
+    Returns the batch-to-warehouse ID mapping, the new members to insert and the next free ID.
+    """
+    existing_keys = existing_dim[key_cols + [id_col]].drop_duplicates(subset=key_cols)
+    existing_keys = existing_keys.rename(columns={id_col: 'warehouse_id'})
+    existing_keys['warehouse_id'] = pd.to_numeric(existing_keys['warehouse_id'])
+
+    # compare dates as dates, whatever type the driver returned them as
+    for col in key_cols:
+        if pd.api.types.is_datetime64_any_dtype(batch_dim[col]):
+            existing_keys[col] = pd.to_datetime(existing_keys[col])
+
+    merged = batch_dim.merge(existing_keys, on=key_cols, how='left')
+    is_new = merged['warehouse_id'].isna()
+    merged.loc[is_new, 'warehouse_id'] = range(next_id, next_id + is_new.sum())
+
+    mapping = dict(zip(batch_dim[id_col], merged['warehouse_id'].astype('int64')))
+    new_members = merged.loc[is_new].drop(columns=id_col).rename(columns={'warehouse_id': id_col})
+    new_members[id_col] = as_ids(new_members[id_col])
+    return mapping, new_members[batch_dim.columns], next_id + int(is_new.sum())
+
+
+def align_hierarchy(batch_dim, existing_dim, next_id):
+    """
+    Aligns an id/name/parent_id hierarchy level by level, so a member is matched on its name
+    under its already aligned parent.
+    """
+    existing = existing_dim.assign(parent_id=pd.to_numeric(existing_dim['parent_id']))
+    mapping, new_members = {}, []
+
+    level = batch_dim[batch_dim['parent_id'].isna()]
+    while not level.empty:
+        level_ids = level['id']
+        level = level.assign(parent_id=pd.to_numeric(level['parent_id'].map(mapping)))
+        level_mapping, level_new, next_id = align_dimension(level, existing, 'id', ['name', 'parent_id'], next_id)
+        mapping.update(level_mapping)
+        new_members.append(level_new.assign(parent_id=as_ids(level_new['parent_id'])))
+        level = batch_dim[batch_dim['parent_id'].isin(level_ids) & ~batch_dim['id'].isin(list(mapping))]
+
+    return mapping, pd.concat(new_members, ignore_index=True), next_id
+
+
+def check_registry_members(dim, existing_dim, id_col, key_cols):
+    """
+    Raises when a registry ID is already held in the warehouse by another natural key: loading with
+    skip_existing would silently keep the warehouse member and point the batch's facts at it.
+    """
+    existing = existing_dim.assign(**{id_col: pd.to_numeric(existing_dim[id_col])})
+    merged = dim.merge(existing, on=id_col, suffixes=('', '_warehouse'))
+    if merged.empty:
+        return
+    conflicting = encode_natural_keys(merged[key_cols]) != encode_natural_keys(
+        merged[[f'{col}_warehouse' for col in key_cols]].set_axis(key_cols, axis=1))
+    if conflicting.any():
+        raise ValueError(f"{int(conflicting.sum())} registry IDs of {id_col} are held by other natural keys in the warehouse, "
+                         f"e.g. {merged.loc[conflicting, id_col].iloc[0]}")
+
+
+def next_free_id(existing_dim, id_col):
+    if existing_dim.empty:
+        return 1
+    return int(pd.to_numeric(existing_dim[id_col]).max()) + 1
+
+
+def generate_incremental_dimensions(df, conn, registry=None, date_mode='range'):
+    """
+    Splits a delta batch into the fact table and dimensions like generate_dimensions, then aligns it with the warehouse:
+    dimension members already loaded keep their IDs and fact IDs continue after the highest fact ID in the warehouse.
+    Registry dimensions come back whole with their durable IDs (load them with skip_existing=True),
+    the others come back with their new members only.
+    """
+    if registry is None:
+        registry = KeyRegistry(conn)
+    for table_name, _, id_col, key_cols, strategy in DIMENSIONS:
+        if strategy == 'registry':
+            registry.seed(id_col, table_name, id_col, key_cols)
+
+    existing_date_ids = pd.read_sql_query("SELECT date_id FROM dim_dates;", conn)['date_id']
+    fact, *dims = generate_dimensions(df, registry, date_mode, existing_date_ids)
+
+    new_dims = []
+    for (table_name, fact_cols, id_col, key_cols, strategy), dim in zip(DIMENSIONS, dims):
+        if strategy == 'registry':
+            check_registry_members(dim, fetch_dimension(conn, table_name), id_col, key_cols)
+            new_dims.append(dim)
+            continue
+
+        if strategy == 'smart_key':
+            # dates already in the warehouse were left out by generate_date_ids
+            new_dims.append(dim)
+            continue
+
+        existing = fetch_dimension(conn, table_name)
+        next_id = next_free_id(existing, id_col)
+
+        if strategy == 'hierarchy':
+            mapping, new_members, _ = align_hierarchy(dim, existing, next_id)
+        else:
+            mapping, new_members, _ = align_dimension(dim, existing, id_col, key_cols, next_id)
+
+        for col in fact_cols:
+            fact[col] = as_ids(fact[col].map(mapping))
+
+        logger.info(f"{table_name}: {len(dim) - len(new_members)} existing members reused, {len(new_members)} new members")
+        new_dims.append(new_members)
+
+    # a record already in the warehouse (same dis_no) keeps its fact ID and replaces the earlier version
+    # (loaded with replace_existing), new records continue after the highest fact ID
+    existing_facts = pd.read_sql_query("SELECT dis_no, id::BIGINT AS id FROM fact_disasters WHERE dis_no = ANY(%(dis_nos)s);",
+                                       conn, params={'dis_nos': fact['dis_no'].dropna().astype(str).tolist()})
+    max_id = pd.read_sql_query("SELECT COALESCE(MAX(id::BIGINT), 0) AS max_id FROM fact_disasters;", conn)['max_id'].iloc[0]
+    fact_ids = fact['dis_no'].map(existing_facts.drop_duplicates(subset='dis_no').set_index('dis_no')['id'])
+    is_new = fact_ids.isna()
+    fact_ids[is_new] = fact.loc[is_new, 'id'] + int(max_id)
+    fact['id'] = fact_ids.astype('int64')
+    logger.info(f"fact_disasters: {int((~is_new).sum())} records replace their earlier version, {int(is_new.sum())} new records")
+
+    return (fact, *new_dims)
+
+
+def replaced_fact_groups(conn, fact):
+    """
+    Returns the agg_country_impacts groups the warehouse versions of the records the batch holds again (same dis_no)
+    are counted in, for refresh_country_impacts to recount along with the groups of the new facts. Read before the
+    load, which overwrites those facts under the same ID (replace_existing) in the fact load's own transaction.
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT id FROM fact_disasters WHERE dis_no = ANY(%(dis_nos)s);",
+                    {'dis_nos': fact['dis_no'].dropna().astype(str).tolist()})
+        replaced_ids = [row[0] for row in cur.fetchall()]
+    logger.info(f"{len(replaced_ids)} facts will be replaced by the batch")
+    return impact_groups(conn, replaced_ids)
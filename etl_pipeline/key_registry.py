@@ -0,0 +1,206 @@
+import logging
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+
+
+__all__ = [
+    'KeyRegistry',
+    'encode_natural_keys',
+]
+
+logger = logging.getLogger(__name__)
+
+KEY_BLOCK_SIZE = 1000  # IDs reserved from the warehouse at a time
+KEY_SEPARATOR = '\x1f'  # joins the columns of a natural key
+NULL_MARKER = '\x1e'  # stands for a missing value inside a natural key
+TOKEN_FILE = 'warehouse_token'  # token of the registry the on-disk cache was filled from
+
+
+# Encoding natural-key tuples as single strings
+###############################################
+def encode_natural_keys(df):
+    """
+    Joins the columns of each row into one string, the same way seed() does it in SQL,
+    so natural keys can be compared and stored as a single text column.
+    """
+    encoded = None
+    for col in df.columns:
+        values = df[col].astype(object).where(df[col].notna(), NULL_MARKER).astype(str)
+        encoded = values if encoded is None else encoded + KEY_SEPARATOR + values
+    return encoded.to_numpy()
+
+
+class KeyRegistry:
+    """
+    Durable mapping from natural-key tuples to surrogate IDs, kept per dimension in the warehouse
+    (key_registry) with a local on-disk cache in front of it.
+    Lookups are vectorized over all rows: cached keys first, then one bulk query for the rest,
+    and only keys the warehouse has never seen get new IDs, taken from blocks reserved in key_registry_blocks.
+    The cache is only used with the registry it was filled from (see check_cache).
+    """
+    def __init__(self, conn, cache_dir=os.getenv('KEY_REGISTRY_CACHE', '.key_registry'), block_size=KEY_BLOCK_SIZE):
+        self.conn = conn
+        self.cache_dir = cache_dir
+        self.block_size = block_size
+        self.keys = {}  # dimension -> Series of surrogate IDs indexed by natural key
+        self.blocks = {}  # dimension -> [next unused ID, end of reserved block)
+        self.token = self.create_tables()
+        self.check_cache()
+
+    def create_tables(self):
+        with self.conn.cursor() as cur:
+            cur.execute("""--sql
+                CREATE TABLE IF NOT EXISTS key_registry (
+                    dimension TEXT,
+                    natural_key TEXT,
+                    surrogate_id BIGINT NOT NULL,
+                    PRIMARY KEY (dimension, natural_key)
+                );
+                CREATE TABLE IF NOT EXISTS key_registry_blocks (
+                    dimension TEXT PRIMARY KEY,
+                    next_id BIGINT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS key_registry_token (
+                    single_row BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (single_row),
+                    token TEXT NOT NULL
+                );
+                INSERT INTO key_registry_token (token) VALUES (md5(random()::TEXT || clock_timestamp()::TEXT))
+                ON CONFLICT DO NOTHING;
+            """)
+            cur.execute("SELECT token FROM key_registry_token;")
+            token = cur.fetchone()[0]
+        self.conn.commit()
+        return token
+
+    def check_cache(self):
+        """
+        Drops the on-disk cache when it was filled from another registry (another warehouse, or this one since reset):
+        its IDs are not registered here and would be handed out again to other keys.
+        """
+        if not self.cache_dir or not os.path.isdir(self.cache_dir):
+            return
+        token_path = os.path.join(self.cache_dir, TOKEN_FILE)
+        cached_token = None
+        if os.path.exists(token_path):
+            with open(token_path) as f:
+                cached_token = f.read()
+        if cached_token != self.token:
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+            logger.warning(f"Key registry cache {self.cache_dir} belongs to another registry and was dropped")
+
+    def seed(self, dimension, table_name, id_col, key_cols):
+        """
+        Registers the members already in a dimension table the first time the dimension is used,
+        so rows loaded before the registry existed keep their IDs and new IDs start after them.
+        """
+        with self.conn.cursor() as cur:
+            cur.execute("SELECT 1 FROM key_registry_blocks WHERE dimension = %s;", (dimension,))
+            if cur.fetchone():
+                return
+
+            natural_key = sql.SQL("concat_ws({}, {})").format(
+                sql.Literal(KEY_SEPARATOR),
+                sql.SQL(', ').join(sql.SQL("COALESCE({}::TEXT, {})").format(sql.Identifier(col), sql.Literal(NULL_MARKER)) for col in key_cols)
+            )
+            cur.execute(sql.SQL("""--sql
+                INSERT INTO key_registry (dimension, natural_key, surrogate_id)
+                SELECT %(dimension)s, {natural_key}, MIN({id_col}::BIGINT) FROM {table} GROUP BY 2
+                ON CONFLICT DO NOTHING;
+                INSERT INTO key_registry_blocks (dimension, next_id)
+                SELECT %(dimension)s, COALESCE(MAX({id_col}::BIGINT), 0) + 1 FROM {table}
+                ON CONFLICT DO NOTHING;
+            """).format(natural_key=natural_key, id_col=sql.Identifier(id_col), table=sql.Identifier(table_name)),
+                {'dimension': dimension})
+        self.conn.commit()
+        logger.info(f"Key registry seeded for {dimension} from {table_name}")
+
+    def cache_path(self, dimension):
+        return os.path.join(self.cache_dir, f"{dimension}.pkl")
+
+    def load(self, dimension):
+        """
+        Returns the known keys of a dimension, reading the on-disk cache on first use.
+        IDs never change once handed out, so cached entries stay valid for as long as their registry does.
+        """
+        if dimension not in self.keys:
+            if self.cache_dir and os.path.exists(self.cache_path(dimension)):
+                self.keys[dimension] = pd.read_pickle(self.cache_path(dimension))
+            else:
+                self.keys[dimension] = pd.Series(dtype='int64', index=pd.Index([], dtype=object))
+        return self.keys[dimension]
+
+    def save(self, dimension):
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(os.path.join(self.cache_dir, TOKEN_FILE), 'w') as f:
+                f.write(self.token)
+            self.keys[dimension].to_pickle(self.cache_path(dimension))
+
+    def fetch(self, dimension, natural_keys):
+        """
+        Bulk-reads the warehouse IDs of the given natural keys in one query.
+        """
+        with self.conn.cursor() as cur:
+            cur.execute("""--sql
+                SELECT natural_key, surrogate_id FROM key_registry
+                WHERE dimension = %s AND natural_key = ANY(%s);
+            """, (dimension, list(natural_keys)))
+            rows = cur.fetchall()
+        return pd.Series([row[1] for row in rows], index=pd.Index([row[0] for row in rows], dtype=object), dtype='int64')
+
+    def reserve(self, dimension, count):
+        """
+        Hands out count new IDs, reserving a fresh block from the warehouse when the current one runs out.
+        """
+        next_id, end_id = self.blocks.get(dimension, (0, 0))
+        if end_id - next_id < count:
+            size = max(count, self.block_size)
+            with self.conn.cursor() as cur:
+                cur.execute("""--sql
+                    INSERT INTO key_registry_blocks (dimension, next_id) VALUES (%(dimension)s, 1 + %(size)s)
+                    ON CONFLICT (dimension) DO UPDATE SET next_id = key_registry_blocks.next_id + %(size)s
+                    RETURNING next_id - %(size)s;
+                """, {'dimension': dimension, 'size': size})
+                next_id = cur.fetchone()[0]
+            self.conn.commit()
+            end_id = next_id + size
+
+        self.blocks[dimension] = (next_id + count, end_id)
+        return np.arange(next_id, next_id + count, dtype='int64')
+
+    def register(self, dimension, natural_keys, ids):
+        """
+        Stores new mappings. A key registered concurrently by another run keeps that run's ID,
+        so the stored mappings are read back instead of trusting the IDs just reserved.
+        """
+        with self.conn.cursor() as cur:
+            execute_values(cur, """--sql
+                INSERT INTO key_registry (dimension, natural_key, surrogate_id) VALUES %s
+                ON CONFLICT DO NOTHING;
+            """, [(dimension, key, int(surrogate_id)) for key, surrogate_id in zip(natural_keys, ids)])
+        self.conn.commit()
+        return self.fetch(dimension, natural_keys)
+
+    def get_ids(self, dimension, keys_df):
+        """
+        Returns the durable surrogate ID of every row of keys_df (one column per natural-key part).
+        """
+        natural_keys = encode_natural_keys(keys_df)
+        unique_keys = pd.unique(natural_keys)
+        known = self.load(dimension)
+
+        missing = unique_keys[~pd.Index(unique_keys).isin(known.index)]
+        if len(missing):
+            known = pd.concat([known, self.fetch(dimension, missing)])
+            missing = missing[~pd.Index(missing).isin(known.index)]
+        if len(missing):
+            known = pd.concat([known, self.register(dimension, missing, self.reserve(dimension, len(missing)))])
+            logger.info(f"Key registry assigned {len(missing)} new IDs for {dimension}")
+
+        self.keys[dimension] = known
+        self.save(dimension)
+        return known.to_numpy()[known.index.get_indexer(natural_keys)]
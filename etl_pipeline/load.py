@@ -2,11 +2,26 @@ import psycopg2
 import logging
 import os
 import pandas as pd
+import numpy as np
 import re
+import io
+import itertools
+import time
 
 
 logger = logging.getLogger(__name__)
 
+# 'insert' uses executemany, 'copy' streams the DataFrame through COPY ... FROM STDIN
+LOAD_METHODS = ('insert', 'copy')
+COPY_CHUNK_SIZE = 10000  # rows rendered to CSV (or converted for executemany) at a time
+COPY_READ_SIZE = 65536  # characters handed to psycopg2 per read
+
+# Dates outside these bounds are treated as invalid when building dim_dates (None means today)
+DATE_DIMENSION_BOUNDS = ('1900-01-01', None)
+# 'range' fills dim_dates with every day between the first and last date, 'referenced' only with the dates the facts use
+DATE_DIMENSION_MODES = ('range', 'referenced')
+DATE_DIMENSION_CACHE = os.getenv('DATE_DIMENSION_CACHE', '.date_dimension.pkl')  # calendar attributes kept between runs
+
 
 # Connecting to PostgreSQL database
 ###################################
@@ -30,6 +45,138 @@ def connect_db(dbname):
         return None
 
 
+# Warehouse tables in creation order, dimensions first since fact_disasters references them
+#########################################################################################
+TABLE_DEFINITIONS = {
+    'dim_disaster_groups': """--sql
+    CREATE TABLE IF NOT EXISTS dim_disaster_groups (
+        id VARCHAR PRIMARY KEY,
+        name VARCHAR,
+        parent_id VARCHAR REFERENCES dim_disaster_groups(id)
+    );
+    """,
+    'dim_disaster_types': """--sql
+    CREATE TABLE IF NOT EXISTS dim_disaster_types (
+        id VARCHAR PRIMARY KEY,
+        name VARCHAR,
+        parent_id VARCHAR REFERENCES dim_disaster_types(id)
+    );
+    """,
+    'dim_disaster_names': """--sql
+    CREATE TABLE IF NOT EXISTS dim_disaster_names (
+        name_id VARCHAR PRIMARY KEY,
+        event_name VARCHAR
+    );
+    """,
+    'dim_locations': """--sql
+    CREATE TABLE IF NOT EXISTS dim_locations (
+        location_id VARCHAR PRIMARY KEY,
+        country VARCHAR,
+        ISO VARCHAR,
+        region VARCHAR,
+        continent VARCHAR,
+        location VARCHAR
+    );
+    """,
+    'dim_dates': """--sql
+    CREATE TABLE IF NOT EXISTS dim_dates (
+        date_id VARCHAR PRIMARY KEY,
+        date DATE,
+        year INTEGER,
+        quarter INTEGER,
+        month INTEGER,
+        iso_week INTEGER
+    );
+    ALTER TABLE dim_dates ADD COLUMN IF NOT EXISTS year INTEGER;
+    ALTER TABLE dim_dates ADD COLUMN IF NOT EXISTS quarter INTEGER;
+    ALTER TABLE dim_dates ADD COLUMN IF NOT EXISTS month INTEGER;
+    ALTER TABLE dim_dates ADD COLUMN IF NOT EXISTS iso_week INTEGER;
+    """,
+    'dim_associated_distructions': """--sql
+    CREATE TABLE IF NOT EXISTS dim_associated_distructions (
+        id VARCHAR PRIMARY KEY,
+        name VARCHAR,
+        parent_id VARCHAR REFERENCES dim_associated_distructions(id)
+    );
+    """,
+    'dim_ofda_responses': """--sql
+    CREATE TABLE IF NOT EXISTS dim_ofda_responses (
+        OFDA_resp_id VARCHAR PRIMARY KEY,
+        ofda_response VARCHAR
+    );
+    """,
+    'dim_appeals': """--sql
+    CREATE TABLE IF NOT EXISTS dim_appeals (
+        appeal_id VARCHAR PRIMARY KEY,
+        appeal VARCHAR
+    );
+    """,
+    'dim_declarations': """--sql
+    CREATE TABLE IF NOT EXISTS dim_declarations (
+        declaration_id VARCHAR PRIMARY KEY,
+        declaration VARCHAR
+    );
+    """,
+    'dim_mag_scales': """--sql
+    CREATE TABLE IF NOT EXISTS dim_mag_scales (
+        dis_mag_scale_id VARCHAR PRIMARY KEY,
+        dis_mag_scale VARCHAR
+    );
+    """,
+    'dim_adm_levels': """--sql
+    CREATE TABLE IF NOT EXISTS dim_adm_levels (
+        adm_level_id VARCHAR PRIMARY KEY,
+        adm_level VARCHAR
+    );
+    """,
+    'dim_disasters_origin': """--sql
+    CREATE TABLE IF NOT EXISTS dim_disasters_origin (
+        origin_id VARCHAR PRIMARY KEY,
+        origin VARCHAR
+    );
+    """,
+    'fact_disasters': """--sql
+    CREATE TABLE IF NOT EXISTS fact_disasters (
+        id VARCHAR PRIMARY KEY ,
+        dis_no VARCHAR,
+        seq BIGINT,
+        glide VARCHAR,
+        aid_contribution BIGINT,
+        dis_mag_value BIGINT,
+        total_deaths BIGINT,
+        no_injured BIGINT,
+        no_affected BIGINT,
+        no_homeless BIGINT,
+        total_affected BIGINT,
+        insured_damages DOUBLE PRECISION,
+        total_damages DOUBLE PRECISION,
+        cpi DOUBLE PRECISION,
+        extraction_time DATE,
+        duration_days BIGINT,
+        type_id VARCHAR REFERENCES dim_disaster_types(id),
+        group_id VARCHAR REFERENCES dim_disaster_groups(id),
+        associated_dis_id VARCHAR REFERENCES dim_associated_distructions(id),
+        location_id VARCHAR REFERENCES dim_locations(location_id),
+        name_id VARCHAR REFERENCES dim_disaster_names(name_id),
+        OFDA_resp_id VARCHAR REFERENCES dim_ofda_responses(OFDA_resp_id),
+        appeal_id VARCHAR REFERENCES dim_appeals(appeal_id),
+        declaration_id VARCHAR REFERENCES dim_declarations(declaration_id),
+        dis_mag_scale_id VARCHAR REFERENCES dim_mag_scales(dis_mag_scale_id),
+        adm_level_id VARCHAR REFERENCES dim_adm_levels(adm_level_id),
+        origin_id VARCHAR REFERENCES dim_disasters_origin(origin_id),
+        starting_date_id VARCHAR REFERENCES dim_dates(date_id),
+        ending_date_id VARCHAR REFERENCES dim_dates(date_id),
+        latitude DOUBLE PRECISION,
+        longitude DOUBLE PRECISION
+    );
+    ALTER TABLE fact_disasters ADD COLUMN IF NOT EXISTS dis_no VARCHAR;
+    CREATE INDEX IF NOT EXISTS fact_disasters_dis_no ON fact_disasters (dis_no);
+    ALTER TABLE fact_disasters ADD COLUMN IF NOT EXISTS latitude DOUBLE PRECISION;
+    ALTER TABLE fact_disasters ADD COLUMN IF NOT EXISTS longitude DOUBLE PRECISION;
+    """,
+}
+
+
 def create_disaster_tables(conn):
     if conn is None:
         logging.error("Connection is None. Cannot create tables.")
@@ -39,207 +186,13 @@ def create_disaster_tables(conn):
     try:
         cur = conn.cursor()
 
-        # dim_disaster_groups
-        try:
-            logging.info("Creating table: dim_disaster_groups")
-            cur.execute("""--sql
-            CREATE TABLE IF NOT EXISTS dim_disaster_groups (
-                id VARCHAR PRIMARY KEY,
-                name VARCHAR,
-                parent_id VARCHAR REFERENCES dim_disaster_groups(id)
-            );
-            """)
-            logging.info("Table dim_disaster_groups created successfully.")
-        except Exception as e:
-            logging.error(f"Error creating dim_disaster_groups: {e}")
-
-        # dim_disaster_types
-        try:
-            logging.info("Creating table: dim_disaster_types")
-            cur.execute("""--sql
-            CREATE TABLE IF NOT EXISTS dim_disaster_types (
-                id VARCHAR PRIMARY KEY,
-                name VARCHAR,
-                parent_id VARCHAR REFERENCES dim_disaster_types(id)
-            );
-            """)
-            logging.info("Table dim_disaster_types created successfully.")
-        except Exception as e:
-            logging.error(f"Error creating dim_disaster_types: {e}")
-
-        # dim_disaster_names
-        try:
-            logging.info("Creating table: dim_disaster_names")
-            cur.execute("""--sql
-            CREATE TABLE IF NOT EXISTS dim_disaster_names (
-                name_id VARCHAR PRIMARY KEY,
-                event_name VARCHAR
-            );
-            """)
-            logging.info("Table dim_disaster_names created successfully.")
-        except Exception as e:
-            logging.error(f"Error creating dim_disaster_names: {e}")
-
-        # dim_locations
-        try:
-            logging.info("Creating table: dim_locations")
-            cur.execute("""--sql
-            CREATE TABLE IF NOT EXISTS dim_locations (
-                location_id VARCHAR PRIMARY KEY,
-                country VARCHAR,
-                ISO VARCHAR,
-                region VARCHAR,
-                continent VARCHAR,
-                location VARCHAR
-            );
-            """)
-            logging.info("Table dim_locations created successfully.")
-        except Exception as e:
-            logging.error(f"Error creating dim_locations: {e}")
-
-        # dim_dates
-        try:
-            logging.info("Creating table: dim_dates")
-            cur.execute("""--sql
-            CREATE TABLE IF NOT EXISTS dim_dates (
-                date_id VARCHAR PRIMARY KEY,
-                date DATE
-            );
-            """)
-            logging.info("Table dim_dates created successfully.")
-        except Exception as e:
-            logging.error(f"Error creating dim_dates: {e}")
-
-        # dim_associated_distructions
-        try:
-            logging.info("Creating table: dim_associated_distructions")
-            cur.execute("""--sql
-            CREATE TABLE IF NOT EXISTS dim_associated_distructions (
-                id VARCHAR PRIMARY KEY,
-                name VARCHAR,
-                parent_id VARCHAR REFERENCES dim_associated_distructions(id)
-            );
-            """)
-            logging.info("Table dim_associated_distructions created successfully.")
-        except Exception as e:
-            logging.error(f"Error creating dim_associated_distructions: {e}")
-
-        # dim_ofda_responses
-        try:
-            logging.info("Creating table: dim_ofda_responses")
-            cur.execute("""--sql
-            CREATE TABLE IF NOT EXISTS dim_ofda_responses (
-                OFDA_resp_id VARCHAR PRIMARY KEY,
-                ofda_response VARCHAR
-            );
-            """)
-            logging.info("Table dim_ofda_responses created successfully.")
-        except Exception as e:
-            logging.error(f"Error creating dim_ofda_responses: {e}")
-
-        # dim_appeals
-        try:
-            logging.info("Creating table: dim_appeals")
-            cur.execute("""--sql
-            CREATE TABLE IF NOT EXISTS dim_appeals (
-                appeal_id VARCHAR PRIMARY KEY,
-                appeal VARCHAR
-            );
-            """)
-            logging.info("Table dim_appeals created successfully.")
-        except Exception as e:
-            logging.error(f"Error creating dim_appeals: {e}")
-
-        # dim_declarations
-        try:
-            logging.info("Creating table: dim_declarations")
-            cur.execute("""--sql
-            CREATE TABLE IF NOT EXISTS dim_declarations (
-                declaration_id VARCHAR PRIMARY KEY,
-                declaration VARCHAR
-            );
-            """)
-            logging.info("Table dim_declarations created successfully.")
-        except Exception as e:
-            logging.error(f"Error creating dim_declarations: {e}")
-
-        # dim_mag_scales
-        try:
-            logging.info("Creating table: dim_mag_scales")
-            cur.execute("""--sql
-            CREATE TABLE IF NOT EXISTS dim_mag_scales (
-                dis_mag_scale_id VARCHAR PRIMARY KEY,
-                dis_mag_scale VARCHAR
-            );
-            """)
-            logging.info("Table dim_mag_scales created successfully.")
-        except Exception as e:
-            logging.error(f"Error creating dim_mag_scales: {e}")
-
-        # dim_adm_levels
-        try:
-            logging.info("Creating table: dim_adm_levels")
-            cur.execute("""--sql
-            CREATE TABLE IF NOT EXISTS dim_adm_levels (
-                adm_level_id VARCHAR PRIMARY KEY,
-                adm_level VARCHAR
-            );
-            """)
-            logging.info("Table dim_adm_levels created successfully.")
-        except Exception as e:
-            logging.error(f"Error creating dim_adm_levels: {e}")
-
-        # dim_disasters_origin
-        try:
-            logging.info("Creating table: dim_disasters_origin")
-            cur.execute("""--sql
-            CREATE TABLE IF NOT EXISTS dim_disasters_origin (
-                origin_id VARCHAR PRIMARY KEY,
-                origin VARCHAR
-            );
-            """)
-            logging.info("Table dim_disasters_origin created successfully.")
-        except Exception as e:
-            logging.error(f"Error creating dim_disasters_origin: {e}")
-
-        # fact_disasters
-        try:
-            logging.info("Creating table: fact_disasters")
-            cur.execute(""" --sql
-                CREATE TABLE IF NOT EXISTS fact_disasters (
-                id VARCHAR PRIMARY KEY ,
-                seq BIGINT,
-                glide VARCHAR,
-                aid_contribution BIGINT,
-                dis_mag_value BIGINT,
-                total_deaths BIGINT,
-                no_injured BIGINT,
-                no_affected BIGINT,
-                no_homeless BIGINT,
-                total_affected BIGINT,
-                insured_damages DOUBLE PRECISION,
-                total_damages DOUBLE PRECISION,
-                cpi DOUBLE PRECISION,
-                extraction_time DATE,
-                duration_days BIGINT,
-                type_id VARCHAR REFERENCES dim_disaster_types(id),
-                group_id VARCHAR REFERENCES dim_disaster_groups(id),
-                associated_dis_id VARCHAR REFERENCES dim_associated_distructions(id),
-                location_id VARCHAR REFERENCES dim_locations(location_id),
-                name_id VARCHAR REFERENCES dim_disaster_names(name_id),
-                OFDA_resp_id VARCHAR REFERENCES dim_ofda_responses(OFDA_resp_id),
-                appeal_id VARCHAR REFERENCES dim_appeals(appeal_id),
-                declaration_id VARCHAR REFERENCES dim_declarations(declaration_id),
-                dis_mag_scale_id VARCHAR REFERENCES dim_mag_scales(dis_mag_scale_id),
-                adm_level_id VARCHAR REFERENCES dim_adm_levels(adm_level_id),
-                origin_id VARCHAR REFERENCES dim_disasters_origin(origin_id),
-                starting_date_id VARCHAR REFERENCES dim_dates(date_id),
-                ending_date_id VARCHAR REFERENCES dim_dates(date_id)
-            );
-            """)
-            logging.info("Table fact_disasters created successfully.")
-        except Exception as e:
-            logging.error(f"Error creating fact_disasters: {e}")
+        for table_name, create_table_query in TABLE_DEFINITIONS.items():
+            try:
+                logging.info(f"Creating table: {table_name}")
+                cur.execute(create_table_query)
+                logging.info(f"Table {table_name} created successfully.")
+            except Exception as e:
+                logging.error(f"Error creating {table_name}: {e}")
 
         conn.commit()
         logging.info("All tables created successfully.")
@@ -253,6 +206,18 @@ def create_disaster_tables(conn):
         if cur is not None:
             cur.close()
 
+
+def count_facts(conn):
+    """
+    Returns the number of rows in fact_disasters, 0 if the table does not exist (e.g. a new or reset warehouse).
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('fact_disasters') IS NOT NULL;")
+        if not cur.fetchone()[0]:
+            return 0
+        cur.execute("SELECT COUNT(*) FROM fact_disasters;")
+        return cur.fetchone()[0]
+
 # # Function to get data from PostgreSQL and load into a pandas DataFrame
 # #######################################################################
 # def get_data_from_db(query,conn):
@@ -276,106 +241,204 @@ def create_disaster_tables(conn):
 #         conn.close()
 
 
+# Numbering the members of a column, straight from the category codes for category columns
+###########################################################################################
+def member_codes(values):
+    """
+    Like pd.factorize(values, use_na_sentinel=False): the code of every row (missing values included as a member)
+    in order of first appearance, and the members. Category columns are numbered from their category codes
+    instead of hashing the values again.
+    """
+    if not isinstance(values.dtype, pd.CategoricalDtype):
+        return pd.factorize(values, use_na_sentinel=False)
+
+    category_codes = values.cat.codes.to_numpy()
+    present, first_rows = np.unique(category_codes, return_index=True)
+    present = present[np.argsort(first_rows)]
+    # code -1 (missing) takes the last slot, after the categories
+    numbering = np.empty(len(values.cat.categories) + 1, dtype=np.intp)
+    numbering[present] = np.arange(len(present))
+    members = np.append(values.cat.categories.to_numpy(dtype=object), np.nan)[present]
+    return numbering[category_codes], members
+
+
+def drop_columns(df, columns):
+    """
+    Like df.drop(columns=columns), but the returned frame shares the remaining columns with df instead of copying them,
+    so splitting a dimension off a large frame does not hold the frame twice.
+    """
+    return pd.DataFrame({col: df[col].array for col in df.columns if col not in columns}, index=df.index, copy=False)
+
+
 # Function to create a hierarchy of groups and subgroups and Subsubgroups... 
 ############################################################################
 def create_hierarchy(df, level_cols, id_col_name):
     """
     Create a hierarchy of groups and subgroups with incremental IDs, and add the the Ids to the original DataFrame.
+    Each level is factorized in a single pass: IDs follow the order of first appearance level by level,
+    the parent of a value is the ID of the previous level on the first row where the value appears,
+    and every row keeps the ID of its deepest non-null level.
     """
-    hierarchy = pd.DataFrame(columns=['id', 'name', 'parent_id'])
+    levels = []
     current_id = 1
-    
-    parent_ids = {}  # A dictionary to keep track of parent IDs for each group level
+    row_ids = np.zeros(len(df), dtype=np.int64)
+    has_id = np.zeros(len(df), dtype=bool)
+    parent_row_ids = None
 
-    df[id_col_name] = None
-    
     for i, level in enumerate(level_cols):
-        unique_values = df[level].unique()
-        
-        for value in unique_values:
-            #  parent ID (if it's not the first level)
-            if i > 0:
-                # checking if there is a matching parent in the previous level
-                parent_row = df[df[level] == value]
-                if len(parent_row) > 0:
-                    parent_value = parent_row[level_cols[i-1]].values[0]
-                    parent_id = parent_ids.get(parent_value, None)
-                else:
-                    parent_id = None  # No matching parent found
-            else:
-                parent_id = None  # First level has no parent
-     
-            hierarchy = pd.concat([hierarchy, pd.DataFrame({
-                'id': [current_id],
-                'name': [value],
-                'parent_id': [parent_id]
-            })], ignore_index=True)
-            
-            parent_ids[value] = current_id
-            df.loc[df[level] == value, id_col_name] = current_id
-            
-            current_id += 1
-    df = df.drop(columns=level_cols)
+        codes, uniques = member_codes(df[level])
+        level_row_ids = codes + current_id
+
+        #  parent ID (if it's not the first level), taken from the first row holding each value
+        if i > 0:
+            first_rows = np.unique(codes, return_index=True)[1]
+            parent_id = parent_row_ids[first_rows].astype(object)
+            parent_id[pd.isna(uniques)] = None  # missing values never match a parent row
+        else:
+            parent_id = np.full(len(uniques), None, dtype=object)  # First level has no parent
+
+        levels.append(pd.DataFrame({
+            'id': np.arange(current_id, current_id + len(uniques), dtype=object),
+            'name': np.asarray(uniques, dtype=object),
+            'parent_id': parent_id
+        }))
+
+        # rows only take the ID of a level where they hold a value
+        has_value = df[level].notna().to_numpy()
+        row_ids[has_value] = level_row_ids[has_value]
+        has_id |= has_value
+
+        parent_row_ids = level_row_ids
+        current_id += len(uniques)
+
+    hierarchy = pd.concat(levels, ignore_index=True)
+    df[id_col_name] = pd.arrays.IntegerArray(row_ids, ~has_id)
+    df = drop_columns(df, level_cols)
     return hierarchy, df
 
 
-# Function to generate all dates between the starting date and ending date
-##########################################################################
-def generate_date_ids(df, start_date_col, end_date_col, id_name='date_id'):
+# Function to compute YYYYMMDD smart keys for dates
+####################################################
+def date_key(dates):
     """
-    Generates incremental IDs for all dates between the minimum and maximum dates 
-    found in the starting_date and ending_date columns, updates the original DataFrame 
-    to replace dates with their corresponding IDs, and creates a new DataFrame with 
-    all unique dates and their IDs.
+    Computes the integer YYYYMMDD key of every date arithmetically, NaT gives <NA>.
     """
-    # Convert date columns to datetime, handling invalid parsing as NaT
-    df[start_date_col] = pd.to_datetime(df[start_date_col], errors='coerce')
-    df[end_date_col] = pd.to_datetime(df[end_date_col], errors='coerce')
-    
-    # Determine the min and max dates
-    min_date = min(df[start_date_col].min(), df[end_date_col].min())
-    max_date = max(df[start_date_col].max(), df[end_date_col].max())
+    dates = pd.to_datetime(dates, errors='coerce')
+    if isinstance(dates, pd.Series):
+        keys = dates.dt.year * 10000 + dates.dt.month * 100 + dates.dt.day
+    else:
+        keys = pd.Series(dates.year * 10000 + dates.month * 100 + dates.day)
+    return keys.astype('Int64')
 
-    # Create a DataFrame with all dates in the range
-    all_dates = pd.date_range(start=min_date, end=max_date, freq='D').to_frame(name='date')
 
-    # Create the date_dimension DataFrame with IDs
-    date_dimension = all_dates.reset_index(drop=True)
-    date_dimension[id_name] = range(1, len(date_dimension) + 1)
-    date_dimension[id_name] = date_dimension[id_name].astype(int)
-    
-    # Merge date IDs into the original DataFrame for start_date_col
-    df = pd.merge(df, date_dimension, left_on=start_date_col, right_on='date', how='left')
-    df = df.rename(columns={id_name: f'{start_date_col}_id'}).drop(columns='date')
-    
-    # Merge date IDs into the original DataFrame for end_date_col
-    df = pd.merge(df, date_dimension, left_on=end_date_col, right_on='date', how='left')
-    df = df.rename(columns={id_name: f'{end_date_col}_id'}).drop(columns='date')
-    
+# Function to get calendar attributes of dates, computed once and cached between runs
+######################################################################################
+def calendar_attributes(dates, cache_path=DATE_DIMENSION_CACHE):
+    """
+    Returns the key, year, quarter, month and ISO week of the given dates (indexed by date).
+    Attributes of dates seen before are read from the on-disk cache, only new dates are computed.
+    """
+    dates = pd.DatetimeIndex(dates).dropna().unique().sort_values()
+
+    if cache_path and os.path.exists(cache_path):
+        calendar = pd.read_pickle(cache_path)
+    else:
+        calendar = pd.DataFrame(columns=['date_key', 'year', 'quarter', 'month', 'iso_week'], index=pd.DatetimeIndex([], name='date'))
+
+    new_dates = dates.difference(calendar.index)
+    if len(new_dates):
+        new_calendar = pd.DataFrame({
+            'date_key': date_key(new_dates).to_numpy(),
+            'year': new_dates.year,
+            'quarter': new_dates.quarter,
+            'month': new_dates.month,
+            'iso_week': new_dates.isocalendar()['week'].to_numpy(),
+        }, index=new_dates.rename('date')).astype('int64')
+        calendar = pd.concat([calendar, new_calendar]).sort_index() if len(calendar) else new_calendar
+        if cache_path:
+            calendar.to_pickle(cache_path)
+
+    return calendar.loc[dates].rename_axis('date')
+
+
+# Function to generate the date dimension and replace dates with their IDs
+###########################################################################
+def generate_date_ids(df, start_date_col, end_date_col, id_name='date_id', mode='range', bounds=DATE_DIMENSION_BOUNDS, existing_ids=None):
+    """
+    Replaces the starting and ending dates with integer YYYYMMDD keys and builds the date dimension.
+    mode='range' keeps every day between the minimum and maximum dates, mode='referenced' only the dates
+    the rows use. Dates outside bounds are treated as invalid, so one outlier cannot blow up the range.
+    Keys in existing_ids (dates already in dim_dates) are left out of the returned dimension.
+    Rows whose start or end date is missing or invalid are dropped (and counted in a warning).
+    """
+    if mode not in DATE_DIMENSION_MODES:
+        raise ValueError(f"Unknown date dimension mode '{mode}', expected one of {DATE_DIMENSION_MODES}")
+    lower, upper = [pd.Timestamp(bound) if bound is not None else pd.Timestamp.today().normalize() for bound in bounds]
+
+    # Convert date columns to datetime, handling invalid parsing and out of bounds dates as NaT
+    for col in (start_date_col, end_date_col):
+        df[col] = pd.to_datetime(df[col], errors='coerce')
+        df[col] = df[col].where(df[col].between(lower, upper))
+
+    # Smart keys come straight from the dates, no merge with the dimension needed
+    df[f'{start_date_col}_id'] = date_key(df[start_date_col])
+    df[f'{end_date_col}_id'] = date_key(df[end_date_col])
+
     # Drop rows where IDs are NaN
+    row_count = len(df)
     df = df.dropna(subset=[f'{start_date_col}_id', f'{end_date_col}_id'])
+    if len(df) < row_count:
+        logger.warning(f"Dropped {row_count - len(df)} of {row_count} rows without a valid {start_date_col} and {end_date_col} "
+                       f"(missing, impossible or outside {lower.date()} - {upper.date()})")
     
     # Ensure IDs are integers
     df[f'{start_date_col}_id'] = df[f'{start_date_col}_id'].astype(int)
     df[f'{end_date_col}_id'] = df[f'{end_date_col}_id'].astype(int)
-    
-    return df, date_dimension
+
+    referenced = pd.concat([df[start_date_col], df[end_date_col]])
+    if mode == 'referenced':
+        dates = referenced.unique()
+    elif referenced.empty:
+        dates = []
+    else:
+        dates = pd.date_range(start=referenced.min(), end=referenced.max(), freq='D')
+
+    date_dimension = calendar_attributes(dates).reset_index().rename(columns={'date_key': id_name})
+    date_dimension = date_dimension[['date', id_name, 'year', 'quarter', 'month', 'iso_week']]
+
+    # Dates already in the warehouse are only ever appended to, never regenerated
+    if existing_ids is not None:
+        date_dimension = date_dimension[~date_dimension[id_name].isin(pd.to_numeric(pd.Series(list(existing_ids))))]
+
+    return df, date_dimension.reset_index(drop=True)
 
 # Function to generate incremental ID for specified columns and new dimensions
 ##############################################################################
-def create_incremental_ids(df, column_names, id_column_name):
+def create_incremental_ids(df, column_names, id_column_name, registry=None):
     """
     This function generates incremental IDs for unique combinations of values across multiple columns in a DataFrame
     and ensures the IDs appear as the first column in the unique_combinations DataFrame.
+    With a KeyRegistry the IDs are the durable ones registered for the combinations instead of 1..n for this batch.
     """
-    unique_combinations = df[column_names].drop_duplicates().reset_index(drop=True)
-    unique_combinations[id_column_name] = range(1, len(unique_combinations) + 1)
-    
-    unique_combinations = unique_combinations[[id_column_name] + [col for col in unique_combinations.columns if col != id_column_name]]
-    df = pd.merge(df, unique_combinations, on=column_names, how='left')
-    
-    df = df.drop(columns=column_names)
-    
+    # one code per combination (in order of first appearance) built from the member codes of the columns,
+    # the same combinations and order as drop_duplicates
+    combination, _ = member_codes(df[column_names[0]])
+    for column in column_names[1:]:
+        codes, members = member_codes(df[column])
+        combination, _ = pd.factorize(combination * len(members) + codes)
+    first_rows = np.unique(combination, return_index=True)[1]
+
+    unique_combinations = df[column_names].iloc[first_rows].reset_index(drop=True)
+    if registry is None:
+        ids = np.arange(1, len(unique_combinations) + 1)
+    else:
+        ids = np.asarray(registry.get_ids(id_column_name, unique_combinations))
+    unique_combinations.insert(0, id_column_name, ids)
+
+    df = drop_columns(df, column_names)
+    df.index = pd.RangeIndex(len(df))
+    df[id_column_name] = ids[combination]
+
     return df, unique_combinations
 
 
@@ -392,54 +455,189 @@ def add_id_column(df, id_column_name='id'):
 
 # this function will take a dataframe and start spiltting it into the wanted dimensions
 #######################################################################################
-def generate_dimensions(df):
+def generate_dimensions(df, registry=None, date_mode='range', existing_date_ids=None):
     df=add_id_column(df,'id')
     dim_disaster_types, df = create_hierarchy(df, ['disaster_type', 'disaster_subtype', 'disaster_subsubtype'],'type_id')
     dim_disaster_groups ,df= create_hierarchy(df,['disaster_group', 'disaster_subgroup'],'group_id')
     dim_associated_distructions, df=create_hierarchy(df,['associated_dis', 'associated_dis2'],'associated_dis_id')
     
-    df, dim_locations=create_incremental_ids(df,['country', 'iso', 'region', 'continent', 'location'],'location_id')
-    df, dim_disaster_names=create_incremental_ids(df,['event_name'],'name_id')
-    df, dim_ofda_responses=create_incremental_ids(df,['ofda_response'],'ofda_resp_id')
-    df, dim_appeals=create_incremental_ids(df,['appeal'],'appeal_id')
-    df, dim_declarations=create_incremental_ids(df,['declaration'],'declaration_id')
-    df, dim_mag_scales=create_incremental_ids(df,['dis_mag_scale'],'dis_mag_scale_id')
-    df, dim_adm_levels=create_incremental_ids(df,['adm_level'],'adm_level_id')
-    df, dim_disasters_origin=create_incremental_ids(df,['origin'],'origin_id')
-    df, dim_dates=generate_date_ids(df,'starting_date','ending_date','date_id')
+    df, dim_locations=create_incremental_ids(df,['country', 'iso', 'region', 'continent', 'location'],'location_id',registry)
+    df, dim_disaster_names=create_incremental_ids(df,['event_name'],'name_id',registry)
+    df, dim_ofda_responses=create_incremental_ids(df,['ofda_response'],'ofda_resp_id',registry)
+    df, dim_appeals=create_incremental_ids(df,['appeal'],'appeal_id',registry)
+    df, dim_declarations=create_incremental_ids(df,['declaration'],'declaration_id',registry)
+    df, dim_mag_scales=create_incremental_ids(df,['dis_mag_scale'],'dis_mag_scale_id',registry)
+    df, dim_adm_levels=create_incremental_ids(df,['adm_level'],'adm_level_id',registry)
+    df, dim_disasters_origin=create_incremental_ids(df,['origin'],'origin_id',registry)
+    df, dim_dates=generate_date_ids(df,'starting_date','ending_date','date_id',date_mode,existing_ids=existing_date_ids)
     return df, dim_disaster_types, dim_disaster_groups, dim_associated_distructions, dim_locations, dim_disaster_names, dim_ofda_responses, dim_appeals, dim_declarations, dim_mag_scales, dim_adm_levels,dim_disasters_origin,dim_dates
 
 
-def load_dataframe_to_db(df, table_name, conn):
+# Columns generate_dimensions turns into dimension IDs, plus dis_no that incremental loads match records on
+DIMENSION_INPUT_COLUMNS = ['disaster_type', 'disaster_subtype', 'disaster_subsubtype', 'disaster_group', 'disaster_subgroup',
+                           'associated_dis', 'associated_dis2', 'country', 'iso', 'region', 'continent', 'location',
+                           'event_name', 'ofda_response', 'appeal', 'declaration', 'dis_mag_scale', 'adm_level', 'origin',
+                           'starting_date', 'ending_date', 'dis_no']
+
+
+# Splitting a stream of transformed chunks: only the dimension inputs are held, the other columns go straight to the fact load
+###############################################################################################################################
+def dimension_inputs(chunk):
+    # the columns of a transformed chunk generate_dimensions needs
+    return chunk[[col for col in DIMENSION_INPUT_COLUMNS if col in chunk.columns]]
+
+
+def iter_fact_chunks(fact_keys, chunks):
+    """
+    Yields fact_disasters chunk by chunk. fact_keys are the fact rows generate_dimensions made of the dimension inputs
+    of a batch (indexed by the position of their row in the batch), chunks the transformed chunks of the batch read again
+    in the same order: the other columns of every chunk are joined to its fact rows. Rows generate_dimensions dropped
+    (no valid dates) are left out.
+    """
+    offset = 0
+    for chunk in chunks:
+        start, stop = fact_keys.index.searchsorted([offset, offset + len(chunk)])
+        measures = chunk.drop(columns=DIMENSION_INPUT_COLUMNS, errors='ignore')
+        measures.index = pd.RangeIndex(offset, offset + len(chunk))
+        offset += len(chunk)
+        if stop > start:
+            yield fact_keys.iloc[start:stop].join(measures)
+
+
+# Streaming a DataFrame to COPY one chunk of rows at a time
+###########################################################
+class DataFrameCSVStream(io.TextIOBase):
+    """
+    Read-only file-like object that renders a DataFrame, or a stream of DataFrames with the same columns
+    (e.g. from iter_fact_chunks), as CSV text chunk by chunk for COPY ... FROM STDIN.
+    Only one chunk of rows is ever held as text, so memory stays capped by chunk_size whatever the table size.
+    Missing values (None, NaN, NaT) are written as empty fields, which COPY reads as NULL.
+    """
+    def __init__(self, df, chunk_size=COPY_CHUNK_SIZE):
+        self.frames = iter([df] if isinstance(df, pd.DataFrame) else df)
+        self.df = None
+        self.chunk_size = chunk_size
+        self.position = 0
+        self.rows = 0
+        self.buffer = io.StringIO()
+
+    def readable(self):
+        return True
+
+    def next_chunk(self):
+        # the next chunk_size rows of the current frame, moving on to the next frame once it is rendered (None at the end)
+        while self.df is None or self.position >= len(self.df):
+            self.df = next(self.frames, None)
+            self.position = 0
+            if self.df is None:
+                return None
+
+        chunk = self.df.iloc[self.position:self.position + self.chunk_size]
+        self.position += self.chunk_size
+        self.rows += len(chunk)
+
+        # whole-number floats (e.g. ids that went through a merge with NaN) are written without '.0' for BIGINT columns
+        integral = [col for col in chunk.select_dtypes('float').columns if (chunk[col].dropna() % 1 == 0).all()]
+        if integral:
+            chunk = chunk.astype({col: 'Int64' for col in integral})
+
+        return io.StringIO(chunk.to_csv(header=False, index=False, na_rep=''))
+
+    def read(self, size=-1):
+        data = self.buffer.read(size)
+        while size < 0 or len(data) < size:
+            buffer = self.next_chunk()
+            if buffer is None:
+                break
+            self.buffer = buffer
+            data += self.buffer.read(size - len(data) if size >= 0 else -1)
+        return data
+
+
+def primary_key_columns(cursor, table_name):
+    # names of the primary key columns of the table
+    cursor.execute("""--sql
+        SELECT a.attname FROM pg_index i
+        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+        WHERE i.indrelid = %s::regclass AND i.indisprimary;
+    """, (table_name,))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def load_dataframe_to_db(df, table_name, conn, method='insert', chunk_size=COPY_CHUNK_SIZE, skip_existing=False, replace_existing=False):
     """
     Load a DataFrame into a specified table in the database using psycopg2, 
     handling special characters in column names by sanitizing them.
+    method='insert' sends the rows with executemany, method='copy' streams them through COPY ... FROM STDIN,
+    both in chunks of chunk_size rows.
+    skip_existing=True leaves rows whose primary key is already in the table untouched (ON CONFLICT DO NOTHING),
+    replace_existing=True overwrites them with the new values (ON CONFLICT ... DO UPDATE) in the same transaction.
     """
-    if df.empty:
+    if method not in LOAD_METHODS:
+        raise ValueError(f"Unknown load method '{method}', expected one of {LOAD_METHODS}")
+
+    # a DataFrame or a stream of DataFrames with the same columns (e.g. from iter_fact_chunks), loaded in one transaction
+    frames = iter([df] if isinstance(df, pd.DataFrame) else df)
+    first = next((frame for frame in frames if not frame.empty), None)
+    if first is None:
         logging.warning(f"No data to load for table: {table_name}")
         return
+    frames = itertools.chain([first], frames)
 
     try:
         # Create a cursor object
         cursor = conn.cursor()
 
         # Sanitize column names: replace invalid characters with underscores
-        df.columns = [re.sub(r"[^\w]", "_", col) for col in df.columns]
+        column_names = [re.sub(r"[^\w]", "_", col) for col in first.columns]
 
         # Generate SQL query
-        columns = ', '.join([f'"{col}"' for col in df.columns])  # Add double quotes around column names
-        values = ', '.join(['%s'] * len(df.columns))
-        insert_query = f"INSERT INTO {table_name} ({columns}) VALUES ({values})"
-
-        # Convert DataFrame rows to list of tuples
-        data = [tuple(row) for row in df.to_numpy()]
-
-        # Execute batch insert
-        cursor.executemany(insert_query, data)
+        columns = ', '.join([f'"{col}"' for col in column_names])  # Add double quotes around column names
+        start = time.perf_counter()
+
+        on_conflict = ''
+        if replace_existing:
+            keys = primary_key_columns(cursor, table_name)
+            updates = ', '.join(f'"{col}" = EXCLUDED."{col}"' for col in column_names if col.lower() not in keys)
+            on_conflict = f" ON CONFLICT ({', '.join(keys)}) DO UPDATE SET {updates}"
+        elif skip_existing:
+            on_conflict = " ON CONFLICT DO NOTHING"
+
+        if method == 'copy':
+            # COPY cannot handle conflicts, so it goes through a temporary table first
+            copy_table = f"{table_name}_copy" if on_conflict else table_name
+            if on_conflict:
+                cursor.execute(f"CREATE TEMP TABLE {copy_table} (LIKE {table_name}) ON COMMIT DROP")
+
+            # Stream the rows as CSV, empty unquoted fields are NULL
+            copy_query = f"COPY {copy_table} ({columns}) FROM STDIN WITH (FORMAT CSV, NULL '')"
+            stream = DataFrameCSVStream(frames, chunk_size)
+            cursor.copy_expert(copy_query, stream, size=COPY_READ_SIZE)
+            rows = stream.rows
+
+            if on_conflict:
+                cursor.execute(f"INSERT INTO {table_name} ({columns}) SELECT {columns} FROM {copy_table}{on_conflict}")
+        else:
+            values = ', '.join(['%s'] * len(column_names))
+            insert_query = f"INSERT INTO {table_name} ({columns}) VALUES ({values}){on_conflict}"
+
+            rows = 0
+            for frame in frames:
+                for position in range(0, len(frame), chunk_size):
+                    chunk = frame.iloc[position:position + chunk_size]
+
+                    # Convert DataFrame rows to list of tuples, with None for every missing value (NaN, NaT, pd.NA)
+                    data = [tuple(row) for row in chunk.astype(object).where(chunk.notna(), None).to_numpy()]
+
+                    # Execute batch insert
+                    cursor.executemany(insert_query, data)
+                    rows += len(data)
         
         # Commit changes
         conn.commit()
-        logging.info(f"Data successfully loaded into table: {table_name}")
+        elapsed = time.perf_counter() - start
+        logging.info(f"Data successfully loaded into table: {table_name} "
+                     f"({rows} rows via {method} in {elapsed:.2f}s, {rows / max(elapsed, 1e-9):.0f} rows/s)")
         
     except Exception as e:
         logging.error(f"Error loading data into table {table_name}: {e}")
@@ -448,41 +646,41 @@ def load_dataframe_to_db(df, table_name, conn):
     finally:
         cursor.close()  # Close cursor
 
-def load_fact_disasters(df, conn):
-    load_dataframe_to_db(df, 'fact_disasters', conn)
+def load_fact_disasters(df, conn, method='insert'):
+    load_dataframe_to_db(df, 'fact_disasters', conn, method)
 
-def load_dim_disaster_types(df, conn):
-    load_dataframe_to_db(df, 'dim_disaster_types', conn)
+def load_dim_disaster_types(df, conn, method='insert', skip_existing=False):
+    load_dataframe_to_db(df, 'dim_disaster_types', conn, method, skip_existing=skip_existing)
 
-def load_dim_disaster_groups(df, conn):
-    load_dataframe_to_db(df, 'dim_disaster_groups', conn)
+def load_dim_disaster_groups(df, conn, method='insert', skip_existing=False):
+    load_dataframe_to_db(df, 'dim_disaster_groups', conn, method, skip_existing=skip_existing)
 
-def load_dim_associated_distructions(df, conn):
-    load_dataframe_to_db(df, 'dim_associated_distructions', conn)
+def load_dim_associated_distructions(df, conn, method='insert', skip_existing=False):
+    load_dataframe_to_db(df, 'dim_associated_distructions', conn, method, skip_existing=skip_existing)
 
-def load_dim_locations(df, conn):
-    load_dataframe_to_db(df, 'dim_locations', conn)
+def load_dim_locations(df, conn, method='insert', skip_existing=False):
+    load_dataframe_to_db(df, 'dim_locations', conn, method, skip_existing=skip_existing)
 
-def load_dim_disaster_names(df, conn):
-    load_dataframe_to_db(df, 'dim_disaster_names', conn)
+def load_dim_disaster_names(df, conn, method='insert', skip_existing=False):
+    load_dataframe_to_db(df, 'dim_disaster_names', conn, method, skip_existing=skip_existing)
 
-def load_dim_ofda_responses(df, conn):
-    load_dataframe_to_db(df, 'dim_ofda_responses', conn)
+def load_dim_ofda_responses(df, conn, method='insert', skip_existing=False):
+    load_dataframe_to_db(df, 'dim_ofda_responses', conn, method, skip_existing=skip_existing)
 
-def load_dim_appeals(df, conn):
-    load_dataframe_to_db(df, 'dim_appeals', conn)
+def load_dim_appeals(df, conn, method='insert', skip_existing=False):
+    load_dataframe_to_db(df, 'dim_appeals', conn, method, skip_existing=skip_existing)
 
-def load_dim_declarations(df, conn):
-    load_dataframe_to_db(df, 'dim_declarations', conn)
+def load_dim_declarations(df, conn, method='insert', skip_existing=False):
+    load_dataframe_to_db(df, 'dim_declarations', conn, method, skip_existing=skip_existing)
 
-def load_dim_mag_scales(df, conn):
-    load_dataframe_to_db(df, 'dim_mag_scales', conn)
+def load_dim_mag_scales(df, conn, method='insert', skip_existing=False):
+    load_dataframe_to_db(df, 'dim_mag_scales', conn, method, skip_existing=skip_existing)
 
-def load_dim_adm_levels(df, conn):
-    load_dataframe_to_db(df, 'dim_adm_levels', conn)
+def load_dim_adm_levels(df, conn, method='insert', skip_existing=False):
+    load_dataframe_to_db(df, 'dim_adm_levels', conn, method, skip_existing=skip_existing)
 
-def load_dim_disasters_origin(df, conn):
-    load_dataframe_to_db(df, 'dim_disasters_origin', conn)
+def load_dim_disasters_origin(df, conn, method='insert', skip_existing=False):
+    load_dataframe_to_db(df, 'dim_disasters_origin', conn, method, skip_existing=skip_existing)
 
-def load_dim_dates(df, conn):
-    load_dataframe_to_db(df, 'dim_dates', conn)
+def load_dim_dates(df, conn, method='insert', skip_existing=False):
+    load_dataframe_to_db(df, 'dim_dates', conn, method, skip_existing=skip_existing)
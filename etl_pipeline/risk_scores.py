@@ -0,0 +1,210 @@
+import logging
+import os
+import pandas as pd
+from psycopg2.extras import execute_values
+
+
+__all__ = [
+    'SUMMARY_DEFINITIONS',
+    'create_summary_tables',
+    'impact_groups',
+    'refresh_country_impacts',
+    'refresh_seismicity',
+]
+
+logger = logging.getLogger(__name__)
+
+RECENT_QUAKE_DAYS = int(os.getenv('RECENT_QUAKE_DAYS', 90))  # live quakes kept in the warehouse for re-aggregation
+
+# Precomputed aggregates read by the dashboards instead of scanning fact_disasters:
+# impacts per country, disaster type and decade, live earthquakes per country and day,
+# and the views that roll them up per region and into one risk score per country.
+# Facts without a country, type or start year are left out of the aggregates.
+SUMMARY_DEFINITIONS = {
+    'agg_country_impacts': """--sql
+    CREATE TABLE IF NOT EXISTS agg_country_impacts (
+        iso VARCHAR NOT NULL,
+        type_id VARCHAR NOT NULL,
+        decade INTEGER NOT NULL,
+        country VARCHAR,
+        region VARCHAR,
+        continent VARCHAR,
+        events BIGINT,
+        total_deaths BIGINT,
+        total_affected BIGINT,
+        total_damages DOUBLE PRECISION,
+        PRIMARY KEY (iso, type_id, decade)
+    );
+    """,
+    'recent_quakes': """--sql
+    CREATE TABLE IF NOT EXISTS recent_quakes (
+        id VARCHAR PRIMARY KEY,
+        iso VARCHAR,
+        time TIMESTAMPTZ,
+        mag DOUBLE PRECISION
+    );
+    CREATE INDEX IF NOT EXISTS recent_quakes_iso_time ON recent_quakes (iso, time);
+    """,
+    'agg_country_seismicity': """--sql
+    CREATE TABLE IF NOT EXISTS agg_country_seismicity (
+        iso VARCHAR NOT NULL,
+        day DATE NOT NULL,
+        quakes BIGINT,
+        max_mag DOUBLE PRECISION,
+        PRIMARY KEY (iso, day)
+    );
+    """,
+    'region_impacts': """--sql
+    CREATE OR REPLACE VIEW region_impacts AS
+    SELECT region, continent, type_id, decade, SUM(events) AS events, SUM(total_deaths) AS total_deaths,
+           SUM(total_affected) AS total_affected, SUM(total_damages) AS total_damages
+    FROM agg_country_impacts
+    GROUP BY region, continent, type_id, decade;
+    """,
+    # score: log-scaled events, deaths and damages per decade over the last 50 years,
+    # plus the live earthquakes of the last 30 days; every term is read from the small summary tables
+    'country_risk_scores': """--sql
+    CREATE OR REPLACE VIEW country_risk_scores AS
+    WITH impacts AS (
+        SELECT iso, MAX(country) AS country, MAX(region) AS region, MAX(continent) AS continent,
+               SUM(events) / 5.0 AS events_per_decade,
+               SUM(total_deaths) / 5.0 AS deaths_per_decade,
+               SUM(total_damages) / 5.0 AS damages_per_decade
+        FROM agg_country_impacts
+        WHERE decade >= EXTRACT(YEAR FROM CURRENT_DATE)::INTEGER / 10 * 10 - 40
+        GROUP BY iso
+    ), seismicity AS (
+        SELECT iso, SUM(quakes) AS quakes_30d, MAX(max_mag) AS max_mag_30d
+        FROM agg_country_seismicity
+        WHERE day >= CURRENT_DATE - 30
+        GROUP BY iso
+    )
+    SELECT COALESCE(i.iso, s.iso) AS iso, i.country, i.region, i.continent,
+           COALESCE(i.events_per_decade, 0) AS events_per_decade,
+           COALESCE(i.deaths_per_decade, 0) AS deaths_per_decade,
+           COALESCE(i.damages_per_decade, 0) AS damages_per_decade,
+           COALESCE(s.quakes_30d, 0) AS quakes_30d, s.max_mag_30d,
+           LN(1 + COALESCE(i.events_per_decade, 0)) + LN(1 + COALESCE(i.deaths_per_decade, 0))
+           + 0.5 * LN(1 + COALESCE(i.damages_per_decade, 0)) + LN(1 + COALESCE(s.quakes_30d, 0))
+           + GREATEST(COALESCE(s.max_mag_30d, 0) - 4.5, 0) AS risk_score
+    FROM impacts i
+    FULL OUTER JOIN seismicity s ON s.iso = i.iso;
+    """,
+}
+
+
+def create_summary_tables(conn):
+    with conn.cursor() as cur:
+        for create_query in SUMMARY_DEFINITIONS.values():
+            cur.execute(create_query)
+    conn.commit()
+
+
+# Historical impacts: only the (country, type, decade) groups of the new facts are recomputed
+##############################################################################################
+IMPACT_GROUPS = """--sql
+    SELECT l.iso, f.type_id, d.year / 10 * 10 AS decade,
+           MAX(l.country) AS country, MAX(l.region) AS region, MAX(l.continent) AS continent,
+           COUNT(*) AS events, SUM(f.total_deaths) AS total_deaths,
+           SUM(f.total_affected) AS total_affected, SUM(f.total_damages) AS total_damages
+    FROM fact_disasters f
+    JOIN dim_locations l ON f.location_id = l.location_id
+    JOIN dim_dates d ON f.starting_date_id = d.date_id
+    WHERE l.iso IS NOT NULL AND f.type_id IS NOT NULL AND d.year IS NOT NULL {filter}
+    GROUP BY l.iso, f.type_id, d.year / 10 * 10
+"""
+IMPACT_GROUP_KEYS = """--sql
+    SELECT DISTINCT l.iso, f.type_id, d.year / 10 * 10 AS decade
+    FROM fact_disasters f
+    JOIN dim_locations l ON f.location_id = l.location_id
+    JOIN dim_dates d ON f.starting_date_id = d.date_id
+    WHERE f.id = ANY(%(ids)s) AND l.iso IS NOT NULL AND f.type_id IS NOT NULL AND d.year IS NOT NULL
+"""
+
+
+def impact_groups(conn, fact_ids):
+    """
+    Returns the (iso, type_id, decade) agg_country_impacts groups the facts are counted in.
+    """
+    if not len(fact_ids):
+        return []
+    with conn.cursor() as cur:
+        cur.execute(IMPACT_GROUP_KEYS, {'ids': [str(fact_id) for fact_id in fact_ids]})
+        return cur.fetchall()
+
+
+def refresh_country_impacts(conn, fact_ids=None, groups=None):
+    """
+    Brings agg_country_impacts up to date with fact_disasters. With fact_ids (the facts just loaded)
+    only the groups those facts fall in, plus the extra (iso, type_id, decade) groups (e.g. those of replaced facts),
+    are deleted and aggregated again; without, the table is rebuilt.
+    Returns the number of groups written.
+    """
+    create_summary_tables(conn)
+    with conn.cursor() as cur:
+        if fact_ids is None:
+            cur.execute("TRUNCATE agg_country_impacts;")
+            cur.execute("INSERT INTO agg_country_impacts (iso, type_id, decade, country, region, continent, events, "
+                        "total_deaths, total_affected, total_damages) " + IMPACT_GROUPS.format(filter=''))
+        else:
+            cur.execute("CREATE TEMP TABLE touched_groups ON COMMIT DROP AS " + IMPACT_GROUP_KEYS,
+                        {'ids': [str(fact_id) for fact_id in fact_ids]})
+            if groups:
+                execute_values(cur, "INSERT INTO touched_groups (iso, type_id, decade) VALUES %s", groups)
+            cur.execute("""--sql
+                DELETE FROM agg_country_impacts a USING touched_groups t
+                WHERE a.iso = t.iso AND a.type_id = t.type_id AND a.decade = t.decade;
+            """)
+            cur.execute("INSERT INTO agg_country_impacts (iso, type_id, decade, country, region, continent, events, "
+                        "total_deaths, total_affected, total_damages) " + IMPACT_GROUPS.format(
+                            filter="AND (l.iso, f.type_id, d.year / 10 * 10) IN (SELECT iso, type_id, decade FROM touched_groups)"))
+        written = cur.rowcount
+    conn.commit()
+    logger.info(f"Refreshed {written} country impact groups ({'full rebuild' if fact_ids is None else f'{len(fact_ids)} new facts'})")
+    return written
+
+
+# Live seismicity: quakes are upserted by id (feed revisions replace the earlier copy)
+# and only the (country, day) groups of the batch are counted again
+######################################################################################
+def refresh_seismicity(conn, quakes, iso_col='iso'):
+    """
+    Adds a batch of live quakes (id, time, mag and their country ISO code in iso_col) to the warehouse
+    and recomputes agg_country_seismicity for the countries and days they fall on.
+    Quakes older than RECENT_QUAKE_DAYS are dropped from recent_quakes; their daily counts stay.
+    Returns the number of groups written.
+    """
+    quakes = quakes.dropna(subset=[iso_col, 'time']).drop_duplicates(subset='id', keep='last')
+    if quakes.empty:
+        return 0
+
+    rows = list(zip(quakes['id'].astype(str), quakes[iso_col], pd.to_datetime(quakes['time'], utc=True, format='ISO8601'),
+                    quakes['mag'].astype(object).where(quakes['mag'].notna(), None)))
+    create_summary_tables(conn)
+    ids = [row[0] for row in rows]
+    with conn.cursor() as cur:
+        # groups of the earlier copies too, in case a revision moved a quake to another day or country
+        cur.execute("""--sql
+            CREATE TEMP TABLE touched_days ON COMMIT DROP AS
+            SELECT iso, (time AT TIME ZONE 'UTC')::DATE AS day FROM recent_quakes WHERE id = ANY(%(ids)s);
+        """, {'ids': ids})
+        execute_values(cur, """--sql
+            INSERT INTO recent_quakes (id, iso, time, mag) VALUES %s
+            ON CONFLICT (id) DO UPDATE SET iso = EXCLUDED.iso, time = EXCLUDED.time, mag = EXCLUDED.mag;
+        """, rows)
+        cur.execute("""--sql
+            INSERT INTO touched_days SELECT iso, (time AT TIME ZONE 'UTC')::DATE FROM recent_quakes WHERE id = ANY(%(ids)s);
+            DELETE FROM agg_country_seismicity a USING touched_days t WHERE a.iso = t.iso AND a.day = t.day;
+        """, {'ids': ids})
+        cur.execute("""--sql
+            INSERT INTO agg_country_seismicity (iso, day, quakes, max_mag)
+            SELECT q.iso, (q.time AT TIME ZONE 'UTC')::DATE AS day, COUNT(*), MAX(q.mag)
+            FROM recent_quakes q
+            JOIN (SELECT DISTINCT iso, day FROM touched_days) t ON q.iso = t.iso AND (q.time AT TIME ZONE 'UTC')::DATE = t.day
+            GROUP BY q.iso, (q.time AT TIME ZONE 'UTC')::DATE;
+        """)
+        written = cur.rowcount
+        cur.execute("DELETE FROM recent_quakes WHERE time < NOW() - make_interval(days => %s);", (RECENT_QUAKE_DAYS,))
+    conn.commit()
+    logger.info(f"Refreshed {written} country/day seismicity groups from {len(rows)} quakes")
+    return written
@@ -0,0 +1,112 @@
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from psycopg2 import pool
+
+from load import TABLE_DEFINITIONS, load_dataframe_to_db
+
+
+__all__ = [
+    'table_dependencies',
+    'create_connection_pool',
+    'load_tables',
+]
+
+logger = logging.getLogger(__name__)
+
+LOAD_WORKERS = int(os.getenv('LOAD_WORKERS', 4))  # tables loaded at the same time, one pooled connection each
+
+
+# Building the load order from the REFERENCES clauses of the warehouse tables
+##############################################################################
+def table_dependencies(definitions=TABLE_DEFINITIONS):
+    """
+    Returns, for every table, the set of other tables it references.
+    Self references (parent_id in the hierarchies) do not constrain the load order.
+    """
+    dependencies = {}
+    for table_name, create_table_query in definitions.items():
+        referenced = set(re.findall(r"REFERENCES\s+(\w+)\s*\(", create_table_query, flags=re.IGNORECASE))
+        dependencies[table_name] = referenced - {table_name}
+    return dependencies
+
+
+# Bounded pool of warehouse connections shared by the load workers
+###################################################################
+def create_connection_pool(dbname, max_connections=LOAD_WORKERS):
+    """
+    Creates a thread-safe pool with at most max_connections connections, configured like connect_db.
+    """
+    return pool.ThreadedConnectionPool(
+        1, max_connections,
+        dbname=os.getenv('DB_NAME', dbname),
+        user=os.getenv('DB_USER', 'postgres'),
+        password=os.getenv('DB_PASSWORD'),
+        host=os.getenv('DB_HOST', 'localhost'),
+        port=os.getenv('DB_PORT', 5432)
+    )
+
+
+def load_table(df, table_name, db_pool, method, skip_existing, replace_existing=False):
+    conn = db_pool.getconn()
+    try:
+        start = time.perf_counter()
+        load_dataframe_to_db(df, table_name, conn, method, skip_existing=skip_existing, replace_existing=replace_existing)
+        return time.perf_counter() - start
+    finally:
+        db_pool.putconn(conn)
+
+
+# Loading tables concurrently once everything they reference is loaded
+#######################################################################
+def load_tables(frames, db_pool, method='insert', skip_existing=(), max_workers=LOAD_WORKERS, replace_existing=()):
+    """
+    Loads {table_name: DataFrame} into the warehouse. A table starts as soon as every table it references
+    (among the ones being loaded) has finished, so the dimensions load side by side and fact_disasters last.
+    Tables named in skip_existing are loaded with ON CONFLICT DO NOTHING, tables named in replace_existing
+    overwrite the rows they hold again (ON CONFLICT ... DO UPDATE).
+    Tables depending on a failed table are skipped, and a RuntimeError lists the failures at the end.
+    Returns the load time of every table in seconds.
+    """
+    dependencies = {table: deps & frames.keys() for table, deps in table_dependencies().items() if table in frames}
+    pending = [table for table in frames if table in dependencies]
+    unknown = set(frames) - set(dependencies)
+    if unknown:
+        raise ValueError(f"No table definition for {sorted(unknown)}")
+
+    timings, failed, running = {}, {}, {}
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            ready = [table for table in pending if dependencies[table] <= timings.keys()]
+            for table in ready:
+                pending.remove(table)
+                logger.info(f"Loading {table}...")
+                running[executor.submit(load_table, frames[table], table, db_pool, method,
+                                                table in skip_existing, table in replace_existing)] = table
+
+            if not running:
+                # whatever is left depends on a table that failed
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                table = running.pop(future)
+                try:
+                    timings[table] = future.result()
+                    logger.info(f"{table} loaded successfully in {timings[table]:.2f}s.")
+                except Exception as e:
+                    failed[table] = e
+                    logger.error(f"Error loading {table}: {e}")
+
+    for table in pending:
+        logger.error(f"Skipped {table}: a table it references failed to load.")
+
+    logger.info(f"Loaded {len(timings)} of {len(frames)} tables in {time.perf_counter() - start:.2f}s wall-clock "
+                f"({sum(timings.values()):.2f}s of table load time).")
+    if failed or pending:
+        raise RuntimeError(f"Failed to load tables: {sorted(failed)}, skipped: {sorted(pending)}")
+    return timings
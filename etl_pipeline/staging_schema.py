@@ -0,0 +1,247 @@
+import logging
+import os
+import pandas as pd
+from psycopg2 import sql
+
+from extract import get_columns_from_csv, load_data_into_staging
+
+
+__all__ = [
+    'TYPE_PATTERNS',
+    'STAGED_DATES',
+    'infer_column_types',
+    'get_staging_types',
+    'widen_staging_types',
+    'prepare_staging_types',
+    'staged_date_parts',
+    'create_typed_staging_table',
+    'date_expression',
+    'load_typed_rows',
+    'process_csv_to_typed_staging',
+]
+
+logger = logging.getLogger(__name__)
+
+STAGING_SAMPLE_ROWS = int(os.getenv('STAGING_SAMPLE_ROWS', 10000))  # rows that decide whether a column holds numbers
+
+# Text a value must match to be cast to each type, used both on the file and by the server-side casts.
+# Listed from narrowest to widest, each accepting the values of the ones before it; anything else stays TEXT.
+TYPE_PATTERNS = {
+    'INTEGER': r'^\s*[+-]?\d{1,9}\s*$',
+    'BIGINT': r'^\s*[+-]?\d{1,18}\s*$',
+    'DOUBLE PRECISION': r'^\s*[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?\s*$',
+}
+
+# Dates assembled on the server from their year/month/day parts (matched on cleaned column names);
+# impossible dates (e.g. February 30) are stored as NULL, like transform.assemble_dates does
+STAGED_DATES = {
+    'starting_date': ('start_year', 'start_month', 'start_day'),
+    'ending_date': ('end_year', 'end_month', 'end_day'),
+}
+
+
+# Inferring the staging schema from the CSV
+#############################################
+TYPE_ORDER = list(TYPE_PATTERNS) + ['TEXT']
+
+
+def infer_column_types(file_path, sample_rows=STAGING_SAMPLE_ROWS, numbers_only=False):
+    """
+    Picks for every column the narrowest of INTEGER, BIGINT and DOUBLE PRECISION, or TEXT.
+    Whether a column holds numbers is decided on the first sample_rows rows (all their non-empty values
+    must match), so a stray malformed value later on is rejected instead of turning the column to TEXT.
+    The width is taken from the numbers of the whole file, read sample_rows rows at a time, so larger
+    numbers further down widen the type. With numbers_only=True every column is typed from its numbers alone.
+    Returns {column: type} in file order.
+    """
+    text_rank = TYPE_ORDER.index('TEXT')
+    sample_rank, number_rank = {}, {}  # column -> index in TYPE_ORDER, None while it has no values
+    rows = 0
+    for chunk in pd.read_csv(file_path, chunksize=sample_rows, dtype=str, keep_default_na=False, encoding='utf-8', encoding_errors='replace'):
+        for col in chunk.columns:
+            values = chunk[col][chunk[col].str.strip() != '']
+            if not rows:
+                sample_rank[col] = None if values.empty else narrowest_type(values)
+            numbers = values[values.str.fullmatch(TYPE_PATTERNS[TYPE_ORDER[text_rank - 1]])]
+            current = number_rank.get(col)
+            if not numbers.empty:
+                number_rank[col] = narrowest_type(numbers, start=current or 0)
+            else:
+                number_rank.setdefault(col, None)
+        rows += len(chunk)
+
+    types = {}
+    for col, position in number_rank.items():
+        if not numbers_only:
+            # only columns whose sample holds nothing but numbers are typed
+            position = None if sample_rank[col] in (None, text_rank) else max(position, sample_rank[col])
+        types[col] = 'TEXT' if position is None else TYPE_ORDER[position]
+    logger.info(f"Inferred staging types from {rows} rows of {file_path}: "
+                f"{sum(t != 'TEXT' for t in types.values())} of {len(types)} columns typed")
+    return types
+
+
+def narrowest_type(values, start=0):
+    # index in TYPE_ORDER of the narrowest type, from start on, that all the values match
+    return next((position for position, type_name in enumerate(TYPE_ORDER[:-1])
+                 if position >= start and values.str.fullmatch(TYPE_PATTERNS[type_name]).all()), len(TYPE_ORDER) - 1)
+
+
+def get_staging_types(cursor, table_name):
+    """
+    Returns {column: type} of an existing staging table (without extraction_time), or None if there is none.
+    Once a staging table exists its types are kept, so later files are cast the same way.
+    """
+    cursor.execute("""--sql
+        SELECT column_name, UPPER(data_type) FROM information_schema.columns
+        WHERE table_name = %s AND table_schema = current_schema()
+        ORDER BY ordinal_position;
+    """, (table_name,))
+    rows = cursor.fetchall()
+    if not rows:
+        return None
+    return {col: 'TEXT' if type_name.startswith('CHARACTER') else type_name
+            for col, type_name in rows if col != 'extraction_time' and col not in STAGED_DATES}
+
+
+def widen_staging_types(cursor, table_name, types, file_types):
+    """
+    Widens the numeric columns of an existing staging table whose numbers in the file need a wider type
+    (e.g. INTEGER to BIGINT or DOUBLE PRECISION), so valid numbers beyond the inferred range are not rejected.
+    Columns are never widened from a number to TEXT: values that are not numbers still go to the rejects table.
+    Returns the updated {column: type}.
+    """
+    types = dict(types)
+    for col, file_type in file_types.items():
+        current = types.get(col)
+        if current not in TYPE_PATTERNS or file_type not in TYPE_PATTERNS:
+            continue
+        if TYPE_ORDER.index(file_type) > TYPE_ORDER.index(current):
+            cursor.execute(sql.SQL("ALTER TABLE {table} ALTER COLUMN {col} TYPE {type};").format(
+                table=sql.Identifier(table_name), col=sql.Identifier(col), type=sql.SQL(file_type)))
+            logger.info(f"Widened {table_name}.{col} from {current} to {file_type}")
+            types[col] = file_type
+    return types
+
+
+def prepare_staging_types(cursor, table_name, file_path):
+    # Types of the existing staging table, widened where the file needs it, or inferred from the file
+    types = get_staging_types(cursor, table_name)
+    if types is None:
+        return infer_column_types(file_path)
+    return widen_staging_types(cursor, table_name, types, infer_column_types(file_path, numbers_only=True))
+
+
+def staged_date_parts(columns):
+    # {date column: (year, month, day) source columns} for the date parts present in columns
+    cleaned = {col.lower().replace(' ', '_'): col for col in columns}
+    return {date_col: tuple(cleaned[part] for part in parts)
+            for date_col, parts in STAGED_DATES.items() if all(part in cleaned for part in parts)}
+
+
+# Typed staging and reject tables
+##################################
+def create_typed_staging_table(cursor, table_name, types):
+    """
+    Creates the staging table with the given column types, the assembled date columns and the extraction_time index,
+    and the {table_name}_rejects table that keeps, as text, the rows that could not be cast.
+    """
+    columns_sql = [sql.SQL("{} {}").format(sql.Identifier(col), sql.SQL(type_name)) for col, type_name in types.items()]
+    columns_sql.append(sql.SQL("extraction_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP"))
+    cursor.execute(sql.SQL("CREATE TABLE IF NOT EXISTS {} ({});").format(sql.Identifier(table_name), sql.SQL(', ').join(columns_sql)))
+    # also added to staging tables created before the dates were assembled on the server
+    for date_col in staged_date_parts(types):
+        cursor.execute(sql.SQL("ALTER TABLE {} ADD COLUMN IF NOT EXISTS {} DATE;").format(sql.Identifier(table_name), sql.Identifier(date_col)))
+    cursor.execute(sql.SQL("CREATE INDEX IF NOT EXISTS {} ON {} (extraction_time);").format(
+        sql.Identifier(f"{table_name}_extraction_time_idx"), sql.Identifier(table_name)))
+
+    reject_columns = [sql.SQL("{} TEXT").format(sql.Identifier(col)) for col in types]
+    reject_columns += [sql.SQL("failed_columns TEXT[]"), sql.SQL("extraction_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP")]
+    cursor.execute(sql.SQL("CREATE TABLE IF NOT EXISTS {} ({});").format(
+        sql.Identifier(f"{table_name}_rejects"), sql.SQL(', ').join(reject_columns)))
+    logger.info(f"Created typed staging table {table_name} and {table_name}_rejects")
+
+
+def cast_expression(col, type_name):
+    if type_name not in TYPE_PATTERNS:
+        return sql.Identifier(col)
+    return sql.SQL("TRIM({col})::{type}").format(col=sql.Identifier(col), type=sql.SQL(type_name))
+
+
+def date_expression(year, month, day):
+    # nested CASEs (AND does not short-circuit in SQL) so the parts are only cast once they are whole numbers
+    # and make_date only ever sees a valid month and day and a year within the date range; parts may be text or already numbers
+    parts = [sql.SQL("TRIM({}::TEXT)").format(sql.Identifier(part)) for part in (year, month, day)]
+    y, m, d = (sql.SQL("{}::INTEGER").format(part) for part in parts)
+    return sql.SQL("""CASE WHEN {valid} THEN
+            CASE WHEN {m} BETWEEN 1 AND 12 AND {d} >= 1 AND {y} BETWEEN 1 AND 9999 THEN
+                CASE WHEN {d} <= EXTRACT(DAY FROM make_date({y}, {m}, 1) + INTERVAL '1 month' - INTERVAL '1 day') THEN make_date({y}, {m}, {d}) END
+            END
+        END""").format(
+        valid=sql.SQL(' AND ').join(sql.SQL("{} ~ {}").format(part, sql.Literal(TYPE_PATTERNS['INTEGER'])) for part in parts),
+        y=y, m=m, d=d)
+
+
+def load_typed_rows(cursor, table_name, file_path, columns, types, target_table=None):
+    """
+    Streams the CSV into a temporary text table, then casts it on the server into target_table (the staging
+    table by default). Rows with a value that does not match its column type go to {table_name}_rejects
+    with the names of the failing columns; rejects already recorded are not added again.
+    Returns the number of rows loaded and rejected.
+    """
+    target_table = target_table or table_name
+    raw_table = f"{table_name}_raw"
+    cursor.execute(sql.SQL("CREATE TEMP TABLE {} ({}) ON COMMIT DROP;").format(
+        sql.Identifier(raw_table), sql.SQL(', ').join(sql.SQL("{} TEXT").format(sql.Identifier(col)) for col in columns)))
+    load_data_into_staging(cursor, raw_table, file_path, columns)
+
+    checks = [(col, sql.SQL("({col} IS NULL OR {col} ~ {pattern})").format(col=sql.Identifier(col), pattern=sql.Literal(TYPE_PATTERNS[types[col]])))
+              for col in columns if types.get(col, 'TEXT') in TYPE_PATTERNS]
+    valid = sql.SQL(' AND ').join(check for _, check in checks) if checks else sql.SQL('TRUE')
+    dates = staged_date_parts(columns)
+
+    insert_columns = [sql.Identifier(col) for col in columns] + [sql.Identifier(date_col) for date_col in dates]
+    select_values = [cast_expression(col, types.get(col, 'TEXT')) for col in columns] + [date_expression(*parts) for parts in dates.values()]
+    cursor.execute(sql.SQL("INSERT INTO {target} ({columns}) SELECT {values} FROM {raw} WHERE {valid};").format(
+        target=sql.Identifier(target_table), columns=sql.SQL(', ').join(insert_columns),
+        values=sql.SQL(', ').join(select_values), raw=sql.Identifier(raw_table), valid=valid))
+    loaded = cursor.rowcount
+
+    rejected = 0
+    if checks:
+        raw_columns = sql.SQL(', ').join(sql.Identifier(col) for col in columns)
+        failed = sql.SQL("ARRAY_REMOVE(ARRAY[{}], NULL)").format(sql.SQL(', ').join(
+            sql.SQL("CASE WHEN NOT {check} THEN {name} END").format(check=check, name=sql.Literal(col)) for col, check in checks))
+        cursor.execute(sql.SQL("""--sql
+            INSERT INTO {rejects} ({columns}, failed_columns)
+            SELECT {columns}, {failed} FROM (
+                SELECT {columns} FROM {raw} WHERE NOT ({valid})
+                EXCEPT
+                SELECT {columns} FROM {rejects}
+            ) AS new_rejects;
+        """).format(rejects=sql.Identifier(f"{table_name}_rejects"), columns=raw_columns, failed=failed,
+                    raw=sql.Identifier(raw_table), valid=valid))
+        rejected = cursor.rowcount
+
+    cursor.execute(sql.SQL("DROP TABLE {};").format(sql.Identifier(raw_table)))
+    if rejected:
+        logger.warning(f"{rejected} rows of {file_path} could not be cast and were written to {table_name}_rejects")
+    logger.info(f"Cast {loaded} rows of {file_path} into {target_table}")
+    return loaded, rejected
+
+
+# Main function to process CSV files into typed staging
+########################################################
+def process_csv_to_typed_staging(cursor, table_name, file_path):
+    """
+    Like extract.process_csv_to_staging, with the column types inferred from the file
+    (or taken from the existing staging table, widened where the file needs it) and cast on the server.
+    """
+    columns = get_columns_from_csv(file_path)
+    if not columns:
+        logger.warning(f"No columns found for file {file_path}. Skipping processing.")
+        return 0, 0
+
+    types = prepare_staging_types(cursor, table_name, file_path)
+    create_typed_staging_table(cursor, table_name, types)
+    return load_typed_rows(cursor, table_name, file_path, columns, types)
@@ -1,5 +1,4 @@
 import pandas as pd
-import reverse_geocode
 import json
 import numpy as np
 import csv 
@@ -9,25 +8,57 @@ import psycopg2
 from psycopg2 import sql
 import logging
 from datetime import datetime
+from geocoding import ReverseGeocoder, GEOCODE_COLUMNS
 
 
 __all__ = [
     'connect_db',
     'get_data_from_db',
+    'iter_data_from_db',
+    'optimize_dtypes',
+    'concat_chunks',
     'clean_column_names',
     'combine_date',
+    'date_part_to_number',
+    'assemble_dates',
     'compute_dates',
     'duration_days',
+    'coordinates_to_number',
     'add_reverse_geocode_info',
     'try_parsing_date',
     'remove_duplicates',
     'remove_columns',
     'transform_data',
-    'rename_column'
+    'transform_chunks',
+    'rename_column',
+    'TRANSFORM_VERSION',
 ]
 
 logger = logging.getLogger(__name__)
 
+READ_CHUNK_SIZE = int(os.getenv('READ_CHUNK_SIZE', 50000))  # staging rows held in memory at a time
+# Part of the checkpoint keys: bump it when the transform or the dtypes it reads into change, so older checkpoints are not reused
+TRANSFORM_VERSION = 2
+
+# dtypes of the streamed columns by PostgreSQL type OID. from_records infers them per chunk (an all-NULL integer column
+# comes back as object), so every chunk of a read is given these and rows hash alike across chunks; other types keep theirs
+READ_DTYPES = {
+    16: 'boolean', 21: 'Int16', 23: 'Int32', 20: 'Int64', 700: 'float64', 701: 'float64',
+    25: 'object', 1042: 'object', 1043: 'object', 1114: 'datetime64[ns]',
+}
+
+# Compact column types set right after the read (matched on the cleaned column names): low-cardinality text as categories,
+# whole-number columns as nullable integers of a fixed width per column, so every chunk hashes and concatenates alike
+CATEGORY_COLUMNS = ['disaster_group', 'disaster_subgroup', 'disaster_type', 'disaster_subtype', 'disaster_subsubtype',
+                    'country', 'iso', 'region', 'continent', 'origin', 'associated_dis', 'associated_dis2',
+                    'ofda_response', 'appeal', 'declaration', 'dis_mag_scale', 'adm_level']
+INTEGER_COLUMNS = {
+    'year': 'Int16', 'seq': 'Int16', 'aid_contribution': 'Int32',
+    'start_year': 'Int16', 'start_month': 'Int8', 'start_day': 'Int8',
+    'end_year': 'Int16', 'end_month': 'Int8', 'end_day': 'Int8',
+    'total_deaths': 'Int32', 'no_injured': 'Int32', 'no_affected': 'Int32', 'no_homeless': 'Int32', 'total_affected': 'Int32',
+}
+
 # # directory where the script is located
 # script_dir = os.getcwd()
 # # logs folder
@@ -45,14 +76,14 @@ logger = logging.getLogger(__name__)
 
 # Connecting to PostgreSQL database
 ###################################
-def connect_db():
+def connect_db(dbname='staging_disasters'):
     """
     Connects to the PostgreSQL database.
     Returns a connection object if successful, or None if connection fails.
     """
     try:
         conn = psycopg2.connect(
-            dbname=os.getenv('DB_NAME', 'staging_disasters'),
+            dbname=os.getenv('DB_NAME', dbname),
             user=os.getenv('DB_USER', 'postgres'),
             password=os.getenv('DB_PASSWORD'),
             host=os.getenv('DB_HOST', 'localhost'),
@@ -67,9 +98,10 @@ def connect_db():
 
 # Function to get data from PostgreSQL and load into a pandas DataFrame
 #######################################################################
-def get_data_from_db(query,dbname):
+def get_data_from_db(query, dbname, params=None):
     """
     Fetches data from the PostgreSQL database using the provided query.
+    Query parameters (e.g. extraction_time bounds) can be passed through params.
     Cleans column names and returns the data as a pandas DataFrame.
     """
     conn = connect_db(dbname)
@@ -78,7 +110,7 @@ def get_data_from_db(query,dbname):
         return None
     
     try:
-        df = pd.read_sql_query(query, conn)
+        df = pd.read_sql_query(query, conn, params=params)
         logger.info(f"Data fetched successfully for query: {query}")
         return df
     except Exception as error:
@@ -88,6 +120,91 @@ def get_data_from_db(query,dbname):
         conn.close()
 
 
+# Streaming query results through a server-side cursor, one DataFrame chunk at a time
+#####################################################################################
+def iter_data_from_db(query, dbname, params=None, chunksize=READ_CHUNK_SIZE, conn=None):
+    """
+    Runs the query on a named (server-side) cursor and yields the result as DataFrames of at most chunksize rows,
+    so only one chunk is ever held on the client. Every chunk gets the same dtypes, from the column types (READ_DTYPES).
+    An open connection can be passed in and is left open, otherwise one is opened for the read and closed at the end.
+    """
+    own_conn = conn is None
+    if own_conn:
+        conn = connect_db(dbname)
+        if conn is None:
+            logger.error("Connection to database failed")
+            return
+
+    try:
+        rows_read = 0
+        with conn.cursor(name=f"{dbname}_reader") as cursor:
+            cursor.itersize = chunksize
+            cursor.execute(query, params)
+            dtypes = None
+            while rows := cursor.fetchmany(chunksize):
+                rows_read += len(rows)
+                if dtypes is None:
+                    dtypes = {column.name: READ_DTYPES[column.type_code] for column in cursor.description if column.type_code in READ_DTYPES}
+                chunk = pd.DataFrame.from_records(rows, columns=[column.name for column in cursor.description])
+                yield chunk.astype({column: dtype for column, dtype in dtypes.items() if chunk[column].dtype != dtype})
+        logger.info(f"Streamed {rows_read} rows in chunks of {chunksize} for query: {query}")
+    except Exception as error:
+        logger.error(f"Error streaming data: {error}")
+        raise
+    finally:
+        if own_conn:
+            conn.close()
+
+
+# Compact column types, so a chunk (and the dimension inputs held for the split) takes a fraction of the object/float64 memory
+##############################################################################################################################
+def optimize_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Stores the CATEGORY_COLUMNS as categories and the INTEGER_COLUMNS as their nullable integers, matching the columns
+    on their cleaned names. The dtypes are applied whatever a chunk holds (all NULL, numbers or numbers as text),
+    so every chunk gets the same ones. Floats (coordinates, damages, CPI) are left as they are.
+    Values of an integer column that are not whole numbers within its dtype's range are set to NULL (and counted in a warning).
+    """
+    converted = {}
+    for column in df.columns:
+        name = column.lower().replace(' ', '_')
+        if name in CATEGORY_COLUMNS:
+            converted[column] = df[column].astype('category')
+        elif name in INTEGER_COLUMNS:
+            converted[column] = to_integer(df[column], INTEGER_COLUMNS[name], column)
+
+    logger.info(f"Stored {len(converted)} columns with compact types")
+    return df.assign(**converted)
+
+
+def to_integer(values: pd.Series, dtype: str, column: str) -> pd.Series:
+    # values (numbers or text) as the nullable integer dtype, the ones that do not fit it (text, fractions, out of range) as <NA>
+    if str(values.dtype) == dtype:
+        return values
+    limits = np.iinfo(dtype.lower())
+    numbers = pd.to_numeric(values, errors='coerce').astype('float64')
+    invalid = values.notna() & (numbers.isna() | (numbers % 1 != 0) | ~numbers.between(limits.min, limits.max))
+    if invalid.any():
+        logger.warning(f"Set {invalid.sum()} values of column {column} that do not fit {dtype} to NULL, e.g. {values[invalid].unique()[:5].tolist()}")
+        numbers = numbers.mask(invalid)
+    return numbers.astype(dtype)
+
+
+def concat_chunks(chunks) -> pd.DataFrame:
+    """
+    pd.concat of transformed chunks that keeps the category columns: pd.concat falls back to object
+    when the categories differ, so every chunk is given the union of the categories first.
+    """
+    chunks = list(chunks)
+    for column in chunks[0].columns:
+        dtypes = [chunk[column].dtype for chunk in chunks]
+        if len(chunks) > 1 and all(isinstance(dtype, pd.CategoricalDtype) for dtype in dtypes):
+            categories = dtypes[0].categories.append([dtype.categories for dtype in dtypes[1:]]).unique()
+            for chunk in chunks:
+                chunk[column] = chunk[column].cat.set_categories(categories)
+    return pd.concat(chunks, ignore_index=True)
+
+
 # Function to clean column names (removes spaces, lowercases)
 #############################################################
 def clean_column_names(df: pd.DataFrame) -> pd.DataFrame:
@@ -114,6 +231,42 @@ def combine_date(year: int, month: int, day: int) -> pd.Timestamp:
         return pd.NaT
 
 
+# Function to turn a year, month or day column into whole numbers
+##################################################################
+def date_part_to_number(part: pd.Series) -> pd.Series:
+    """
+    Converts a date part column to numbers the way int() does in combine_date:
+    text must hold a whole number, numbers are truncated, anything else becomes NaN.
+    """
+    numbers = pd.to_numeric(part, errors='coerce')
+    if part.dtype == object:
+        # text such as '1990.0' or '' is rejected by int(), non-text values give NaN here and are kept
+        integer_like = part.str.fullmatch(r'\s*[+-]?\d+\s*')
+        numbers = numbers.where(integer_like.isna() | integer_like.astype(bool))
+    return np.trunc(numbers)
+
+
+# Function to combine year, month, and day columns into dates in one pass
+##########################################################################
+def assemble_dates(year: pd.Series, month: pd.Series, day: pd.Series) -> pd.Series:
+    """
+    Vectorized combine_date: combines year, month, and day columns into a datetime column.
+    Missing or invalid parts and impossible dates (e.g. February 30) give NaT.
+    """
+    parts = pd.DataFrame({
+        'year': date_part_to_number(year),
+        'month': date_part_to_number(month),
+        'day': date_part_to_number(day),
+    })
+    dates = pd.Series(pd.NaT, index=parts.index, dtype='datetime64[ns]')
+
+    # only complete rows are assembled, the rest stay NaT
+    valid = parts.notna().all(axis=1)
+    if valid.any():
+        dates[valid] = pd.to_datetime(parts[valid].astype('int64'), errors='coerce')
+    return dates
+
+
 # Function to compute the start and end dates in a DataFrame
 ############################################################
 def compute_dates(df: pd.DataFrame, start_cols: list, end_cols: list, dataset_name: str) -> pd.DataFrame:
@@ -121,8 +274,12 @@ def compute_dates(df: pd.DataFrame, start_cols: list, end_cols: list, dataset_na
     Computes the start and end dates based on year, month, and day columns in the DataFrame.
     Adds 'start_date' and 'end_date' columns to the DataFrame.
     """
-    df['starting_date'] = df.apply(lambda row: combine_date(row[start_cols[0]], row[start_cols[1]], row[start_cols[2]]), axis=1)
-    df['ending_date'] = df.apply(lambda row: combine_date(row[end_cols[0]], row[end_cols[1]], row[end_cols[2]]), axis=1)
+    df['starting_date'] = assemble_dates(df[start_cols[0]], df[start_cols[1]], df[start_cols[2]])
+    df['ending_date'] = assemble_dates(df[end_cols[0]], df[end_cols[1]], df[end_cols[2]])
+
+    invalid_count = (df['starting_date'].isna() | df['ending_date'].isna()).sum()
+    if invalid_count:
+        logger.warning(f"{invalid_count} rows with an invalid or incomplete start or end date set to NaT in {dataset_name} dataset")
     logger.info(f"Start and end dates computed for {dataset_name} dataset")
     return df
 
@@ -147,20 +304,39 @@ def duration_days(df: pd.DataFrame, start_column: str, end_column: str, dataset_
     return df
 
 
+# Function to turn EM-DAT coordinates ('38.58 N', '-122.3', '12 S') into signed degrees
+########################################################################################
+def coordinates_to_number(values: pd.Series) -> pd.Series:
+    """
+    Converts a latitude or longitude column to signed decimal degrees.
+    A trailing S or W hemisphere letter makes the value negative; text that holds no number becomes NaN.
+    """
+    if values.dtype != object:
+        return pd.to_numeric(values, errors='coerce')
+    parts = values.astype('string').str.upper().str.extract(r'^\s*([+-]?\d+(?:\.\d*)?)\s*°?\s*([NSEW]?)\s*$')
+    numbers = pd.to_numeric(parts[0], errors='coerce')
+    return numbers.where(~parts[1].isin(['S', 'W']), -numbers.abs()).astype('float64')
+
+
 # Function to add reverse geocoding information to a DataFrame
 ##############################################################
-def add_reverse_geocode_info(df: pd.DataFrame, lat_col: str = 'dfo_centroid_y', lon_col: str = 'dfo_centroid_x', dataset_name: str = 'dataset') -> pd.DataFrame:
+def add_reverse_geocode_info(df: pd.DataFrame, lat_col: str = 'dfo_centroid_y', lon_col: str = 'dfo_centroid_x', dataset_name: str = 'dataset', geocoder: ReverseGeocoder = None) -> pd.DataFrame:
     """
     Adds reverse geocoding information (country, country_code, city, state) to the DataFrame based on latitude and longitude.
+    Repeated coordinates are looked up once and results are cached on disk (see geocoding.ReverseGeocoder).
     """
+    own_geocoder = geocoder is None
     try:
-        coords = list(zip(df[lat_col], df[lon_col]))
-        results = reverse_geocode.search(coords)
-        geocode_df = pd.DataFrame(results)[['country', 'country_code', 'city', 'state']]
-        df[['country', 'country_code', 'city', 'state']] = geocode_df
+        if own_geocoder:
+            geocoder = ReverseGeocoder()
+        df[GEOCODE_COLUMNS] = geocoder.lookup(df[lat_col], df[lon_col])
         logger.info(f"Reverse geocoding information added for {dataset_name} dataset using columns {lat_col} and {lon_col}")
     except Exception as error:
         logger.error(f"Error during reverse geocoding for {dataset_name} dataset: {error}")
+    finally:
+        # a geocoder passed in is left open for the caller, one opened here is closed
+        if own_geocoder and geocoder is not None:
+            geocoder.close()
     return df
 
 
@@ -177,14 +353,40 @@ def try_parsing_date(text: str) -> pd.Timestamp:
         return pd.NaT
     
 
+# Hashes of the rows kept so far, to remove duplicates across chunks
+#####################################################################
+class SeenRows:
+    """
+    The 64-bit hashes of the rows already kept, as one sorted array (8 bytes per row).
+    """
+    def __init__(self):
+        self.hashes = np.empty(0, dtype='uint64')
+
+    def keep_new(self, df: pd.DataFrame) -> np.ndarray:
+        """
+        Returns the mask of the rows of df not seen before (nor earlier in df) and records them.
+        """
+        hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+        is_new = ~pd.Series(hashes).duplicated().to_numpy()
+        if len(self.hashes):
+            positions = np.minimum(np.searchsorted(self.hashes, hashes), len(self.hashes) - 1)
+            is_new &= self.hashes[positions] != hashes
+        self.hashes = np.union1d(self.hashes, hashes[is_new])
+        return is_new
+
+
 # Function to remove duplicates from DataFrame
 ################################################
-def remove_duplicates(df: pd.DataFrame, dataset_name: str) -> pd.DataFrame:
+def remove_duplicates(df: pd.DataFrame, dataset_name: str, seen: SeenRows = None) -> pd.DataFrame:
     """
     Removes duplicate rows from the DataFrame.
+    With seen (shared across chunks) rows already kept from earlier chunks are removed too.
     """
     original_count = len(df)
-    df = df.drop_duplicates()
+    if seen is None:
+        df = df.drop_duplicates()
+    else:
+        df = df[seen.keep_new(df)].copy()
     removed_count = original_count - len(df)
     logger.info(f"Removed {removed_count} duplicates from {dataset_name} dataset")
     return df
@@ -203,21 +405,30 @@ def remove_columns(df: pd.DataFrame, columns: list, dataset_name: str) -> pd.Dat
 
 # Transform function that applies cleaning, transformations, geocoding, duplicates, and column removal
 #######################################################################################################
-def transform_data(disasters: pd.DataFrame, columns_to_remove: list = None): 
+def transform_data(disasters: pd.DataFrame, columns_to_remove: list = None, seen: SeenRows = None, raise_errors: bool = False): 
     """
     Transforms disasters  data by applying various transformations.
     Removes duplicates and specific columns if provided.
-    Returns the transformed DataFrames.
+    Returns the transformed DataFrames. With raise_errors an error is raised after being logged
+    instead of returning the partly transformed rows.
     """
     try:
 
         # Remove duplicates
-        disasters = remove_duplicates(disasters, 'disasters')
+        disasters = remove_duplicates(disasters, 'disasters', seen)
 
         # Process disasters DataFrame
         disasters = clean_column_names(disasters)
-        disasters = compute_dates(disasters, ['start_year', 'start_month', 'start_day'], ['end_year', 'end_month', 'end_day'], 'disasters')
+        if {'starting_date', 'ending_date'} <= set(disasters.columns):
+            # already assembled on the server by typed staging; dates pandas cannot hold become NaT, as in assemble_dates
+            disasters['starting_date'] = pd.to_datetime(disasters['starting_date'], errors='coerce')
+            disasters['ending_date'] = pd.to_datetime(disasters['ending_date'], errors='coerce')
+        else:
+            disasters = compute_dates(disasters, ['start_year', 'start_month', 'start_day'], ['end_year', 'end_month', 'end_day'], 'disasters')
         disasters = duration_days(disasters, 'starting_date', 'ending_date', 'disasters')
+        for column in ('latitude', 'longitude'):
+            if column in disasters.columns:
+                disasters[column] = coordinates_to_number(disasters[column])
         
         # Remove specified columns
         if columns_to_remove:
@@ -227,9 +438,24 @@ def transform_data(disasters: pd.DataFrame, columns_to_remove: list = None):
         return disasters
     except Exception as error:
         logger.error(f"Error during data transformation: {error}")
+        if raise_errors:
+            raise
         return disasters
 
 
+# Transforming a stream of chunks, so memory follows the chunk size and not the staging size
+#############################################################################################
+def transform_chunks(chunks, columns_to_remove: list = None):
+    """
+    Applies transform_data to every chunk (e.g. from iter_data_from_db) and yields the transformed chunks.
+    Duplicates are removed across chunks through the hashes of the rows already kept.
+    A chunk that fails raises, so a partly transformed stream is never taken for a whole one (e.g. by a checkpoint).
+    """
+    seen = SeenRows()
+    for chunk in chunks:
+        yield transform_data(chunk, columns_to_remove, seen, raise_errors=True)
+
+
 # if __name__ == "__main__":
     # # Fetching data
     # current_date = datetime.now().strftime("%Y%m%d")
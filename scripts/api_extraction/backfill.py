@@ -0,0 +1,149 @@
+import gzip
+import logging
+import os
+import time
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+
+from earthquakes import clean_eq_data
+from eq_store import EarthquakeStore
+from feeds import GeoJSONStreamParser, READ_SIZE
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_CHUNK_SIZE = 100000  # events held in memory at a time
+
+
+# Reading catalog dumps (CSV or GeoJSON, optionally gzipped) in bounded chunks
+###############################################################################
+def open_catalog(path):
+    return gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')
+
+
+def read_catalog_chunks(path, chunksize=BACKFILL_CHUNK_SIZE):
+    """
+    Yields the events of a local catalog dump as DataFrames of at most chunksize rows,
+    with the CSV feed's column names whatever the format.
+    """
+    with open_catalog(path) as stream:
+        if not path.removesuffix('.gz').endswith(('.geojson', '.json')):
+            yield from pd.read_csv(stream, chunksize=chunksize)
+            return
+
+        parser = GeoJSONStreamParser()
+        while chunk := stream.read(READ_SIZE):
+            parser.feed(chunk)
+            if len(parser) >= chunksize:
+                yield parser.drain()
+        last = parser.close()
+        if len(last):
+            yield last
+
+
+# Replaying a catalog as a simulated live feed
+###############################################
+def replay(chunks, speed=None, stats=None):
+    """
+    Yields batches of events in time order, paced so that catalog time runs speed times faster than wall time.
+    Every batch holds the events that came due since the previous one, like a feed poll would see them.
+    With speed=None the events are released as fast as the consumer takes them.
+    Catalogs are expected in time order across chunks; events older than the replay clock are released at once.
+    stats (a dict) collects the largest lag behind schedule in seconds.
+    """
+    start_time = start_wall = None
+    for chunk in chunks:
+        if speed is None:
+            yield chunk
+            continue
+
+        nanoseconds = pd.to_datetime(chunk['time'], format='ISO8601', utc=True).astype('int64').to_numpy()
+        order = np.argsort(nanoseconds, kind='stable')
+        chunk = chunk.iloc[order]
+        seconds = nanoseconds[order] / 1e9
+        if start_time is None:
+            start_time, start_wall = seconds[0], time.time()
+        due = start_wall + (seconds - start_time) / speed
+
+        position = 0
+        while position < len(chunk):
+            now = time.time()
+            if due[position] > now:
+                time.sleep(due[position] - now)
+                now = time.time()
+            end = np.searchsorted(due, now, side='right')
+            if stats is not None:
+                stats['max_lag'] = max(stats.get('max_lag', 0), now - due[position])
+            yield chunk.iloc[position:end]
+            position = end
+
+
+# Throughput of each stage of the real-time path
+#################################################
+class ThroughputMeter:
+    def __init__(self):
+        self.stages = {}  # stage -> [events, seconds]
+        self.max_lag = None  # largest delay behind the replay schedule, in seconds
+
+    def add(self, stage, events, seconds):
+        totals = self.stages.setdefault(stage, [0, 0.0])
+        totals[0] += events
+        totals[1] += seconds
+
+    @contextmanager
+    def measure(self, stage, events):
+        start = time.perf_counter()
+        yield
+        self.add(stage, events, time.perf_counter() - start)
+
+    def report(self):
+        lines = []
+        for stage, (events, seconds) in self.stages.items():
+            rate = events / seconds if seconds else float('inf')
+            lines.append(f"{stage:>8}: {events:>10} events in {seconds:8.2f}s, {rate:>12,.0f} events/s")
+        if self.max_lag is not None:
+            lines.append(f"max lag behind the replay schedule: {self.max_lag:.3f}s")
+        return '\n'.join(lines)
+
+
+def metered_chunks(chunks, meter):
+    # times the reading stage alone, not the work done on each chunk
+    while True:
+        start = time.perf_counter()
+        chunk = next(chunks, None)
+        if chunk is None:
+            return
+        meter.add('read', len(chunk), time.perf_counter() - start)
+        yield chunk
+
+
+def run_backfill(path, speed=None, chunksize=BACKFILL_CHUNK_SIZE, min_mag=1, store_path='API_data/earthquake_data.sqlite', index=None,
+                 clusterer=None):
+    """
+    Streams a catalog dump through the real-time path (clean, sequence clustering, store, spatial index) in bounded chunks,
+    optionally replayed at speed times real time. Returns the ThroughputMeter with the events/s of every stage.
+    """
+    meter = ThroughputMeter()
+    stats = {}
+    os.makedirs(os.path.dirname(store_path) or '.', exist_ok=True)
+    store = EarthquakeStore(store_path)
+    start = time.perf_counter()
+
+    try:
+        for batch in replay(metered_chunks(read_catalog_chunks(path, chunksize), meter), speed=speed, stats=stats):
+            with meter.measure('clean', len(batch)):
+                batch = clean_eq_data(batch.copy(), min_mag=min_mag)
+            if clusterer is not None:
+                with meter.measure('cluster', len(batch)):
+                    batch['cluster_id'] = clusterer.assign(batch)
+            with meter.measure('store', len(batch)):
+                store.upsert(batch)
+            if index is not None:
+                with meter.measure('index', len(batch)):
+                    index.add(batch)
+    finally:
+        store.close()
+
+    meter.max_lag = stats.get('max_lag')
+    logger.info(f"Backfilled {path} in {time.perf_counter() - start:.2f}s\n{meter.report()}")
+    return meter
@@ -0,0 +1,146 @@
+import heapq
+import math
+from collections import defaultdict
+import numpy as np
+import pandas as pd
+
+from spatial_index import to_unit_vectors, km_to_chord
+
+DAY_SECONDS = 86400
+MAX_WINDOW_KM = 150  # Gardner-Knopoff distance window of an M9, the cell size of the active-cluster grid
+
+
+# Gardner-Knopoff (1974) space-time windows of a mainshock of magnitude M
+##########################################################################
+def window_km(mag):
+    return 10 ** (0.1238 * mag + 0.983)
+
+
+def window_seconds(mag):
+    days = 10 ** (0.032 * mag + 2.7389) if mag >= 6.5 else 10 ** (0.5409 * mag - 0.547)
+    return days * DAY_SECONDS
+
+
+class SequenceClusterer:
+    """
+    Incremental mainshock/aftershock grouping with Gardner-Knopoff windows.
+    Events arrive in time order and each gets a cluster_id straight away: an event inside the
+    space-time window of an active cluster's mainshock joins it (and becomes the mainshock if larger),
+    otherwise it starts a new cluster. Clusters whose window has closed are dropped, so the state and the
+    cost per event depend on the clusters still open, not on the history.
+    Active mainshocks sit in a grid over unit vectors with cells as wide as the largest window, so each
+    event only looks at the 27 cells around it.
+    """
+    def __init__(self, id_col='id', time_col='time', lat_col='latitude', lon_col='longitude', mag_col='mag'):
+        self.id_col = id_col
+        self.time_col = time_col
+        self.lat_col = lat_col
+        self.lon_col = lon_col
+        self.mag_col = mag_col
+        self.cell_size = float(km_to_chord(MAX_WINDOW_KM))
+
+        self.next_cluster_id = 0
+        self.clusters = {}  # cluster id -> mainshock and window, see new_cluster
+        self.cells = defaultdict(set)  # grid cell -> ids of active clusters whose mainshock lies in it
+        self.assigned = {}  # event id -> cluster id, for the events of active clusters
+        self.closing = []  # heap of (window end, cluster id); entries outdated by a new mainshock are skipped
+        self.clock = -math.inf  # time of the latest event seen, in epoch seconds
+
+    def __len__(self):
+        return len(self.clusters)
+
+    def cell(self, vector):
+        return (math.floor(vector[0] / self.cell_size), math.floor(vector[1] / self.cell_size), math.floor(vector[2] / self.cell_size))
+
+    def new_cluster(self, event_id, seconds, lat, lon, mag, vector):
+        cluster_id = self.next_cluster_id
+        self.next_cluster_id += 1
+        self.clusters[cluster_id] = {'events': [], 'size': 0}
+        self.set_mainshock(cluster_id, event_id, seconds, lat, lon, mag, vector)
+        return cluster_id
+
+    def set_mainshock(self, cluster_id, event_id, seconds, lat, lon, mag, vector):
+        cluster = self.clusters[cluster_id]
+        if 'cell' in cluster:
+            self.cells[cluster['cell']].discard(cluster_id)
+        radius_km = window_km(mag)
+        cluster.update(mainshock=event_id, time=seconds, lat=lat, lon=lon, mag=mag, vector=vector, cell=self.cell(vector),
+                       radius_km=radius_km, radius_chord=float(km_to_chord(radius_km)), ends=seconds + window_seconds(mag))
+        self.cells[cluster['cell']].add(cluster_id)
+        heapq.heappush(self.closing, (cluster['ends'], cluster_id))
+
+    def expire(self):
+        # windows close in time, so anything ending before the clock can no longer take events
+        while self.closing and self.closing[0][0] < self.clock:
+            ends, cluster_id = heapq.heappop(self.closing)
+            cluster = self.clusters.get(cluster_id)
+            if cluster is None or cluster['ends'] != ends:
+                continue
+            del self.clusters[cluster_id]
+            self.cells[cluster['cell']].discard(cluster_id)
+            if not self.cells[cluster['cell']]:
+                del self.cells[cluster['cell']]
+            for event_id in cluster['events']:
+                self.assigned.pop(event_id, None)
+
+    def candidates(self, vector):
+        x, y, z = self.cell(vector)
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for dz in (-1, 0, 1):
+                    yield from self.cells.get((x + dx, y + dy, z + dz), ())
+
+    def add_event(self, event_id, seconds, lat, lon, mag, vector):
+        if event_id in self.assigned:
+            # a revision of an event already placed keeps its cluster
+            return self.assigned[event_id]
+
+        best, best_mag = None, -math.inf
+        for cluster_id in self.candidates(vector):
+            cluster = self.clusters[cluster_id]
+            if cluster['time'] <= seconds <= cluster['ends'] and cluster['mag'] > best_mag \
+                    and math.dist(vector, cluster['vector']) <= cluster['radius_chord']:
+                best, best_mag = cluster_id, cluster['mag']
+
+        if best is None:
+            best = self.new_cluster(event_id, seconds, lat, lon, mag, vector)
+        elif mag > best_mag:
+            self.set_mainshock(best, event_id, seconds, lat, lon, mag, vector)
+
+        cluster = self.clusters[best]
+        cluster['events'].append(event_id)
+        cluster['size'] += 1
+        self.assigned[event_id] = best
+        return best
+
+    def assign(self, df):
+        """
+        Returns the cluster_id of every event of df (a Series aligned with it), processing the events in time order.
+        """
+        if df.empty:
+            return pd.Series(dtype='int64', index=df.index)
+
+        seconds = pd.to_datetime(df[self.time_col], utc=True).astype('int64').to_numpy() / 1e9
+        lat = df[self.lat_col].to_numpy(dtype=float)
+        lon = df[self.lon_col].to_numpy(dtype=float)
+        mag = df[self.mag_col].fillna(0).to_numpy(dtype=float)
+        vectors = to_unit_vectors(lat, lon).tolist()
+        ids = df[self.id_col].to_numpy()
+
+        cluster_ids = np.empty(len(df), dtype='int64')
+        for position in np.argsort(seconds, kind='stable'):
+            if seconds[position] > self.clock:
+                self.clock = seconds[position]
+                self.expire()
+            cluster_ids[position] = self.add_event(ids[position], seconds[position], lat[position], lon[position], mag[position], vectors[position])
+        return pd.Series(cluster_ids, index=df.index, name='cluster_id')
+
+    def active_clusters(self):
+        """
+        The open sequences: mainshock, its magnitude and position, event count and when the window closes.
+        """
+        return pd.DataFrame([
+            {'cluster_id': cluster_id, 'mainshock': c['mainshock'], 'mag': c['mag'], 'latitude': c['lat'], 'longitude': c['lon'],
+             'events': c['size'], 'window_km': c['radius_km'], 'window_ends': pd.Timestamp(c['ends'], unit='s', tz='UTC')}
+            for cluster_id, c in self.clusters.items()
+        ])
@@ -1,32 +1,37 @@
+import argparse
+import logging
 import os
+import sys
 import pandas as pd
 
-def extract_subarea(place):
-    return place[0]
-
-
-def extract_area(place):
-    return place[-1]
-
-
-def extract_date(time):
-    return str(time).split(' ')[0]
-
-
-def extract_weekday(time):
-    date = extract_date(time)
-    return date + ' - ' + str(time.weekday())
-
-
-def extract_hour(time):
-    t = str(time).split(' ')
-    return t[0] + ' - ' + t[1].split(':')[0]
-
-
-
-def fetch_eq_data(period='daily', region='Worldwide', min_mag=1):
-    # Where we are getting data from
-    url = 'https://earthquake.usgs.gov/earthquakes/feed/v1.0/summary/{}.csv'
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'etl_pipeline'))
+from geocoding import ReverseGeocoder, GEOCODE_COLUMNS, ISO3_CODES
+from eq_store import EarthquakeStore
+from feeds import FEED_URL, ingest_feeds
+from eq_features import add_place_columns
+from clustering import SequenceClusterer
+from historical_links import link_history
+
+
+def add_geocode_info(df, geocoder=None):
+    # country, country_code, city and state from the coordinates, through the shared geocode cache,
+    # and iso, the warehouse's alpha-3 code of the country
+    # (a geocoder opened here is closed again, one passed in is left open for the caller)
+    own_geocoder = geocoder is None
+    geocoder = geocoder or ReverseGeocoder()
+    try:
+        df[GEOCODE_COLUMNS] = geocoder.lookup(df['latitude'], df['longitude'])
+    finally:
+        if own_geocoder:
+            geocoder.close()
+    df['iso'] = df['country_code'].map(ISO3_CODES)
+    return df
+
+
+def fetch_eq_data(period='daily', region='Worldwide', min_mag=1, geocode=False, extra_feeds=(), cluster=False, history=False):
+    # Where we are getting data from, extra_feeds (e.g. 'significant_month') are fetched alongside and merged on the event id.
+    # A CSV extra feed (e.g. 'all_day.csv') adds the error columns the GeoJSON feeds do not carry
+    url = 'https://earthquake.usgs.gov/earthquakes/feed/v1.0/summary/{}.geojson'
 
     if period == 'weekly':
         new_url = url.format('all_week')
@@ -36,13 +41,25 @@ def fetch_eq_data(period='daily', region='Worldwide', min_mag=1):
         new_url = url.format('all_day')
 
 
-    df_earthquake = pd.read_csv(new_url)
-    
-    # Extracting sub-area in place cols
-    place_list = df_earthquake['place'].str.split(', ')    
-    df_earthquake['sub_area'] = place_list.apply(extract_subarea)
-    df_earthquake['area'] = place_list.apply(extract_area)
-    df_earthquake = df_earthquake.drop(columns=['place'], axis=1)
+    df_earthquake = ingest_feeds([new_url] + [FEED_URL.format(feed) if feed.endswith('.csv') else url.format(feed) for feed in extra_feeds])
+
+    df_earthquake = clean_eq_data(df_earthquake, region=region, min_mag=min_mag, geocode=geocode)
+
+    # Mainshock/aftershock sequences: events of the same sequence share a cluster_id
+    if cluster:
+        df_earthquake['cluster_id'] = SequenceClusterer().assign(df_earthquake)
+
+    # Deaths, affected and damages of past earthquakes nearby, from the warehouse history kept in memory
+    if history:
+        df_earthquake = link_history(df_earthquake)
+
+    return df_earthquake
+
+
+def clean_eq_data(df_earthquake, region='Worldwide', min_mag=1, geocode=False):
+    # Cleans a raw USGS feed, shared by fetch_eq_data and the feed poller
+    # Extracting sub-area and area (categoricals) from the place text
+    df_earthquake = add_place_columns(df_earthquake)
 
     # Filtering data based on min. mag threshold
     if isinstance(min_mag, int) and min_mag > 0:
@@ -52,6 +69,10 @@ def fetch_eq_data(period='daily', region='Worldwide', min_mag=1):
 
     # Converting 'time' to pd datetime
     df_earthquake['time'] = pd.to_datetime(df_earthquake['time'])
+
+    # Country of each event from its coordinates rather than the 'place' text
+    if geocode:
+        df_earthquake = add_geocode_info(df_earthquake)
     
     # Setting lat and long to some default if not found
     if region in df_earthquake['area'].to_list():
@@ -68,20 +89,68 @@ def fetch_eq_data(period='daily', region='Worldwide', min_mag=1):
 
 
 
-def store_eq_data(df, folder='API_data', filename='earthquake_data.csv'):
+def store_eq_data(df, folder='API_data', filename='earthquake_data.sqlite', index=None):
+    # index: optional EarthquakeIndex kept in step with the stored events
     if not os.path.exists(folder):
         os.makedirs(folder)
 
     filepath = os.path.join(folder, filename)
-    if os.path.exists(filepath):
-        existing_df = pd.read_csv(filepath)
-        combined_df = pd.concat([existing_df, df])
-        combined_df = combined_df.drop_duplicates()
+    legacy_csv = os.path.join(folder, 'earthquake_data.csv')
+    first_write = not os.path.exists(filepath)
+
+    # Upsert on the event id: only this poll's rows are written, newer 'updated' versions replace older ones
+    store = EarthquakeStore(filepath)
+    try:
+        if first_write and os.path.exists(legacy_csv):
+            print(f"{store.import_csv(legacy_csv)} events imported from {legacy_csv}")
+        changed = store.upsert(df)
+    finally:
+        store.close()
+    print(f"{changed} new or updated events stored in {filepath}")
+
+    if index is not None:
+        print(f"{index.add(df)} new or updated events added to the spatial index")
+
+
+def refresh_store_seismicity(conn, folder='API_data', filename='earthquake_data.sqlite'):
+    # Per-country seismicity in the warehouse from the quakes in the store (the last RECENT_QUAKE_DAYS of them),
+    # each counted in the country of its own coordinates
+    from risk_scores import RECENT_QUAKE_DAYS, refresh_seismicity
+
+    store = EarthquakeStore(os.path.join(folder, filename))
+    try:
+        quakes = store.read(since=pd.Timestamp.now(tz='UTC') - pd.Timedelta(days=RECENT_QUAKE_DAYS))
+    finally:
+        store.close()
+    if quakes.empty:
+        return 0
+
+    quakes = add_geocode_info(quakes)
+    unmatched = quakes['iso'].isna().sum()
+    if unmatched:
+        print(f"{unmatched} stored quakes have no country code known to the warehouse and are left out of the seismicity")
+    return refresh_seismicity(conn, quakes)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Fetch the latest USGS earthquakes, or backfill a local catalog dump')
+    parser.add_argument('--backfill', metavar='PATH', help='CSV or GeoJSON catalog dump (optionally .gz) to stream through the pipeline')
+    parser.add_argument('--speed', type=float, default=None, help='replay the dump as a live feed at this multiple of real time')
+    parser.add_argument('--chunksize', type=int, default=100000)
+    parser.add_argument('--risk', action='store_true', help='link the quakes to the warehouse history and refresh the per-country seismicity from the store')
+    args = parser.parse_args()
+
+    if args.backfill:
+        from backfill import run_backfill
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+        run_backfill(args.backfill, speed=args.speed, chunksize=args.chunksize)
     else:
-        combined_df = df
-    combined_df.to_csv(filepath, index=False)
-    print(f"Data stored in {filepath}")
-
-
-df_earthquake=fetch_eq_data('monthly','Worlwide',1)
-store_eq_data(df_earthquake)
\ No newline at end of file
+        df_earthquake=fetch_eq_data('monthly','Worlwide',1, geocode=args.risk, history=args.risk)
+        store_eq_data(df_earthquake)
+        if args.risk:
+            from transform import connect_db
+            conn = connect_db('disasters_dwh')
+            try:
+                print(f"{refresh_store_seismicity(conn)} country/day seismicity groups refreshed")
+            finally:
+                conn.close()
\ No newline at end of file
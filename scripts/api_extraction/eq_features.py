@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+
+# Animation frame keys per period: the time unit events are grouped by and the label format of a frame
+FRAME_COLUMNS = {'daily': 'hours', 'weekly': 'weekday', 'monthly': 'date'}
+FRAME_UNITS = {'daily': ('h', '%Y-%m-%d - %H'), 'weekly': ('D', '%Y-%m-%d'), 'monthly': ('D', '%Y-%m-%d')}
+
+
+# Place text: "16 km ESE of Jovellar, Philippines" -> sub_area "16 km ESE of Jovellar", area "Philippines"
+###########################################################################################################
+def split_place(place):
+    """
+    Returns (sub_area, area) as categoricals: the text before the first ', ' and after the last one.
+    Places without a comma give the same text for both, missing places stay missing.
+    Each distinct place is split once and the result is spread back through the factorized codes.
+    """
+    codes, places = pd.factorize(place)
+    return (to_categorical(codes, [text.partition(', ')[0] for text in places], place.index),
+            to_categorical(codes, [text.rpartition(', ')[2] for text in places], place.index))
+
+
+def to_categorical(codes, values, index):
+    # values holds one entry per code, possibly repeated (many places share an area)
+    value_codes, categories = pd.factorize(np.asarray(values, dtype=object))
+    codes = np.where(codes >= 0, value_codes[np.maximum(codes, 0)] if len(value_codes) else -1, -1)
+    return pd.Series(pd.Categorical.from_codes(codes, categories=categories), index=index)
+
+
+def add_place_columns(df):
+    df['sub_area'], df['area'] = split_place(df['place'])
+    return df.drop(columns=['place'])
+
+
+# Frame keys: one label per hour or day, formatted once per distinct value instead of once per event
+######################################################################################################
+def frame_keys(times, period='daily'):
+    """
+    Labels the animation frame of every event: 'YYYY-MM-DD - HH' (daily), 'YYYY-MM-DD - weekday' (weekly,
+    Monday is 0) or 'YYYY-MM-DD' (monthly).
+    """
+    unit, label_format = FRAME_UNITS.get(period, FRAME_UNITS['daily'])
+    codes, frames = pd.factorize(times.dt.floor(unit))
+    labels = frames.strftime(label_format)
+    if period == 'weekly':
+        labels = labels + ' - ' + frames.weekday.astype(str)
+
+    # code -1 (missing time) picks the trailing None
+    labels = np.append(np.asarray(labels, dtype=object), None)
+    return pd.Series(labels[codes], index=times.index)
+
+
+def add_frame_column(df, period='daily'):
+    """
+    Adds the animation frame column of the period ('hours', 'weekday' or 'date') and returns its name.
+    """
+    column = FRAME_COLUMNS.get(period, FRAME_COLUMNS['daily'])
+    df[column] = frame_keys(df['time'], period)
+    return column
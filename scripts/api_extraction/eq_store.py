@@ -0,0 +1,83 @@
+import sqlite3
+import pandas as pd
+
+
+class EarthquakeStore:
+    """
+    Append-optimized store of USGS events in a local SQLite table keyed on the event id.
+    Each write upserts only the given rows: new ids are inserted, known ids are replaced when the
+    incoming 'updated' timestamp is newer (last writer wins), so a poll costs time in proportion
+    to its own records rather than to the whole history.
+    """
+    def __init__(self, path, table='earthquakes'):
+        self.path = path
+        self.table = table
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(f'CREATE TABLE IF NOT EXISTS {self.table} ("id" TEXT PRIMARY KEY, "updated" TEXT)')
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def columns(self):
+        return [row[1] for row in self.conn.execute(f'PRAGMA table_info({self.table})')]
+
+    def add_columns(self, columns):
+        # new columns in the feed (e.g. geocoding results) are added on the fly, older rows keep NULL
+        known = set(self.columns())
+        for col in columns:
+            if col not in known:
+                self.conn.execute(f'ALTER TABLE {self.table} ADD COLUMN "{col}"')
+
+    def upsert(self, df):
+        """
+        Writes the events of df and returns how many rows were inserted or updated.
+        """
+        if df.empty:
+            return 0
+
+        # timestamps are stored as text; USGS ISO 'updated' values compare correctly as strings
+        rows = df.drop_duplicates(subset='id', keep='last').copy()
+        for col in rows.select_dtypes(include=['datetime', 'datetimetz']).columns:
+            rows[col] = rows[col].astype(str).where(rows[col].notna(), None)
+        if 'updated' in rows and pd.api.types.is_numeric_dtype(rows['updated']):
+            rows['updated'] = pd.to_datetime(rows['updated'], unit='ms', utc=True).dt.strftime('%Y-%m-%dT%H:%M:%S.%f').str[:-3] + 'Z'
+        rows = rows.astype(object).where(rows.notna(), None)
+
+        columns = list(rows.columns)
+        self.add_columns(columns)
+        column_list = ', '.join(f'"{col}"' for col in columns)
+        placeholders = ', '.join('?' for _ in columns)
+        assignments = ', '.join(f'"{col}" = excluded."{col}"' for col in columns if col != 'id')
+
+        before = self.conn.total_changes
+        self.conn.executemany(f"""
+            INSERT INTO {self.table} ({column_list}) VALUES ({placeholders})
+            ON CONFLICT ("id") DO UPDATE SET {assignments}
+            WHERE excluded."updated" > {self.table}."updated" OR {self.table}."updated" IS NULL
+        """, rows.itertuples(index=False, name=None))
+        self.conn.commit()
+        return self.conn.total_changes - before
+
+    def read(self, since=None):
+        """
+        Returns the stored events as a DataFrame, optionally only those with 'time' at or after since.
+        """
+        if since is None:
+            return pd.read_sql_query(f'SELECT * FROM {self.table}', self.conn)
+        return pd.read_sql_query(f'SELECT * FROM {self.table} WHERE "time" >= ?', self.conn, params=(str(since),))
+
+    def import_csv(self, path, chunksize=100000):
+        """
+        One-off import of an earthquake CSV written by the previous store_eq_data.
+        """
+        total = 0
+        for chunk in pd.read_csv(path, chunksize=chunksize):
+            total += self.upsert(chunk)
+        return total
+
+    def export_csv(self, path):
+        """
+        Writes the store as a single CSV for consumers that read files (e.g. the dashboard).
+        """
+        self.read().to_csv(path, index=False)
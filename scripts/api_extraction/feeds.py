@@ -0,0 +1,196 @@
+import asyncio
+import codecs
+import gzip
+import json
+import logging
+import os
+import re
+import urllib.request
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+FEED_URL = 'https://earthquake.usgs.gov/earthquakes/feed/v1.0/summary/{}'
+FEED_WORKERS = int(os.getenv('FEED_WORKERS', 4))  # feeds downloaded at the same time
+READ_SIZE = 64 * 1024
+
+# Properties kept from GeoJSON features, with the CSV feed's column names.
+# Numbers go to float arrays, everything else to lists.
+NUMERIC_FIELDS = ['latitude', 'longitude', 'depth', 'mag', 'nst', 'gap', 'dmin', 'rms', 'sig', 'felt', 'tsunami']
+TEXT_FIELDS = ['id', 'time', 'updated', 'place', 'magType', 'net', 'type', 'status', 'alert']
+# Columns of the CSV feed that the summary GeoJSON does not carry. They are read when a feature has them
+# and only emitted if some feature did, so merge_feeds can fill them from a CSV copy of the event.
+OPTIONAL_NUMERIC_FIELDS = ['horizontalError', 'depthError', 'magError', 'magNst']
+OPTIONAL_TEXT_FIELDS = ['locationSource', 'magSource']
+
+
+def ms_to_iso(values):
+    # epoch milliseconds -> the ISO text used by the CSV feeds, e.g. 2024-08-24T10:43:49.040Z
+    times = pd.to_datetime(pd.Series(values, dtype='float64'), unit='ms', utc=True)
+    return (times.dt.strftime('%Y-%m-%dT%H:%M:%S.%f').str[:-3] + 'Z').where(times.notna(), None)
+
+
+# Streaming GeoJSON parser: features are decoded one at a time as the bytes arrive
+# and appended to a columnar buffer, so the whole document is never held as Python objects
+##############################################################################################
+class GeoJSONStreamParser:
+    features_start = re.compile(r'"features"\s*:\s*\[')
+
+    def __init__(self):
+        self.decoder = json.JSONDecoder()
+        self.text = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.buffer = ''
+        self.in_features = False
+        self.done = False
+        self.columns = self.empty_columns()
+        self.found = set()
+
+    def __len__(self):
+        return len(self.columns['id'])
+
+    @staticmethod
+    def empty_columns():
+        columns = {field: array('d') for field in NUMERIC_FIELDS + OPTIONAL_NUMERIC_FIELDS}
+        columns.update({field: [] for field in TEXT_FIELDS + OPTIONAL_TEXT_FIELDS})
+        return columns
+
+    def feed(self, chunk):
+        if self.done:
+            return
+        self.buffer += self.text.decode(chunk)
+
+        if not self.in_features:
+            match = self.features_start.search(self.buffer)
+            if match is None:
+                return
+            self.in_features = True
+            self.buffer = self.buffer[match.end():]
+
+        position = 0
+        while True:
+            # skip separators between features
+            while position < len(self.buffer) and self.buffer[position] in ' \t\r\n,':
+                position += 1
+            if position < len(self.buffer) and self.buffer[position] == ']':
+                self.done = True
+                break
+            try:
+                feature, position = self.decoder.raw_decode(self.buffer, position)
+            except json.JSONDecodeError:
+                # the feature continues in the next chunk
+                break
+            self.append(feature)
+        self.buffer = self.buffer[position:]
+
+    def append(self, feature):
+        properties = feature.get('properties') or {}
+        coordinates = ((feature.get('geometry') or {}).get('coordinates') or []) + [None, None, None]
+        values = dict(properties, id=feature.get('id'), longitude=coordinates[0], latitude=coordinates[1], depth=coordinates[2])
+        for field in NUMERIC_FIELDS + OPTIONAL_NUMERIC_FIELDS:
+            value = values.get(field)
+            self.columns[field].append(np.nan if value is None else float(value))
+        for field in TEXT_FIELDS + OPTIONAL_TEXT_FIELDS:
+            self.columns[field].append(values.get(field))
+        self.found.update(field for field in OPTIONAL_NUMERIC_FIELDS + OPTIONAL_TEXT_FIELDS if field in properties)
+
+    def drain(self):
+        """
+        Returns the features parsed so far as a DataFrame and empties the buffer, so large documents
+        can be consumed in bounded chunks.
+        """
+        columns, self.columns = self.columns, self.empty_columns()
+        fields = TEXT_FIELDS[:1] + NUMERIC_FIELDS + TEXT_FIELDS[1:]
+        fields += [field for field in OPTIONAL_NUMERIC_FIELDS + OPTIONAL_TEXT_FIELDS if field in self.found]
+        df = pd.DataFrame({field: np.frombuffer(columns[field], dtype='float64') if isinstance(columns[field], array) else columns[field]
+                           for field in fields})
+        df['time'] = ms_to_iso(df['time'])
+        df['updated'] = ms_to_iso(df['updated'])
+        return df
+
+    def close(self):
+        self.feed(b'')
+        if self.in_features and not self.done:
+            raise ValueError("GeoJSON feed ended in the middle of its features")
+        return self.drain()
+
+
+# Fetching feeds concurrently: blocking downloads run on a bounded thread pool driven by asyncio
+#################################################################################################
+def open_feed(url, timeout):
+    response = urllib.request.urlopen(urllib.request.Request(url, headers={'Accept-Encoding': 'gzip'}), timeout=timeout)
+    if response.headers.get('Content-Encoding') == 'gzip':
+        return gzip.GzipFile(fileobj=response)
+    return response
+
+
+def read_feed(url, timeout=30):
+    """
+    Downloads one USGS summary feed into a DataFrame with the CSV feed's column names.
+    GeoJSON feeds are parsed as a stream, CSV feeds are read straight from the response.
+    """
+    with open_feed(url, timeout) as stream:
+        if not url.endswith('.geojson'):
+            return pd.read_csv(stream)
+        parser = GeoJSONStreamParser()
+        while chunk := stream.read(READ_SIZE):
+            parser.feed(chunk)
+        return parser.close()
+
+
+async def fetch_feeds(urls, max_workers=FEED_WORKERS, timeout=30):
+    """
+    Downloads the feeds concurrently, at most max_workers at a time. Returns {url: DataFrame}
+    for the feeds that could be read; failures are logged and left out.
+    """
+    loop = asyncio.get_running_loop()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = await asyncio.gather(*(loop.run_in_executor(executor, read_feed, url, timeout) for url in urls), return_exceptions=True)
+
+    frames = {}
+    for url, result in zip(urls, results):
+        if isinstance(result, Exception):
+            logger.warning(f"Could not read {url}: {result}")
+        else:
+            frames[url] = result
+    return frames
+
+
+def merge_feeds(frames):
+    """
+    Merges feeds on the event id. The most recently updated copy of each event wins as a whole; only
+    columns its feed does not carry (e.g. 'sig' from GeoJSON, 'magError' from CSV) are filled in from
+    the latest copy of a feed that does.
+    """
+    frames = [df for df in frames if len(df)]
+    if not frames:
+        return pd.DataFrame(columns=['id'])
+    merged = pd.concat([df.assign(_feed=i) for i, df in enumerate(frames)], ignore_index=True).sort_values('updated', kind='stable')
+    latest = merged.drop_duplicates('id', keep='last').set_index('id')
+
+    for col in latest.columns.drop('_feed'):
+        carried_by = [i for i, df in enumerate(frames) if col in df.columns]
+        missing = ~latest['_feed'].isin(carried_by)
+        if missing.any():
+            copies = merged[merged['_feed'].isin(carried_by)].drop_duplicates('id', keep='last').set_index('id')[col]
+            latest.loc[missing, col] = latest.index[missing].map(copies)
+    return latest.drop(columns='_feed').reset_index()
+
+
+def ingest_feeds(urls, max_workers=FEED_WORKERS, timeout=30):
+    """
+    Fetches the given feed URLs concurrently and returns one frame with every event once.
+    """
+    frames = asyncio.run(fetch_feeds(urls, max_workers=max_workers, timeout=timeout))
+    if not frames:
+        raise RuntimeError(f"None of the feeds could be read: {urls}")
+    df = merge_feeds(list(frames.values()))
+    logger.info(f"Ingested {len(df)} events from {len(frames)} feeds ({sum(len(frame) for frame in frames.values())} rows)")
+    return df
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    print(ingest_feeds([FEED_URL.format(feed) for feed in ('significant_month.geojson', '4.5_week.geojson', 'all_hour.geojson')]))
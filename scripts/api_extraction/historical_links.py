@@ -0,0 +1,158 @@
+import logging
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'etl_pipeline'))
+from spatial_index import to_unit_vectors, km_to_chord, chord_to_km
+
+logger = logging.getLogger(__name__)
+
+HISTORY_DB = os.getenv('HISTORY_DB', 'disasters_dwh')
+HISTORY_TTL = int(os.getenv('HISTORY_TTL', 24 * 3600))  # seconds before the warehouse is read again
+LINK_RADIUS_KM = 300
+LINK_MAG_WINDOW = 1.0  # historical magnitudes within this many units of the live one
+COUNTRY_MATCH_KM = 500  # a live quake takes the country of the nearest located historical earthquake within this distance
+
+# Every earthquake of the warehouse, with its impact, location and coordinates, read in one query.
+# Earthquake types are the 'Earthquake' member of dim_disaster_types and everything below it.
+HISTORY_QUERY = """--sql
+    WITH RECURSIVE earthquake_types AS (
+        SELECT id FROM dim_disaster_types WHERE name = 'Earthquake'
+        UNION ALL
+        SELECT t.id FROM dim_disaster_types t JOIN earthquake_types e ON t.parent_id = e.id
+    )
+    SELECT f.id, f.dis_mag_value AS magnitude, f.latitude, f.longitude,
+           f.total_deaths, f.total_affected, f.total_damages,
+           l.country, l.iso, l.location, d.year
+    FROM fact_disasters f
+    JOIN earthquake_types e ON f.type_id = e.id
+    LEFT JOIN dim_locations l ON f.location_id = l.location_id
+    LEFT JOIN dim_dates d ON f.starting_date_id = d.date_id;
+"""
+
+IMPACT_COLUMNS = ['total_deaths', 'total_affected', 'total_damages']
+
+
+class HistoricalLinker:
+    """
+    Links live earthquakes to the historical earthquake disasters of the warehouse.
+    The history is read once and kept in memory: located events in a KD-tree over unit vectors,
+    events without coordinates summed per country (ISO). Linking a batch of live quakes is then
+    one tree query and a few array reductions, with no SQL on the live path.
+    """
+    def __init__(self, history):
+        history = history.reset_index(drop=True)
+        for column in ['magnitude', 'latitude', 'longitude', 'year'] + IMPACT_COLUMNS:
+            history[column] = pd.to_numeric(history[column], errors='coerce')
+
+        located = history[['latitude', 'longitude']].notna().all(axis=1)
+        self.events = history[located].reset_index(drop=True)
+        self.tree = cKDTree(to_unit_vectors(self.events['latitude'], self.events['longitude'])) if len(self.events) else None
+        self.magnitude = self.events['magnitude'].to_numpy(dtype=float)
+        self.impacts = self.events[IMPACT_COLUMNS].fillna(0).to_numpy(dtype=float)
+        self.iso = self.events['iso'].to_numpy(dtype=object)
+
+        # events that cannot be placed on the map are still counted for their country
+        by_country = history[~located].groupby('iso')
+        self.countries = pd.concat([by_country.size().rename('events'), by_country[IMPACT_COLUMNS].sum()], axis=1)
+        self.loaded_at = time.time()
+        logger.info(f"Indexed {len(self.events)} located historical earthquakes and {int(self.countries['events'].sum())} "
+                    f"more in {len(self.countries)} countries")
+
+    def __len__(self):
+        return len(self.events) + int(self.countries['events'].sum())
+
+    @classmethod
+    def from_warehouse(cls, dbname=HISTORY_DB, query=HISTORY_QUERY):
+        from transform import get_data_from_db
+        history = get_data_from_db(query, dbname)
+        if history is None:
+            raise RuntimeError(f"Could not read the historical earthquakes from {dbname}")
+        return cls(history)
+
+    def link(self, df, radius_km=LINK_RADIUS_KM, mag_window=LINK_MAG_WINDOW, lat_col='latitude', lon_col='longitude', mag_col='mag'):
+        """
+        Historical context of every live quake of df (a DataFrame aligned with it):
+        the count and summed deaths, affected and damages of the historical earthquakes within radius_km
+        whose magnitude is within mag_window (unknown magnitudes always match), the closest of them,
+        and the country totals of the historical earthquakes without coordinates.
+        """
+        context = pd.DataFrame(index=df.index)
+        context['hist_events'] = 0
+        for column in IMPACT_COLUMNS:
+            context['hist_' + column] = 0.0
+        context['hist_nearest_id'] = None
+        context['hist_nearest_km'] = np.nan
+        context['hist_nearest_year'] = np.nan
+        context['hist_iso'] = None
+        if df.empty or self.tree is None:
+            return self.add_country_totals(context)
+
+        vectors = to_unit_vectors(df[lat_col], df[lon_col])
+        placed = np.isfinite(vectors).all(axis=1)
+        mags = df[mag_col].to_numpy(dtype=float)
+
+        # country of the quake: that of the closest located historical earthquake
+        nearest = self.tree.query(vectors[placed], distance_upper_bound=float(km_to_chord(COUNTRY_MATCH_KM)))[1]
+        found = nearest < len(self.events)
+        iso = np.full(len(df), None, dtype=object)
+        iso[np.flatnonzero(placed)[found]] = self.iso[nearest[found]]
+        context['hist_iso'] = iso
+
+        # every historical event in the radius, flattened to (quake, event) pairs
+        neighbours = self.tree.query_ball_point(vectors[placed], r=float(km_to_chord(radius_km)))
+        counts = np.fromiter(map(len, neighbours), dtype=np.int64, count=len(neighbours))
+        quakes = np.repeat(np.flatnonzero(placed), counts)
+        events = np.fromiter((i for points in neighbours for i in points), dtype=np.int64, count=counts.sum())
+        history_mag = self.magnitude[events]
+        keep = np.isnan(history_mag) | np.isnan(mags[quakes]) | (np.abs(history_mag - mags[quakes]) <= mag_window)
+        quakes, events = quakes[keep], events[keep]
+        if not len(events):
+            return self.add_country_totals(context)
+
+        n = len(df)
+        context['hist_events'] = np.bincount(quakes, minlength=n)
+        for position, column in enumerate(IMPACT_COLUMNS):
+            context['hist_' + column] = np.bincount(quakes, weights=self.impacts[events, position], minlength=n)
+
+        # closest match per quake: sort the pairs by distance and keep the first one of each quake
+        km = chord_to_km(np.linalg.norm(vectors[quakes] - self.tree.data[events], axis=1))
+        order = np.lexsort((km, quakes))
+        first = order[np.unique(quakes[order], return_index=True)[1]]
+        nearest_id, nearest_km, nearest_year = np.full(n, None, dtype=object), np.full(n, np.nan), np.full(n, np.nan)
+        nearest_id[quakes[first]] = self.events['id'].to_numpy(dtype=object)[events[first]]
+        nearest_km[quakes[first]] = km[first]
+        nearest_year[quakes[first]] = self.events['year'].to_numpy(dtype=float)[events[first]]
+        context['hist_nearest_id'], context['hist_nearest_km'], context['hist_nearest_year'] = nearest_id, nearest_km, nearest_year
+        return self.add_country_totals(context)
+
+    def add_country_totals(self, context):
+        countries = self.countries.reindex(context['hist_iso'])
+        context['country_events'] = countries['events'].fillna(0).to_numpy(dtype='int64')
+        for column in IMPACT_COLUMNS:
+            context['country_' + column] = countries[column].fillna(0).to_numpy()
+        return context
+
+
+# One linker per process, read again from the warehouse once it is older than HISTORY_TTL
+##########################################################################################
+cached_linker = None
+
+
+def get_linker(dbname=HISTORY_DB, max_age=HISTORY_TTL):
+    global cached_linker
+    if cached_linker is None or time.time() - cached_linker.loaded_at > max_age:
+        cached_linker = HistoricalLinker.from_warehouse(dbname)
+    return cached_linker
+
+
+def link_history(df, linker=None, **options):
+    """
+    Adds the historical context columns of HistoricalLinker.link to df.
+    """
+    linker = linker or get_linker()
+    return df.join(linker.link(df, **options))
@@ -0,0 +1,185 @@
+import gzip
+import io
+import logging
+import os
+import time
+import urllib.error
+import urllib.request
+import numpy as np
+import pandas as pd
+
+from earthquakes import clean_eq_data, store_eq_data
+
+logger = logging.getLogger(__name__)
+
+FEED_URL = os.getenv('USGS_FEED_URL', 'https://earthquake.usgs.gov/earthquakes/feed/v1.0/summary/{}.csv')
+
+# USGS summary feeds from smallest to largest, with the time span each one covers (seconds)
+FEEDS = [
+    ('all_hour', 3600),
+    ('all_day', 24 * 3600),
+    ('all_week', 7 * 24 * 3600),
+    ('all_month', 30 * 24 * 3600),
+]
+
+# Poll cadence (seconds): USGS regenerates the feeds about once a minute
+MIN_INTERVAL = 10  # right after a large event, aftershocks and magnitude revisions follow quickly
+BASE_INTERVAL = 60
+MAX_INTERVAL = 120  # a 304 costs almost nothing, so quiet periods still get polled every couple of minutes
+BACKOFF = 1.5  # the interval grows by this factor after every poll that brings nothing new
+ALERT_MAGNITUDE = 4.5
+FEED_MARGIN = 0.9  # a feed is used only when the gap is within this share of its span, leaving room for late updates
+
+
+# Choosing the smallest feed that covers the time since the last poll
+######################################################################
+def pick_feed(gap_seconds, feeds=FEEDS):
+    for name, span in feeds:
+        if gap_seconds <= span * FEED_MARGIN:
+            return name
+    return feeds[-1][0]
+
+
+class FeedPoller:
+    """
+    Long-running poller of the USGS summary feeds.
+    Each poll downloads the smallest feed covering the time since the previous successful poll, with
+    If-None-Match/If-Modified-Since headers so unchanged feeds come back as an empty 304.
+    Only events that are new, or carry a newer 'updated' value than already seen, are passed to on_events.
+    The interval drops to min_interval after an event of alert_magnitude or more and grows by BACKOFF
+    (up to max_interval) while polls bring nothing new.
+    """
+    def __init__(self, on_events, url=FEED_URL, feeds=FEEDS, min_interval=MIN_INTERVAL, base_interval=BASE_INTERVAL,
+                 max_interval=MAX_INTERVAL, alert_magnitude=ALERT_MAGNITUDE, timeout=30):
+        self.on_events = on_events
+        self.url = url
+        self.feeds = feeds
+        self.min_interval = min_interval
+        self.base_interval = base_interval
+        self.max_interval = max_interval
+        self.alert_magnitude = alert_magnitude
+        self.timeout = timeout
+
+        self.interval = base_interval
+        self.last_poll = None  # time of the last successful poll
+        self.validators = {}  # feed -> (ETag, Last-Modified) of the last 200 response
+        self.seen = {}  # event id -> 'updated' value last passed on
+        self.latencies = []  # seconds between an event's 'updated' time and its hand-off to on_events
+        self.stats = {'polls': 0, 'not_modified': 0, 'errors': 0, 'bytes': 0, 'events': 0}
+
+    def request(self, feed):
+        """
+        Conditional GET of one feed. Returns the CSV bytes, or None when the feed has not changed.
+        """
+        headers = {'Accept-Encoding': 'gzip'}
+        etag, last_modified = self.validators.get(feed, (None, None))
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+
+        try:
+            with urllib.request.urlopen(urllib.request.Request(self.url.format(feed), headers=headers), timeout=self.timeout) as response:
+                body = response.read()
+                self.stats['bytes'] += len(body)
+                if response.headers.get('Content-Encoding') == 'gzip':
+                    body = gzip.decompress(body)
+                self.validators[feed] = (response.headers.get('ETag'), response.headers.get('Last-Modified'))
+                return body
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return None
+            raise
+
+    def new_events(self, df):
+        """
+        Keeps the rows whose id was never seen or whose 'updated' value is newer than the one seen.
+        """
+        previous = df['id'].map(self.seen)
+        fresh = df[previous.isna() | (df['updated'] > previous)].copy()
+        self.seen.update(zip(fresh['id'], fresh['updated']))
+        return fresh
+
+    def forget_old_events(self, df):
+        # events older than the largest feed can no longer come back, so a full feed bounds the seen set
+        if len(df):
+            self.seen = dict(zip(df['id'], df['updated']))
+
+    def adapt_interval(self, fresh):
+        if len(fresh) and fresh['mag'].max() >= self.alert_magnitude:
+            self.interval = self.min_interval
+        elif len(fresh):
+            self.interval = min(self.interval, self.base_interval)
+        else:
+            self.interval = min(self.interval * BACKOFF, self.max_interval)
+
+    def poll(self):
+        """
+        Runs one poll and returns the new or updated events passed to on_events.
+        """
+        now = time.time()
+        gap = np.inf if self.last_poll is None else now - self.last_poll
+        feed = pick_feed(gap, self.feeds)
+        if gap != np.inf and gap > self.feeds[-1][1]:
+            logger.warning(f"{gap:.0f}s since the last poll is more than {feed} covers, events may have been missed")
+        self.stats['polls'] += 1
+
+        try:
+            body = self.request(feed)
+        except (urllib.error.URLError, OSError) as e:
+            self.stats['errors'] += 1
+            self.interval = min(self.interval * BACKOFF, self.max_interval)
+            logger.warning(f"Polling {feed} failed: {e}")
+            return pd.DataFrame()
+        self.last_poll = now
+
+        if body is None:
+            self.stats['not_modified'] += 1
+            self.adapt_interval(pd.DataFrame())
+            logger.info(f"{feed} not modified, next poll in {self.interval:.0f}s")
+            return pd.DataFrame()
+
+        df = pd.read_csv(io.BytesIO(body))
+        fresh = self.new_events(df)
+        if feed == self.feeds[-1][0]:
+            self.forget_old_events(df)
+
+        if len(fresh):
+            self.on_events(fresh)
+            ingested = time.time()
+            published = pd.to_datetime(fresh['updated'], format='ISO8601', utc=True).astype('int64') / 1e9
+            self.latencies.extend(ingested - published)
+            self.stats['events'] += len(fresh)
+
+        self.adapt_interval(fresh)
+        logger.info(f"{feed}: {len(fresh)} new or updated events of {len(df)}, next poll in {self.interval:.0f}s")
+        return fresh
+
+    def run(self, max_polls=None, duration=None):
+        """
+        Polls until max_polls polls or duration seconds have passed (forever by default).
+        """
+        start = time.time()
+        while (max_polls is None or self.stats['polls'] < max_polls) and (duration is None or time.time() - start < duration):
+            self.poll()
+            time.sleep(self.interval)
+
+    def latency_summary(self):
+        """
+        Median, 95th percentile and maximum detection latency in seconds, from publish ('updated') to ingest.
+        """
+        if not self.latencies:
+            return {'median': None, 'p95': None, 'max': None}
+        latencies = np.asarray(self.latencies)
+        return {'median': np.median(latencies), 'p95': np.percentile(latencies, 95), 'max': latencies.max()}
+
+
+def store_new_events(df, min_mag=1):
+    df = clean_eq_data(df, min_mag=min_mag)
+    if len(df):
+        store_eq_data(df)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    FeedPoller(on_events=store_new_events).run()
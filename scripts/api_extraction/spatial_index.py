@@ -0,0 +1,218 @@
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Events appended after the last tree build are scanned directly until they pass this share of the index
+REBUILD_FRACTION = 0.1
+MIN_PENDING = 1000
+
+
+# Geometry helpers: points on the unit sphere, where straight-line (chord) distance
+# grows with great-circle distance, so a KD-tree over them answers haversine queries
+#####################################################################################
+def to_unit_vectors(lat, lon):
+    lat, lon = np.radians(np.asarray(lat, dtype=float)), np.radians(np.asarray(lon, dtype=float))
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+def km_to_chord(km):
+    return 2 * np.sin(np.minimum(np.asarray(km, dtype=float), np.pi * EARTH_RADIUS_KM) / (2 * EARTH_RADIUS_KM))
+
+
+def chord_to_km(chord):
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(np.asarray(chord, dtype=float) / 2, 0, 1))
+
+
+def event_times(values):
+    # 'updated' values as UTC timestamps, from epoch milliseconds (GeoJSON) or ISO text (CSV feeds, the store)
+    if pd.api.types.is_numeric_dtype(values):
+        return pd.to_datetime(values, unit='ms', utc=True)
+    return pd.to_datetime(values, utc=True, errors='coerce', format='ISO8601')
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+class EarthquakeIndex:
+    """
+    Radius and nearest-neighbour queries over earthquake epicentres (latitude/longitude in degrees).
+    Events are kept in a KD-tree over unit vectors. Events added later go to a small pending buffer
+    that is scanned directly, and the tree is rebuilt once the buffer grows past REBUILD_FRACTION of it.
+    Events are identified by id_col: a copy with a newer updated_col (a USGS revision) replaces the indexed one,
+    whose position is marked dead until the next rebuild, like EarthquakeStore keeps the latest copy.
+    """
+    def __init__(self, df=None, id_col='id', lat_col='latitude', lon_col='longitude', updated_col='updated', rebuild_fraction=REBUILD_FRACTION):
+        self.id_col = id_col
+        self.lat_col = lat_col
+        self.lon_col = lon_col
+        self.updated_col = updated_col
+        self.rebuild_fraction = rebuild_fraction
+        self.known = {}  # id -> (position, updated) of the indexed copy, positions run over the tree events then the pending ones
+        self.alive = np.empty(0, dtype=bool)  # per position, False once the copy was replaced
+
+        self.events = pd.DataFrame()  # events covered by the tree
+        self.points = np.empty((0, 3))
+        self.tree = None
+        self.pending_events = pd.DataFrame()  # events added since the last build
+        self.pending_points = np.empty((0, 3))
+
+        if df is not None:
+            self.add(df)
+            self.rebuild()
+
+    def __len__(self):
+        return int(self.alive.sum())
+
+    def add(self, df):
+        """
+        Adds the events of df that are not indexed yet, and the ones updated since their indexed copy.
+        Returns how many were added.
+        """
+        new_events = df.dropna(subset=[self.lat_col, self.lon_col])
+        has_ids = self.id_col in new_events.columns
+        if has_ids:
+            if self.updated_col in new_events.columns:
+                updated = event_times(new_events[self.updated_col])
+            else:
+                updated = pd.Series(pd.NaT, index=new_events.index, dtype='datetime64[ns, UTC]')
+            # the latest copy of each event in the batch
+            order = updated.sort_values(kind='stable', na_position='first').index
+            new_events, updated = new_events.loc[order], updated.loc[order]
+            latest = ~new_events[self.id_col].duplicated(keep='last').to_numpy()
+            new_events, updated = new_events[latest], updated[latest]
+
+            # dict lookups per new event, so the cost follows the batch and not the index size
+            keep = np.zeros(len(new_events), dtype=bool)
+            replaced = []
+            for i, (event_id, event_time) in enumerate(zip(new_events[self.id_col], updated)):
+                known = self.known.get(event_id)
+                if known is None:
+                    keep[i] = True
+                elif pd.notna(event_time) and (pd.isna(known[1]) or event_time > known[1]):
+                    keep[i] = True
+                    replaced.append(known[0])
+            self.alive[replaced] = False
+            new_events, updated = new_events[keep], updated[keep]
+        if new_events.empty:
+            return 0
+
+        new_events = new_events.reset_index(drop=True)
+        if has_ids:
+            start = len(self.alive)
+            self.known.update((event_id, (start + offset, event_time))
+                              for offset, (event_id, event_time) in enumerate(zip(new_events[self.id_col], updated)))
+        self.alive = np.concatenate([self.alive, np.ones(len(new_events), dtype=bool)])
+        self.pending_events = pd.concat([self.pending_events, new_events], ignore_index=True) if len(self.pending_events) else new_events
+        self.pending_points = np.vstack([self.pending_points, to_unit_vectors(new_events[self.lat_col], new_events[self.lon_col])])
+
+        if len(self.pending_events) > max(MIN_PENDING, self.rebuild_fraction * len(self.events)):
+            self.rebuild()
+        return len(new_events)
+
+    def rebuild(self):
+        """
+        Moves the pending events into the tree and drops the replaced copies.
+        """
+        if len(self.pending_events):
+            self.events = pd.concat([self.events, self.pending_events], ignore_index=True) if len(self.events) else self.pending_events
+            self.points = np.vstack([self.points, self.pending_points])
+            self.pending_events = pd.DataFrame()
+            self.pending_points = np.empty((0, 3))
+        if not self.alive.all():
+            self.events = self.events[self.alive].reset_index(drop=True)
+            self.points = self.points[self.alive]
+            self.alive = np.ones(len(self.events), dtype=bool)
+            if self.id_col in self.events.columns:
+                self.known = {event_id: (position, self.known[event_id][1]) for position, event_id in enumerate(self.events[self.id_col])}
+        self.tree = cKDTree(self.points) if len(self.points) else None
+
+    def rows(self, query, positions, chords):
+        """
+        Builds the result frame: the matching events with the query they answer and their distance in km.
+        """
+        n_indexed = len(self.events)
+        in_tree = positions < n_indexed
+        parts = []
+        for source, mask, offset in ((self.events, in_tree, 0), (self.pending_events, ~in_tree, n_indexed)):
+            if mask.any():
+                part = source.iloc[positions[mask] - offset].reset_index(drop=True)
+                part.insert(0, 'query', query[mask])
+                part['distance_km'] = chord_to_km(chords[mask])
+                parts.append(part)
+        if not parts:
+            columns = self.events.columns if len(self.events.columns) else self.pending_events.columns
+            return pd.DataFrame(columns=['query'] + list(columns) + ['distance_km'])
+        return pd.concat(parts, ignore_index=True).sort_values(['query', 'distance_km'], ignore_index=True)
+
+    def pending_chords(self, vectors):
+        # chord distances from every query to every pending event, the buffer is small by construction
+        return np.linalg.norm(vectors[:, None, :] - self.pending_points[None, :, :], axis=2)
+
+    def query_radius(self, lat, lon, radius_km):
+        """
+        All events within radius_km of each query point. Accepts a single point or arrays of points;
+        the 'query' column gives the position of the point each row answers.
+        """
+        vectors = to_unit_vectors(np.atleast_1d(lat), np.atleast_1d(lon))
+        radius = float(km_to_chord(radius_km))
+        query, positions, chords = [], [], []
+
+        if self.tree is not None:
+            for q, matches in enumerate(self.tree.query_ball_point(vectors, r=radius)):
+                matches = np.asarray(matches, dtype=int)
+                query.append(np.full(len(matches), q))
+                positions.append(matches)
+                chords.append(np.linalg.norm(self.points[matches] - vectors[q], axis=1))
+
+        if len(self.pending_points):
+            distances = self.pending_chords(vectors)
+            q, p = np.nonzero(distances <= radius)
+            query.append(q)
+            positions.append(p + len(self.events))
+            chords.append(distances[q, p])
+
+        if not query:
+            return self.rows(np.empty(0, dtype=int), np.empty(0, dtype=int), np.empty(0))
+        query, positions, chords = np.concatenate(query), np.concatenate(positions), np.concatenate(chords)
+        alive = self.alive[positions]
+        return self.rows(query[alive], positions[alive], chords[alive])
+
+    def query_nearest(self, lat, lon, k=10):
+        """
+        The k events nearest to each query point (e.g. every city of a list), closest first.
+        """
+        vectors = to_unit_vectors(np.atleast_1d(lat), np.atleast_1d(lon))
+        query, positions, chords = [], [], []
+
+        if self.tree is not None:
+            # replaced copies still in the tree are fetched too and dropped below
+            kk = min(k + int((~self.alive[:len(self.events)]).sum()), len(self.points))
+            distances, matches = self.tree.query(vectors, k=kk)
+            query.append(np.repeat(np.arange(len(vectors)), kk))
+            positions.append(np.asarray(matches).reshape(-1))
+            chords.append(np.asarray(distances).reshape(-1))
+
+        if len(self.pending_points):
+            distances = self.pending_chords(vectors)
+            q, p = np.indices(distances.shape)
+            query.append(q.ravel())
+            positions.append(p.ravel() + len(self.events))
+            chords.append(distances.ravel())
+
+        if not query:
+            return self.rows(np.empty(0, dtype=int), np.empty(0, dtype=int), np.empty(0))
+
+        # keep the k closest live candidates per query across the tree and the pending buffer
+        query, positions, chords = np.concatenate(query), np.concatenate(positions), np.concatenate(chords)
+        alive = self.alive[positions]
+        query, positions, chords = query[alive], positions[alive], chords[alive]
+        order = np.lexsort((chords, query))
+        query, positions, chords = query[order], positions[order], chords[order]
+        rank = np.arange(len(query)) - np.searchsorted(query, query)
+        keep = rank < k
+        return self.rows(query[keep], positions[keep], chords[keep])
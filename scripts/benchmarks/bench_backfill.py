@@ -0,0 +1,87 @@
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api_extraction'))
+from backfill import run_backfill
+from spatial_index import EarthquakeIndex
+
+
+# Synthetic catalog dumps in the USGS CSV and GeoJSON layouts
+##############################################################
+def make_catalog(n_events, days=365, seed=0):
+    rng = np.random.default_rng(seed)
+    times = pd.Timestamp('2020-01-01', tz='UTC') + pd.to_timedelta(np.sort(rng.uniform(0, days * 86400, n_events)), unit='s')
+    regions = np.array(['Alaska', 'California', 'Japan', 'Indonesia', 'Chile', 'Turkey', 'Philippines', 'Hawaii'])
+    return pd.DataFrame({
+        'time': times.strftime('%Y-%m-%dT%H:%M:%S.%f').str[:-3] + 'Z',
+        'latitude': np.degrees(np.arcsin(rng.uniform(-1, 1, n_events))).round(4),
+        'longitude': rng.uniform(-180, 180, n_events).round(4),
+        'depth': rng.uniform(0, 300, n_events).round(2),
+        'mag': rng.exponential(0.8, n_events).round(1) + 0.5,
+        'magType': 'ml',
+        'id': [f'bf{i:08d}' for i in range(n_events)],
+        'updated': times.strftime('%Y-%m-%dT%H:%M:%S.%f').str[:-3] + 'Z',
+        'place': pd.Series(rng.integers(1, 100, n_events)).astype(str) + ' km N of Somewhere, ' + regions[rng.integers(0, len(regions), n_events)],
+        'type': 'earthquake',
+        'status': 'reviewed',
+    })
+
+
+def write_geojson(df, path):
+    with open(path, 'w') as f:
+        f.write('{"type":"FeatureCollection","metadata":{},"features":[')
+        time_ms = pd.to_datetime(df['time'], format='ISO8601').astype('int64') // 10 ** 6
+        for i, row in enumerate(df.itertuples(index=False)):
+            feature = {'type': 'Feature', 'id': row.id, 'geometry': {'type': 'Point', 'coordinates': [row.longitude, row.latitude, row.depth]},
+                       'properties': {'mag': row.mag, 'place': row.place, 'time': int(time_ms.iloc[i]), 'updated': int(time_ms.iloc[i]),
+                                      'magType': row.magType, 'type': row.type, 'status': row.status}}
+            f.write((',' if i else '') + json.dumps(feature))
+        f.write(']}')
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def backfill(path, speed=None):
+    # each run in its own process, so the peak RSS is that of the backfill alone
+    logging.disable(logging.WARNING)
+    start = time.perf_counter()
+    meter = run_backfill(path, speed=speed, store_path=path + '.sqlite', index=EarthquakeIndex())
+    speed_text = 'as fast as possible' if speed is None else f'replayed at {speed:.0f}x'
+    print(f"\n{os.path.basename(path)} {speed_text}: {time.perf_counter() - start:.1f}s wall, peak RSS {peak_rss_mb():.0f} MB")
+    print(meter.report())
+
+
+def run_in_process(path, speed=None):
+    process = multiprocessing.Process(target=backfill, args=(path, speed))
+    process.start()
+    process.join()
+
+
+if __name__ == "__main__":
+    n_csv = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    n_geojson = n_csv // 5
+
+    with tempfile.TemporaryDirectory() as folder:
+        csv_path = os.path.join(folder, 'catalog.csv')
+        geojson_path = os.path.join(folder, 'catalog.geojson')
+        day_path = os.path.join(folder, 'day.csv')
+        make_catalog(n_csv).to_csv(csv_path, index=False)
+        write_geojson(make_catalog(n_geojson, seed=1), geojson_path)
+        make_catalog(n_csv // 365, days=1, seed=2).to_csv(day_path, index=False)
+        print(f"Catalogs: {n_csv} events CSV ({os.path.getsize(csv_path) / 1e6:.0f} MB), "
+              f"{n_geojson} events GeoJSON ({os.path.getsize(geojson_path) / 1e6:.0f} MB), chunks of 100000 events")
+
+        run_in_process(csv_path)
+        run_in_process(geojson_path)
+        # one day of events replayed as a live feed in 10 seconds
+        run_in_process(day_path, speed=86400 / 10)
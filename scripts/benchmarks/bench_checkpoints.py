@@ -0,0 +1,46 @@
+import logging
+import os
+import sys
+import tempfile
+import time
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'etl_pipeline'))
+from bench_transform_chunks import COLUMNS_TO_REMOVE, staged_chunks
+from checkpoints import StageCheckpoint, stage_key
+from transform import READ_CHUNK_SIZE, remove_columns, transform_chunks
+
+
+def transform(chunks, checkpoint=None):
+    chunks = (remove_columns(chunk, ['Year'], 'disasters') for chunk in chunks)
+    transformed = transform_chunks(chunks, COLUMNS_TO_REMOVE)
+    if checkpoint is not None:
+        transformed = checkpoint.write_chunks(transformed)
+    return pd.concat([chunk for chunk in transformed if not chunk.empty], ignore_index=True)
+
+
+def timed(run):
+    start = time.perf_counter()
+    result = run()
+    return result, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    logging.disable(logging.WARNING)
+    print(f"Staging chunks of {READ_CHUNK_SIZE} rows (generated, standing in for the staging read)")
+    for n_rows in (100000, 400000, 1600000):
+        with tempfile.TemporaryDirectory() as directory:
+            extract = StageCheckpoint('extract', stage_key('source', n_rows), directory)
+            transformed = StageCheckpoint('transform', stage_key(extract.key, COLUMNS_TO_REMOVE), directory)
+
+            plain, plain_time = timed(lambda: transform(staged_chunks(n_rows, READ_CHUNK_SIZE)))
+            written, write_time = timed(lambda: transform(extract.write_chunks(staged_chunks(n_rows, READ_CHUNK_SIZE)), transformed))
+            # a failed load resumes from the transformed rows, a changed transform configuration from the staged rows
+            resumed, resume_time = timed(lambda: pd.concat([chunk for chunk in transformed.read_chunks() if not chunk.empty], ignore_index=True))
+            retransformed, retransform_time = timed(lambda: transform(extract.read_chunks()))
+
+            assert plain.equals(written) and plain.equals(resumed) and plain.equals(retransformed)
+            size = sum(os.path.getsize(os.path.join(checkpoint.path, name)) for checkpoint in (extract, transformed) for name in checkpoint.parts())
+            print(f"{n_rows:>8} rows: transform {plain_time:5.1f}s | with checkpoints {write_time:5.1f}s ({size / 1e6:.0f} MB on disk) | "
+                  f"resume after transform {resume_time:5.2f}s | resume after extract {retransform_time:5.1f}s")
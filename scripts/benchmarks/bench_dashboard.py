@@ -0,0 +1,84 @@
+import http.client
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'real_time_visuals'))
+from dashboard import EventHub, start_dashboard
+from poller import FEEDS, MIN_INTERVAL, BASE_INTERVAL, MAX_INTERVAL
+from bench_poller import RecordedFeeds, make_handler, load_recorded_feed, SPEEDUP
+
+REPLAY_HOURS = 6
+VIEWERS = 50
+
+
+# Offline run: the recorded catalog replayed by the local feed stand-in, one dashboard, many SSE viewers
+#########################################################################################################
+class Viewer(threading.Thread):
+    """
+    Reads the dashboard's event stream like a browser's EventSource and notes when each event arrives.
+    """
+    def __init__(self, port):
+        super().__init__(daemon=True)
+        self.port = port
+        self.received = {}  # event id -> seconds from its publish ('updated') to its arrival here
+        self.refreshes = 0
+
+    def run(self):
+        connection = http.client.HTTPConnection('127.0.0.1', self.port)
+        connection.request('GET', '/events')
+        response = connection.getresponse()
+        event = None
+        for line in response:
+            line = line.decode().rstrip('\n')
+            if line.startswith('event: '):
+                event = line[len('event: '):]
+            elif line.startswith('data: ') and event == 'events':
+                events = json.loads(line[len('data: '):])
+                arrived = time.time()
+                published = pd.to_datetime(pd.Series(events['updated']), format='ISO8601', utc=True).astype('int64') / 1e9
+                self.received.update(zip(events['id'], arrived - published))
+            elif line.startswith('data: ') and event == 'refresh':
+                self.refreshes += 1
+
+
+if __name__ == "__main__":
+    logging.disable(logging.WARNING)
+    df = load_recorded_feed(REPLAY_HOURS)
+    recorded = RecordedFeeds(df, SPEEDUP, FEEDS)
+    feed_server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(recorded))
+    threading.Thread(target=feed_server.serve_forever, daemon=True).start()
+
+    hub = EventHub(period='daily', min_mag=1)
+    server, poller = start_dashboard(
+        hub, port=0, feed_url=f'http://127.0.0.1:{feed_server.server_port}/{{}}.csv',
+        feeds=[(name, span / SPEEDUP) for name, span in FEEDS],
+        min_interval=MIN_INTERVAL / SPEEDUP, base_interval=BASE_INTERVAL / SPEEDUP, max_interval=MAX_INTERVAL / SPEEDUP,
+    )
+    viewers = [Viewer(server.server_port) for _ in range(VIEWERS)]
+    for viewer in viewers:
+        viewer.start()
+
+    time.sleep(recorded.offsets.max() + 2)
+
+    start = time.perf_counter()
+    figures = [hub.figure_json() for _ in range(VIEWERS)]
+    render_time = time.perf_counter() - start
+
+    expected = set(df.loc[df['mag'] >= 1, 'id'])
+    latencies = np.concatenate([list(viewer.received.values()) for viewer in viewers]) * SPEEDUP
+    print(f"Replayed {len(df)} events ({REPLAY_HOURS} h of catalog at {SPEEDUP}x) to {VIEWERS} viewers")
+    print(f"  upstream polls:         {poller.stats['polls']} ({poller.stats['not_modified']} not modified), shared by all viewers")
+    print(f"  events on the map:      {len(hub.events)}, M1+ in the replay: {len(expected)}")
+    print(f"  events per viewer:      min {min(len(v.received) for v in viewers)}, max {max(len(v.received) for v in viewers)}, "
+          f"refreshes per viewer: {viewers[0].refreshes}")
+    print(f"  publish -> viewer:      median {np.median(latencies):.0f}s, p95 {np.percentile(latencies, 95):.0f}s (catalog seconds)")
+    print(f"  {VIEWERS} figure requests:   {render_time:.2f}s, {len(figures[0]) / 1e3:.0f} kB each, rendered once")
+    server.shutdown()
+    feed_server.shutdown()
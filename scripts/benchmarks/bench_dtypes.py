@@ -0,0 +1,105 @@
+import hashlib
+import logging
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+import pandas as pd
+
+os.environ.setdefault('DATE_DIMENSION_CACHE', os.path.join(tempfile.gettempdir(), 'bench_dtypes_dates.pkl'))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'etl_pipeline'))
+from bench_elt import COLUMNS_TO_REMOVE, DIMENSION_TABLES, make_emdat
+from checkpoints import StageCheckpoint
+from load import DataFrameCSVStream, dimension_inputs, generate_dimensions, iter_fact_chunks
+from transform import READ_CHUNK_SIZE, concat_chunks, optimize_dtypes, remove_columns, rename_column, transform_chunks
+
+
+# Staging chunks as the typed staging cursor returns them: numbers with NULLs as float64, text as object.
+# Chunks are generated one at a time, standing in for fetchmany on a server-side cursor.
+##########################################################################################################
+def staged_chunks(n_rows, chunksize=READ_CHUNK_SIZE):
+    for offset in range(0, n_rows, chunksize):
+        chunk = make_emdat(min(chunksize, n_rows - offset), seed=offset).infer_objects()
+        chunk['extraction_time'] = pd.Timestamp('2024-08-24')
+        yield chunk
+
+
+def renamed(df):
+    df = rename_column(df, "insured_damages_('000_us$)", 'insured_damages')
+    return rename_column(df, "total_damages_('000_us$)", 'total_damages')
+
+
+def rendered(frames):
+    # the CSV text COPY would receive (columns in name order, the streamed fact chunks hold the IDs first),
+    # hashed so the paths can be compared row for row
+    digest, stream = hashlib.sha256(), DataFrameCSVStream(frame[sorted(frame.columns)] for frame in frames)
+    while data := stream.read(65536):
+        digest.update(data.encode())
+    return digest.hexdigest()
+
+
+# The driver's full mode without the database: transform, dimension split, then every table rendered for COPY.
+# Concatenated: every transformed row is held for the split. Streamed (the driver): the transformed chunks are
+# spilled to disk, only their dimension inputs are held, and fact_disasters is rendered from the chunks read back.
+################################################################################################################
+def pipeline(n_rows, compact, streamed):
+    start = time.perf_counter()
+    chunks = staged_chunks(n_rows)
+    if compact:
+        chunks = (optimize_dtypes(chunk) for chunk in chunks)
+    chunks = (remove_columns(chunk, ['Year'], 'disasters') for chunk in chunks)
+    transformed = (chunk for chunk in transform_chunks(chunks, COLUMNS_TO_REMOVE) if not chunk.empty)
+
+    with tempfile.TemporaryDirectory() as spill_dir:
+        if streamed:
+            spilled = StageCheckpoint('transform', 'batch', spill_dir)
+            disasters = concat_chunks([dimension_inputs(chunk) for chunk in spilled.write_chunks(transformed)])
+        else:
+            transformed = list(transformed)
+            disasters = renamed(concat_chunks(transformed) if compact else pd.concat(transformed, ignore_index=True))
+            del transformed
+        held_size = disasters.memory_usage(deep=True).sum() / 1e6
+
+        fact_disasters, *dimensions = generate_dimensions(disasters)
+        del disasters
+        fact_disasters = remove_columns(fact_disasters, ['starting_date', 'ending_date'], 'disasters')
+        tables = {table_name: [dimension] for table_name, dimension in zip(DIMENSION_TABLES, dimensions)}
+        if streamed:
+            tables['fact_disasters'] = iter_fact_chunks(fact_disasters, (renamed(chunk) for chunk in spilled.read_chunks()))
+        else:
+            tables['fact_disasters'] = [fact_disasters]
+        del fact_disasters, dimensions
+
+        digests = {table_name: rendered(frames) for table_name, frames in tables.items()}
+
+    elapsed = time.perf_counter() - start
+    return elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, held_size, digests
+
+
+def run_in_process(n_rows, compact, streamed):
+    # each path in its own process, so the peak RSS is that of the path alone
+    with multiprocessing.Pool(1) as pool:
+        return pool.apply(pipeline, (n_rows, compact, streamed))
+
+
+PATHS = {
+    'object/float64, concatenated': (False, False),
+    'compact dtypes, concatenated': (True, False),
+    'compact dtypes, streamed': (True, True),
+}
+
+
+if __name__ == "__main__":
+    logging.disable(logging.WARNING)
+    sizes = [int(size) for size in sys.argv[1:]] or [100000, 400000, 1600000]
+    print(f"Staging chunks of {READ_CHUNK_SIZE} rows (generated, standing in for the staging read)")
+    for n_rows in sizes:
+        results = {path: run_in_process(n_rows, *options) for path, options in PATHS.items()}
+        baseline_tables = results['object/float64, concatenated'][3]
+        for path, (elapsed, peak, held_size, tables) in results.items():
+            differing = [table for table in baseline_tables if baseline_tables[table] != tables[table]]
+            print(f"{n_rows:>8} rows, {path:<28}: {elapsed:5.1f}s, peak RSS {peak:5.0f} MB, rows held for the split {held_size:4.0f} MB | "
+                  f"{'same tables' if not differing else f'different tables: {differing}'}")
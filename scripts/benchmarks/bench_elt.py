@@ -0,0 +1,170 @@
+import logging
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+# Needs a PostgreSQL server, configured through DB_HOST / DB_PORT / DB_USER / DB_PASSWORD like the pipeline
+# (DB_NAME must not be set: the benchmark creates its own staging and warehouse databases)
+os.environ.setdefault('DATE_DIMENSION_CACHE', os.path.join(tempfile.gettempdir(), 'bench_elt_dates.pkl'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'etl_pipeline'))
+from elt import run_elt
+from load import TABLE_DEFINITIONS, connect_db, create_disaster_tables, generate_dimensions
+from scheduler import create_connection_pool, load_tables
+from staging_schema import process_csv_to_typed_staging
+from transform import concat_chunks, iter_data_from_db, optimize_dtypes, remove_columns, rename_column, transform_chunks
+
+STAGING_DB, PANDAS_DB, SQL_DB = 'bench_elt_staging', 'bench_elt_pandas', 'bench_elt_sql'
+STAGING_TABLE = 'staging_disasters'
+QUERY = f"SELECT * FROM {STAGING_TABLE};"
+# in the order generate_dimensions returns them
+DIMENSION_TABLES = ['dim_disaster_types', 'dim_disaster_groups', 'dim_associated_distructions', 'dim_locations', 'dim_disaster_names',
+                    'dim_ofda_responses', 'dim_appeals', 'dim_declarations', 'dim_mag_scales', 'dim_adm_levels', 'dim_disasters_origin', 'dim_dates']
+COLUMNS_TO_REMOVE = ['year', 'Year', 'local_time', 'river_basin', 'admin1_code', 'admin2_code', 'geo_locations',
+                     'start_year', 'start_month', 'start_day', 'end_year', 'end_month', 'end_day']
+
+
+# Synthetic EM-DAT export (the real one holds ~16,000 rows), with 2% duplicated rows and some impossible dates
+###############################################################################################################
+def make_emdat(n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    types = [('Natural', 'Geophysical', 'Earthquake', 'Ground movement', None), ('Natural', 'Geophysical', 'Earthquake', 'Tsunami', None),
+             ('Natural', 'Hydrological', 'Flood', 'Riverine flood', None), ('Natural', 'Hydrological', 'Flood', None, None),
+             ('Natural', 'Meteorological', 'Storm', 'Tropical cyclone', None), ('Natural', 'Meteorological', 'Storm', 'Convective storm', 'Lightning'),
+             ('Natural', 'Climatological', 'Drought', 'Drought', None), ('Technological', 'Industrial accident', 'Explosion', None, None)]
+    countries = [('Japan', 'JPN', 'Eastern Asia', 'Asia'), ('Chile', 'CHL', 'South America', 'Americas'), ('Turkey', 'TUR', 'Western Asia', 'Asia'),
+                 ('Indonesia', 'IDN', 'South-Eastern Asia', 'Asia'), ('Peru', 'PER', 'South America', 'Americas'), ('Italy', 'ITA', 'Southern Europe', 'Europe')]
+    kind = pd.DataFrame(types).iloc[rng.integers(0, len(types), n_rows)].reset_index(drop=True)
+    country = pd.DataFrame(countries).iloc[rng.integers(0, len(countries), n_rows)].reset_index(drop=True)
+    years = rng.integers(1900, 2022, n_rows)
+    latitude = rng.uniform(-40, 45, n_rows).round(2)
+
+    def some(values, share=0.5):
+        return np.where(rng.uniform(size=n_rows) < share, values, None)
+
+    disasters = pd.DataFrame({
+        'Dis No': [f'{year}-{i:06d}-XXX' for i, year in enumerate(years)], 'Year': years, 'Seq': rng.integers(1, 999, n_rows),
+        'Glide': some([f'EQ-{year}-{i:06d}' for i, year in enumerate(years)], 0.3),
+        'Disaster Group': kind[0], 'Disaster Subgroup': kind[1], 'Disaster Type': kind[2], 'Disaster Subtype': kind[3], 'Disaster Subsubtype': kind[4],
+        'Event Name': some(rng.choice(['Tohoku', 'Maria', 'Haiyan', 'Kobe'], n_rows), 0.2),
+        'Country': country[0], 'ISO': country[1], 'Region': country[2], 'Continent': country[3],
+        'Location': some([f'Province {i}' for i in rng.integers(0, 2000, n_rows)], 0.9),
+        'Origin': some(rng.choice(['Heavy rains', 'Monsoon'], n_rows), 0.2),
+        'Associated Dis': some(rng.choice(['Landslide', 'Fire', 'Flood'], n_rows), 0.3), 'Associated Dis2': some(rng.choice(['Flood', 'Fire'], n_rows), 0.1),
+        'OFDA Response': some('Yes', 0.2), 'Appeal': some(rng.choice(['Yes', 'No'], n_rows)), 'Declaration': some(rng.choice(['Yes', 'No'], n_rows)),
+        'Aid Contribution': some(rng.integers(1, 100000, n_rows), 0.1),
+        'Dis Mag Value': some(rng.integers(4, 9, n_rows), 0.6), 'Dis Mag Scale': some(rng.choice(['Richter', 'Km2', 'Kph'], n_rows), 0.7),
+        'Latitude': some([f'{abs(value)} {"N" if value >= 0 else "S"}' for value in latitude], 0.4),
+        'Longitude': some(rng.uniform(-180, 180, n_rows).round(2), 0.4),
+        'Local Time': some('10:32', 0.1), 'River Basin': some('Mekong, Chao Phraya and other basins', 0.1),
+        'Start Year': years, 'Start Month': some(rng.integers(1, 13, n_rows), 0.95), 'Start Day': some(rng.integers(1, 32, n_rows), 0.8),
+        'End Year': years + rng.integers(0, 2, n_rows), 'End Month': rng.integers(1, 13, n_rows), 'End Day': rng.integers(1, 29, n_rows),
+        'Total Deaths': some(rng.integers(0, 5000, n_rows), 0.7), 'No Injured': some(rng.integers(0, 5000, n_rows), 0.3),
+        'No Affected': some(rng.integers(0, 50000, n_rows)), 'No Homeless': some(rng.integers(0, 5000, n_rows), 0.1),
+        'Total Affected': some(rng.integers(0, 60000, n_rows), 0.6),
+        "Insured Damages ('000 US$)": some(rng.integers(0, 10 ** 6, n_rows), 0.1), "Total Damages ('000 US$)": some(rng.integers(0, 10 ** 7, n_rows), 0.3),
+        'CPI': rng.uniform(3, 100, n_rows).round(6), 'Adm Level': some(rng.choice(['1', '2', '1;2'], n_rows), 0.8),
+        'Admin1 Code': some('1234;5678', 0.5), 'Admin2 Code': some('12345;67890', 0.4), 'Geo Locations': some('Region A, Region B (Adm1).', 0.8),
+    })
+    return pd.concat([disasters, disasters.sample(frac=0.02, random_state=seed)], ignore_index=True)
+
+
+def recreate_databases():
+    admin = connect_db('postgres')
+    admin.autocommit = True
+    with admin.cursor() as cur:
+        for dbname in (STAGING_DB, PANDAS_DB, SQL_DB):
+            cur.execute(f"DROP DATABASE IF EXISTS {dbname};")
+            cur.execute(f"CREATE DATABASE {dbname};")
+    admin.close()
+
+
+def stage(n_rows, directory):
+    path = os.path.join(directory, f'emdat_{n_rows}.csv')
+    make_emdat(n_rows).to_csv(path, index=False)
+    conn = connect_db(STAGING_DB)
+    with conn.cursor() as cur:
+        process_csv_to_typed_staging(cur, STAGING_TABLE, path)
+    conn.commit()
+    conn.close()
+
+
+# The two engines, from the staging query to a loaded star schema
+##################################################################
+def pandas_engine():
+    # the driver's full mode: streamed transform, generate_dimensions, then COPY of every table
+    chunks = (remove_columns(optimize_dtypes(chunk), ['Year'], 'disasters') for chunk in iter_data_from_db(QUERY, STAGING_DB))
+    disasters = concat_chunks(chunk for chunk in transform_chunks(chunks, COLUMNS_TO_REMOVE) if not chunk.empty)
+    disasters = rename_column(disasters, "insured_damages_('000_us$)", 'insured_damages')
+    disasters = rename_column(disasters, "total_damages_('000_us$)", 'total_damages')
+
+    conn = connect_db(PANDAS_DB)
+    create_disaster_tables(conn)
+    conn.close()
+    fact_disasters, *dimensions = generate_dimensions(disasters)
+    tables = dict(zip(DIMENSION_TABLES, dimensions))
+    tables['fact_disasters'] = remove_columns(fact_disasters, ['starting_date', 'ending_date'], 'disasters')
+
+    db_pool = create_connection_pool(PANDAS_DB)
+    try:
+        load_tables(tables, db_pool, 'copy')
+    finally:
+        db_pool.closeall()
+
+
+def sql_engine():
+    staging_conn, dwh_conn = connect_db(STAGING_DB), connect_db(SQL_DB)
+    run_elt(QUERY, None, staging_conn, dwh_conn, COLUMNS_TO_REMOVE)
+    staging_conn.close()
+    dwh_conn.close()
+
+
+def timed(engine):
+    logging.disable(logging.WARNING)
+    start = time.perf_counter()
+    engine()
+    return time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_in_process(engine):
+    # each engine in its own process, so the peak RSS is that of the engine alone
+    with multiprocessing.Pool(1) as pool:
+        return pool.apply(timed, (engine,))
+
+
+def differing_tables():
+    # every warehouse table compared as a set of rows, surrogate keys included
+    differing = []
+    pandas_conn, sql_conn = connect_db(PANDAS_DB), connect_db(SQL_DB)
+    for table in TABLE_DEFINITIONS:
+        rows = []
+        for conn in (pandas_conn, sql_conn):
+            with conn.cursor() as cur:
+                cur.execute(f"SELECT * FROM {table};")
+                rows.append(sorted(cur.fetchall(), key=repr))
+        if rows[0] != rows[1]:
+            differing.append(table)
+    pandas_conn.close()
+    sql_conn.close()
+    return differing
+
+
+if __name__ == "__main__":
+    logging.disable(logging.WARNING)
+    sizes = [int(size) for size in sys.argv[1:]] or [16000, 100000, 400000]
+    with tempfile.TemporaryDirectory() as directory:
+        for n_rows in sizes:
+            recreate_databases()
+            stage(n_rows, directory)
+
+            pandas_time, pandas_peak = run_in_process(pandas_engine)
+            sql_time, sql_peak = run_in_process(sql_engine)
+
+            differing = differing_tables()
+            print(f"{n_rows:>7} rows: pandas {pandas_time:6.1f}s, peak RSS {pandas_peak:5.0f} MB | "
+                  f"SQL pushdown {sql_time:6.1f}s, peak RSS {sql_peak:5.0f} MB (speedup {pandas_time / sql_time:.1f}x) | "
+                  f"{'same star schema' if not differing else f'different tables: {differing}'}")
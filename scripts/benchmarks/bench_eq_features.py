@@ -0,0 +1,80 @@
+import os
+import sys
+import time
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api_extraction'))
+from eq_features import add_place_columns, add_frame_column
+
+RECORDED_FEED = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data', 'real_time_data', 'earthquake_data.csv')
+
+
+# Previous implementation: split lists and per-row apply on every place and Timestamp
+######################################################################################
+def extract_subarea(place):
+    return place[0]
+
+
+def extract_area(place):
+    return place[-1]
+
+
+def extract_date(time):
+    return str(time).split(' ')[0]
+
+
+def extract_weekday(time):
+    date = extract_date(time)
+    return date + ' - ' + str(time.weekday())
+
+
+def extract_hour(time):
+    t = str(time).split(' ')
+    return t[0] + ' - ' + t[1].split(':')[0]
+
+
+def legacy_features(df, period):
+    place_list = df['place'].str.split(', ')
+    df['sub_area'] = place_list.apply(extract_subarea)
+    df['area'] = place_list.apply(extract_area)
+    df = df.drop(columns=['place'], axis=1)
+    extract, column = {'daily': (extract_hour, 'hours'), 'weekly': (extract_weekday, 'weekday'), 'monthly': (extract_date, 'date')}[period]
+    df[column] = df['time'].apply(extract)
+    return df
+
+
+def vectorized_features(df, period):
+    df = add_place_columns(df)
+    add_frame_column(df, period)
+    return df
+
+
+def month_feed(copies=1):
+    df = pd.read_csv(RECORDED_FEED, usecols=['time', 'latitude', 'longitude', 'mag', 'sub_area', 'area'])
+    df['place'] = df['sub_area'] + ', ' + df['area']
+    df['time'] = pd.to_datetime(df['time'], format='ISO8601')
+    df = df.drop(columns=['sub_area', 'area'])
+    return pd.concat([df] * copies, ignore_index=True)
+
+
+def timed(function, df, period, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(df.copy(), period)
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+if __name__ == "__main__":
+    for copies in (1, 10):
+        df = month_feed(copies)
+        print(f"{len(df)} events ({copies}x the recorded month feed)")
+        for period in ('daily', 'weekly', 'monthly'):
+            legacy, legacy_time = timed(legacy_features, df, period)
+            vectorized, vectorized_time = timed(vectorized_features, df, period)
+            same = legacy.astype(str).equals(vectorized.astype(str))
+            print(f"  {period:>8}: apply {legacy_time * 1000:7.1f} ms, vectorized {vectorized_time * 1000:6.1f} ms "
+                  f"({legacy_time / vectorized_time:4.1f}x), same output: {same}")
+        print(f"  area/sub_area memory: {legacy[['sub_area', 'area']].memory_usage(deep=True).sum() / 1e6:.2f} MB as strings, "
+              f"{vectorized[['sub_area', 'area']].memory_usage(deep=True).sum() / 1e6:.2f} MB as categoricals")
@@ -0,0 +1,130 @@
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api_extraction'))
+from feeds import GeoJSONStreamParser, ingest_feeds
+
+RECORDED_FEED = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data', 'real_time_data', 'earthquake_data.csv')
+RESPONSE_DELAY = 0.5  # seconds before a mock response starts, standing in for network latency
+
+
+# Mock USGS server: serves the recorded catalog as the summary feeds, in CSV and GeoJSON
+#########################################################################################
+def load_catalog():
+    df = pd.read_csv(RECORDED_FEED).drop_duplicates(subset='id', keep='last')
+    df['place'] = df['sub_area'] + ', ' + df['area']
+    df = df.drop(columns=['sub_area', 'area'])
+    df['time'] = pd.to_datetime(df['time'], format='ISO8601')
+    return df.sort_values('time', ascending=False, ignore_index=True)
+
+
+def feed_rows(df, feed):
+    end = df['time'].max()
+    threshold, span = feed.split('_')
+    spans = {'hour': pd.Timedelta(hours=1), 'day': pd.Timedelta(days=1), 'week': pd.Timedelta(weeks=1), 'month': pd.Timedelta(days=31)}
+    rows = df[df['time'] > end - spans[span]]
+    if threshold == 'significant':
+        return rows[rows['mag'] >= 6]
+    if threshold != 'all':
+        return rows[rows['mag'] >= float(threshold)]
+    return rows
+
+
+def to_geojson(rows):
+    features = []
+    for row in rows.itertuples(index=False):
+        properties = {
+            'mag': row.mag, 'place': row.place, 'time': int(row.time.timestamp() * 1000),
+            'updated': int(pd.Timestamp(row.updated).timestamp() * 1000), 'status': row.status, 'net': row.net,
+            'nst': None if pd.isna(row.nst) else row.nst, 'gap': None if pd.isna(row.gap) else row.gap,
+            'dmin': None if pd.isna(row.dmin) else row.dmin, 'rms': row.rms, 'magType': row.magType, 'type': row.type,
+            'sig': int(row.mag ** 2 * 10), 'tsunami': 0,
+        }
+        features.append({'type': 'Feature', 'properties': properties, 'id': row.id,
+                         'geometry': {'type': 'Point', 'coordinates': [row.longitude, row.latitude, row.depth]}})
+    return json.dumps({'type': 'FeatureCollection', 'metadata': {'count': len(features)}, 'features': features}).encode()
+
+
+def to_csv(rows):
+    rows = rows.copy()
+    rows['time'] = rows['time'].dt.strftime('%Y-%m-%dT%H:%M:%S.%f').str[:-3] + 'Z'
+    return rows.to_csv(index=False).encode()
+
+
+def make_handler(bodies):
+    class FeedHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = bodies[self.path.rsplit('/', 1)[-1]]
+            time.sleep(RESPONSE_DELAY)
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return FeedHandler
+
+
+def peak_memory(function, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function(*args)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def parse_whole(body):
+    return pd.json_normalize(json.loads(body)['features'])
+
+
+def parse_stream(body):
+    parser = GeoJSONStreamParser()
+    for start in range(0, len(body), 64 * 1024):
+        parser.feed(body[start:start + 64 * 1024])
+    return parser.close()
+
+
+if __name__ == "__main__":
+    catalog = load_catalog()
+    feeds = ['significant_month', '4.5_week', '2.5_day', 'all_hour', 'all_day', 'all_week']
+    bodies = {}
+    for feed in feeds + ['all_month']:
+        rows = feed_rows(catalog, feed)
+        bodies[f'{feed}.csv'] = to_csv(rows)
+        bodies[f'{feed}.geojson'] = to_geojson(rows)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(bodies))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}/'
+
+    start = time.perf_counter()
+    sequential = [pd.read_csv(base + f'{feed}.csv') for feed in feeds]
+    sequential_time = time.perf_counter() - start
+    expected_ids = set(pd.concat(sequential)['id'])
+
+    start = time.perf_counter()
+    merged = ingest_feeds([base + f'{feed}.geojson' for feed in feeds])
+    concurrent_time = time.perf_counter() - start
+    server.shutdown()
+
+    print(f"{len(feeds)} feeds, {RESPONSE_DELAY}s response delay each")
+    print(f"  sequential pd.read_csv: {sequential_time:.2f}s, {sum(len(df) for df in sequential)} rows")
+    print(f"  concurrent GeoJSON:     {concurrent_time:.2f}s, {len(merged)} events, same ids: {set(merged['id']) == expected_ids}, "
+          f"unique ids: {merged['id'].is_unique}")
+
+    body = bodies['all_month.geojson']
+    whole, whole_time, whole_peak = peak_memory(parse_whole, body)
+    stream, stream_time, stream_peak = peak_memory(parse_stream, body)
+    print(f"all_month.geojson ({len(body) / 1e6:.1f} MB, {len(stream)} features, timed under tracemalloc)")
+    print(f"  json.loads + json_normalize: {whole_time:.2f}s, peak {whole_peak / 1e6:.1f} MB")
+    print(f"  streaming columnar parser:   {stream_time:.2f}s, peak {stream_peak / 1e6:.1f} MB")
@@ -0,0 +1,92 @@
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'etl_pipeline'))
+from load import create_hierarchy
+
+
+# Previous per-value implementation, kept here as the reference for timings and output checks
+##############################################################################################
+def create_hierarchy_loop(df, level_cols, id_col_name):
+    hierarchy = pd.DataFrame(columns=['id', 'name', 'parent_id'])
+    current_id = 1
+    parent_ids = {}
+    df[id_col_name] = None
+
+    for i, level in enumerate(level_cols):
+        unique_values = df[level].unique()
+
+        for value in unique_values:
+            if i > 0:
+                parent_row = df[df[level] == value]
+                if len(parent_row) > 0:
+                    parent_value = parent_row[level_cols[i-1]].values[0]
+                    parent_id = parent_ids.get(parent_value, None)
+                else:
+                    parent_id = None
+            else:
+                parent_id = None
+
+            hierarchy = pd.concat([hierarchy, pd.DataFrame({
+                'id': [current_id],
+                'name': [value],
+                'parent_id': [parent_id]
+            })], ignore_index=True)
+
+            parent_ids[value] = current_id
+            df.loc[df[level] == value, id_col_name] = current_id
+            current_id += 1
+    df = df.drop(columns=level_cols)
+    return hierarchy, df
+
+
+# Synthetic EM-DAT like frame: type -> subtype -> subsubtype with missing values at the lower levels
+####################################################################################################
+def make_frame(n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    types = np.array([f'type_{i}' for i in range(15)], dtype=object)
+    subtypes = np.array([f'subtype_{i}' for i in range(40)], dtype=object)
+    subsubtypes = np.array([f'subsubtype_{i}' for i in range(30)] + [None], dtype=object)
+
+    # every subtype belongs to a single type, every subsubtype to a single subtype
+    subtype = rng.integers(0, len(subtypes), n_rows)
+    subsubtype = np.where(rng.random(n_rows) < 0.6, len(subsubtypes) - 1, subtype % (len(subsubtypes) - 1))
+    df = pd.DataFrame({
+        'disaster_type': types[subtype % len(types)],
+        'disaster_subtype': subtypes[subtype],
+        'disaster_subsubtype': subsubtypes[subsubtype],
+        'total_deaths': rng.integers(0, 1000, n_rows),
+    })
+    # a missing subtype implies a missing subsubtype, as in the EM-DAT extract
+    df.loc[(rng.random(n_rows) < 0.05) & df['disaster_subsubtype'].isna(), 'disaster_subtype'] = None
+    return df
+
+
+def same_output(expected, actual):
+    # None and NaN both stand for "no parent" / "no id", so compare them as equal
+    normalize = lambda frame: frame.astype(object).where(frame.notna(), None)
+    return all(normalize(e).equals(normalize(a)) for e, a in zip(expected, actual))
+
+
+def run_benchmark(n_rows, levels, id_col_name='type_id'):
+    df = make_frame(n_rows)
+
+    start = time.perf_counter()
+    vectorized = create_hierarchy(df.copy(), levels, id_col_name)
+    vectorized_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    loop = create_hierarchy_loop(df.copy(), levels, id_col_name)
+    loop_time = time.perf_counter() - start
+
+    print(f"{n_rows:>9} rows | loop: {loop_time:8.3f}s | vectorized: {vectorized_time:8.3f}s | "
+          f"speedup: {loop_time / vectorized_time:7.1f}x | same output: {same_output(loop, vectorized)}")
+
+
+if __name__ == "__main__":
+    levels = ['disaster_type', 'disaster_subtype', 'disaster_subsubtype']
+    for n_rows in (10_000, 100_000, 1_000_000):
+        run_benchmark(n_rows, levels)
@@ -0,0 +1,102 @@
+import os
+import sqlite3
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api_extraction'))
+from historical_links import HistoricalLinker, LINK_RADIUS_KM, LINK_MAG_WINDOW
+from spatial_index import haversine_km
+
+BATCH_SIZE = 100  # live quakes per feed poll
+
+
+# Synthetic warehouse history (EM-DAT holds ~1,500 earthquakes; larger sizes show how lookups scale)
+# and live quakes drawn around the same seismic belts
+######################################################################################################
+def make_history(n_events, seed=0):
+    rng = np.random.default_rng(seed)
+    belts = rng.uniform([-50, -180], [60, 180], size=(200, 2))
+    centre = belts[rng.integers(0, len(belts), n_events)]
+    located = rng.uniform(size=n_events) < 0.7
+    return pd.DataFrame({
+        'id': [f'h{i}' for i in range(n_events)],
+        'magnitude': np.where(rng.uniform(size=n_events) < 0.8, rng.uniform(5, 8.5, n_events).round(), np.nan),
+        'latitude': np.where(located, centre[:, 0] + rng.normal(0, 2, n_events), np.nan),
+        'longitude': np.where(located, centre[:, 1] + rng.normal(0, 2, n_events), np.nan),
+        'total_deaths': rng.integers(0, 1000, n_events),
+        'total_affected': rng.integers(0, 100000, n_events),
+        'total_damages': rng.uniform(0, 1e6, n_events),
+        'country': 'Country',
+        'iso': np.array([f'C{i:02d}' for i in range(60)])[rng.integers(0, 60, n_events)],
+        'location': 'Somewhere',
+        'year': rng.integers(1900, 2022, n_events),
+    }), belts
+
+
+def make_quakes(n_quakes, belts, seed=1):
+    rng = np.random.default_rng(seed)
+    centre = belts[rng.integers(0, len(belts), n_quakes)]
+    return pd.DataFrame({
+        'latitude': centre[:, 0] + rng.normal(0, 3, n_quakes),
+        'longitude': centre[:, 1] + rng.normal(0, 3, n_quakes),
+        'mag': rng.uniform(4.5, 8, n_quakes).round(1),
+    })
+
+
+# The alternative: one query per quake against the warehouse tables (in-memory SQLite as a stand-in)
+#####################################################################################################
+def sql_per_quake(conn, quakes, radius_km=LINK_RADIUS_KM, mag_window=LINK_MAG_WINDOW):
+    # a bounding box on the indexed columns then the exact distance; the box does not wrap the antimeridian
+    results = []
+    for lat, lon, mag in quakes[['latitude', 'longitude', 'mag']].itertuples(index=False):
+        dlat = radius_km / 111.0
+        dlon = min(180.0, radius_km / (111.0 * max(np.cos(np.radians(lat)), 0.01)))
+        rows = pd.read_sql_query(
+            """SELECT id, latitude, longitude, total_deaths, total_affected, total_damages FROM history
+               WHERE latitude BETWEEN ? AND ? AND longitude BETWEEN ? AND ?
+               AND (magnitude IS NULL OR ABS(magnitude - ?) <= ?)""",
+            conn, params=(lat - dlat, lat + dlat, lon - dlon, lon + dlon, mag, mag_window))
+        rows = rows[haversine_km(lat, lon, rows['latitude'], rows['longitude']) <= radius_km]
+        results.append((len(rows), rows['total_deaths'].sum()))
+    return results
+
+
+if __name__ == "__main__":
+    n_quakes = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    for n_history in (1500, 20000, 200000):
+        history, belts = make_history(n_history)
+        quakes = make_quakes(n_quakes, belts)
+
+        start = time.perf_counter()
+        linker = HistoricalLinker(history)
+        build = time.perf_counter() - start
+
+        batch_times = []
+        contexts = []
+        for position in range(0, len(quakes), BATCH_SIZE):
+            batch = quakes.iloc[position:position + BATCH_SIZE]
+            batch_start = time.perf_counter()
+            contexts.append(linker.link(batch))
+            batch_times.append(time.perf_counter() - batch_start)
+        context = pd.concat(contexts)
+        per_quake = sum(batch_times) / len(quakes) * 1e6
+
+        print(f"\n{n_history} historical earthquakes ({len(linker.events)} located), {n_quakes} live quakes in batches of {BATCH_SIZE}")
+        print(f"  index build: {build * 1000:.0f} ms (once per {os.getenv('HISTORY_TTL', 86400)}s)")
+        print(f"  in-memory link: {per_quake:.1f} us per quake, p99 batch {np.percentile(batch_times, 99) * 1000:.1f} ms, "
+              f"{(context['hist_events'] > 0).mean():.0%} of quakes with history nearby")
+
+        conn = sqlite3.connect(':memory:')
+        history.to_sql('history', conn, index=False)
+        conn.execute("CREATE INDEX history_position ON history (latitude, longitude)")
+        sample = quakes.iloc[:500]
+        start = time.perf_counter()
+        per_query = sql_per_quake(conn, sample)
+        sql_time = (time.perf_counter() - start) / len(sample) * 1e6
+        conn.close()
+
+        matches = context['hist_events'].iloc[:len(sample)].to_numpy()
+        agree = np.mean([count == match for (count, deaths), match in zip(per_query, matches)])
+        print(f"  query per quake: {sql_time:.0f} us per quake ({sql_time / per_quake:.0f}x slower), same matches for {agree:.0%} of quakes")
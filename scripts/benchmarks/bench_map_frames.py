@@ -0,0 +1,61 @@
+import os
+import sys
+import tempfile
+import time
+import pandas as pd
+import plotly.io as pio
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'real_time_visuals'))
+from recent_earthquakes import build_figure
+from map_frames import prepare_map_frames, data_fingerprint, read_cached_figure, write_cached_figure
+from eq_features import add_place_columns, add_frame_column
+
+RECORDED_FEED = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data', 'real_time_data', 'earthquake_data.csv')
+
+
+def month_feed(period):
+    # the recorded month feed, cleaned the way recent_earthquakes.fetch_eq_data does it
+    df = pd.read_csv(RECORDED_FEED).drop_duplicates(subset='id', keep='last')
+    df['place'] = df['sub_area'] + ', ' + df['area']
+    df = add_place_columns(df[['time', 'latitude', 'longitude', 'mag', 'place']].copy())
+    df = df[df['mag'] >= 1].copy()
+    df['time'] = pd.to_datetime(df['time'], format='ISO8601')
+    frame_col = add_frame_column(df, period)
+    return df.sort_values(by='time'), frame_col
+
+
+def measure(name, build):
+    start = time.perf_counter()
+    fig = build()
+    payload = fig.to_json()
+    elapsed = time.perf_counter() - start
+    points = sum(len(trace.lat) for frame in fig.frames for trace in frame.data) if fig.frames else sum(len(trace.lat) for trace in fig.data)
+    first_frame = sum(len(trace.lat) for trace in fig.data)
+    print(f"  {name:<34} {elapsed:6.2f}s build+serialize, {len(payload) / 1e6:6.2f} MB JSON, "
+          f"{points:>7} points over all frames, {first_frame:>5} in the first frame")
+    return fig, payload
+
+
+if __name__ == "__main__":
+    period = 'monthly'
+    df, frame_col = month_feed(period)
+    print(f"{len(df)} events, {df[frame_col].nunique()} frames ({period})")
+
+    baseline = df.assign(count=1)[['latitude', 'longitude', 'mag', 'sub_area', 'count', frame_col]]
+    build_figure(baseline.head(10), 54, 15, frame_col).to_json()  # warm up plotly's lazy imports
+    measure('all events per frame (before)', lambda: build_figure(baseline, 54, 15, frame_col))
+    measure('binned per frame', lambda: build_figure(prepare_map_frames(df, frame_col), 54, 15, frame_col))
+    measure('cumulative, unbinned', lambda: build_figure(prepare_map_frames(df, frame_col, window='cumulative', density_threshold=float('inf')), 54, 15, frame_col))
+    fig, _ = measure('cumulative, binned', lambda: build_figure(prepare_map_frames(df, frame_col, window='cumulative'), 54, 15, frame_col))
+    measure('3-frame sliding window, binned', lambda: build_figure(prepare_map_frames(df, frame_col, window=3), 54, 15, frame_col))
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        path = os.path.join(cache_dir, 'figure.json')
+        write_cached_figure(path, fig, data_fingerprint(df))
+        start = time.perf_counter()
+        cached = read_cached_figure(path, fingerprint=data_fingerprint(df))
+        html = pio.to_html(cached, validate=False)
+        print(f"  {'cumulative, binned from the cache':<34} {time.perf_counter() - start:6.2f}s to load and render to HTML")
+    start = time.perf_counter()
+    html = pio.to_html(build_figure(prepare_map_frames(df, frame_col, window='cumulative'), 54, 15, frame_col))
+    print(f"  {'cumulative, binned rebuilt':<34} {time.perf_counter() - start:6.2f}s to build and render to HTML")
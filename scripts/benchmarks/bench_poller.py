@@ -0,0 +1,118 @@
+import email.utils
+import gzip
+import logging
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api_extraction'))
+from poller import FeedPoller, FEEDS, MIN_INTERVAL, BASE_INTERVAL, MAX_INTERVAL
+
+RECORDED_FEED = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data', 'real_time_data', 'earthquake_data.csv')
+SPEEDUP = 720  # one hour of the recorded catalog replays in 5 seconds
+REPLAY_HOURS = 6
+
+
+# Local stand-in for the USGS feeds: replays a recorded catalog in accelerated time.
+# Each event is "published" when its origin time comes up, with 'updated' set to that wall-clock time,
+# and every feed answers conditional GETs with ETag/Last-Modified like the real service.
+#####################################################################################################
+class RecordedFeeds:
+    def __init__(self, df, speedup, feeds):
+        self.events = df.sort_values('time', ignore_index=True)
+        self.offsets = (self.events['time'] - self.events['time'].iloc[0]).dt.total_seconds().to_numpy() / speedup
+        self.spans = {name: span / speedup for name, span in feeds}
+        self.start = time.time()
+
+    def published(self, feed):
+        now = time.time() - self.start
+        mask = (self.offsets <= now) & (self.offsets > now - self.spans[feed])
+        events = self.events[mask].copy()
+        publish_times = pd.to_datetime(self.start + self.offsets[mask], unit='s', utc=True)
+        events['updated'] = publish_times.strftime('%Y-%m-%dT%H:%M:%S.%f').str[:-3] + 'Z'
+        last_change = self.start + (self.offsets[mask].max() if mask.any() else 0)
+        return events.iloc[::-1], last_change
+
+
+def make_handler(feeds):
+    class FeedHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            feed = self.path.rsplit('/', 1)[-1].removesuffix('.csv')
+            events, last_change = feeds.published(feed)
+            etag = f'"{feed}-{len(events)}-{last_change:.3f}"'
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+
+            body = gzip.compress(events.to_csv(index=False).encode())
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/csv')
+            self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', email.utils.formatdate(last_change, usegmt=True))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return FeedHandler
+
+
+def load_recorded_feed(hours):
+    df = pd.read_csv(RECORDED_FEED).drop_duplicates(subset='id', keep='last')
+    df['time'] = pd.to_datetime(df['time'], format='ISO8601')
+    df['place'] = df['sub_area'] + ', ' + df['area']
+    df = df.drop(columns=['sub_area', 'area'])
+    end = df['time'].max()
+    return df[df['time'] > end - pd.Timedelta(hours=hours)]
+
+
+# Baseline: the whole month feed on a fixed interval, without validators
+#########################################################################
+class FixedMonthPoller(FeedPoller):
+    def request(self, feed):
+        self.validators.clear()
+        return super().request(feed)
+
+    def adapt_interval(self, fresh):
+        self.interval = self.base_interval
+
+
+def run_poller(poller_class, df, feeds, **kwargs):
+    recorded = RecordedFeeds(df, SPEEDUP, FEEDS)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(recorded))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    poller = poller_class(on_events=lambda fresh: None, url=f'http://127.0.0.1:{server.server_port}/{{}}.csv', feeds=feeds,
+                          min_interval=MIN_INTERVAL / SPEEDUP, base_interval=BASE_INTERVAL / SPEEDUP,
+                          max_interval=MAX_INTERVAL / SPEEDUP, **kwargs)
+    poller.run(duration=recorded.offsets.max() + 1)
+    server.shutdown()
+    server.server_close()
+    return poller
+
+
+def report(name, poller, n_events):
+    latency = {key: None if value is None else value * SPEEDUP for key, value in poller.latency_summary().items()}
+    latency_text = 'no events' if latency['median'] is None else \
+        f"median {latency['median']:.0f}s, p95 {latency['p95']:.0f}s, max {latency['max']:.0f}s"
+    print(f"{name:>22}: {poller.stats['polls']:>5} polls, {poller.stats['not_modified']:>5} not modified, "
+          f"{poller.stats['bytes'] / 1e6:>7.2f} MB, {poller.stats['events']:>5}/{n_events} events, latency {latency_text}")
+
+
+if __name__ == "__main__":
+    logging.disable(logging.WARNING)
+    scaled_feeds = [(name, span / SPEEDUP) for name, span in FEEDS]
+    df = load_recorded_feed(REPLAY_HOURS)
+    print(f"Replaying {len(df)} recorded events ({REPLAY_HOURS} h of catalog) at {SPEEDUP}x, latencies in catalog seconds")
+
+    adaptive = run_poller(FeedPoller, df, scaled_feeds)
+    baseline = run_poller(FixedMonthPoller, df, [scaled_feeds[-1]])
+    report('adaptive conditional', adaptive, len(df))
+    report('fixed month feed', baseline, len(df))
@@ -0,0 +1,66 @@
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api_extraction'))
+from spatial_index import EarthquakeIndex, haversine_km
+
+
+# Synthetic catalog: epicentres spread uniformly over the sphere
+################################################################
+def make_events(n_events, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'id': [f'ev{i}' for i in range(n_events)],
+        'latitude': np.degrees(np.arcsin(rng.uniform(-1, 1, n_events))),
+        'longitude': rng.uniform(-180, 180, n_events),
+        'mag': rng.uniform(1, 7, n_events).round(1),
+    })
+
+
+def brute_force_radius(events, lat, lon, radius_km):
+    distances = haversine_km(lat, lon, events['latitude'].to_numpy(), events['longitude'].to_numpy())
+    return set(events['id'].to_numpy()[distances <= radius_km])
+
+
+def brute_force_nearest(events, lat, lon, k):
+    distances = haversine_km(lat, lon, events['latitude'].to_numpy(), events['longitude'].to_numpy())
+    return set(events['id'].to_numpy()[np.argsort(distances)[:k]])
+
+
+def run_benchmark(n_events, n_queries=200, radius_km=250, k=10):
+    events = make_events(n_events)
+    queries = make_events(n_queries, seed=1)
+
+    start = time.perf_counter()
+    index = EarthquakeIndex(events)
+    build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    radius = index.query_radius(queries['latitude'], queries['longitude'], radius_km)
+    nearest = index.query_nearest(queries['latitude'], queries['longitude'], k)
+    index_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    expected_radius = [brute_force_radius(events, lat, lon, radius_km) for lat, lon in zip(queries['latitude'], queries['longitude'])]
+    expected_nearest = [brute_force_nearest(events, lat, lon, k) for lat, lon in zip(queries['latitude'], queries['longitude'])]
+    brute_time = time.perf_counter() - start
+
+    same = all(set(radius.loc[radius['query'] == q, 'id']) == expected_radius[q] for q in range(n_queries)) and \
+        all(set(nearest.loc[nearest['query'] == q, 'id']) == expected_nearest[q] for q in range(n_queries))
+
+    # incremental path: a poll's worth of new events lands in the pending buffer
+    start = time.perf_counter()
+    index.add(make_events(500, seed=2).assign(id=lambda df: 'new' + df['id']))
+    add_time = time.perf_counter() - start
+
+    print(f"{n_events:>9} events | build: {build_time:6.3f}s | add 500: {add_time:6.3f}s | "
+          f"{2 * n_queries} queries index: {index_time:6.3f}s brute force: {brute_time:7.3f}s | "
+          f"speedup: {brute_time / index_time:7.1f}x | same results: {same}")
+
+
+if __name__ == "__main__":
+    for n_events in (10_000, 100_000, 1_000_000):
+        run_benchmark(n_events)
@@ -0,0 +1,75 @@
+import logging
+import os
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'etl_pipeline'))
+from transform import transform_data, transform_chunks, READ_CHUNK_SIZE
+
+COLUMNS_TO_REMOVE = ['year', 'local_time', 'river_basin', 'admin1_code', 'admin2_code', 'geo_locations',
+                     'start_year', 'start_month', 'start_day', 'end_year', 'end_month', 'end_day']
+
+
+# Synthetic staging rows as the cursor returns them, including the wide text columns the transform drops.
+# Chunks are generated one at a time, standing in for fetchmany on a server-side cursor.
+#########################################################################################################
+def make_chunk(n_rows, offset, seed):
+    rng = np.random.default_rng(seed)
+    years = rng.integers(1900, 2022, n_rows)
+    return pd.DataFrame({
+        'Dis No': [f'{year}-{offset + i:04d}-XXX' for i, year in enumerate(years)],
+        'Disaster Type': rng.choice(['Earthquake', 'Flood', 'Storm', 'Drought'], n_rows),
+        'Country': rng.choice(['Japan', 'Chile', 'Indonesia', 'Turkey', 'Peru'], n_rows),
+        'Location': [f'Province {i % 500}, district {i % 37}' for i in range(n_rows)],
+        'Geo Locations': ['Region A, Region B, Region C, Region D (Adm1).' * 4] * n_rows,
+        'Local Time': rng.choice(['10:32', '22:15', None], n_rows),
+        'River Basin': rng.choice(['Mekong, Chao Phraya and other basins', None], n_rows),
+        'Admin1 Code': ['1234;5678;9012'] * n_rows,
+        'Admin2 Code': ['12345;67890;13579;24680'] * n_rows,
+        'Year': years,
+        'Start Year': years, 'Start Month': rng.integers(1, 13, n_rows), 'Start Day': rng.integers(1, 29, n_rows),
+        'End Year': years, 'End Month': rng.integers(1, 13, n_rows), 'End Day': rng.integers(1, 29, n_rows),
+        'Total Deaths': rng.integers(0, 10000, n_rows),
+        'extraction_time': pd.Timestamp('2024-08-24'),
+    })
+
+
+def staged_chunks(n_rows, chunksize):
+    for offset in range(0, n_rows, chunksize):
+        yield make_chunk(min(chunksize, n_rows - offset), offset, seed=offset)
+
+
+def measure(run):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = run()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak / 1e6
+
+
+def whole_table(n_rows):
+    # the previous path: read_sql_query materializes the full result before transform_data
+    disasters = pd.concat(staged_chunks(n_rows, READ_CHUNK_SIZE), ignore_index=True)
+    return transform_data(disasters, COLUMNS_TO_REMOVE)
+
+
+def streamed(n_rows):
+    # the transform stage on its own: every transformed chunk is handed on (here counted) and dropped
+    return sum(len(chunk) for chunk in transform_chunks(staged_chunks(n_rows, READ_CHUNK_SIZE), COLUMNS_TO_REMOVE))
+
+
+if __name__ == "__main__":
+    logging.disable(logging.WARNING)
+    print(f"Staging chunks of {READ_CHUNK_SIZE} rows")
+    for n_rows in (100000, 400000, 1600000):
+        full, full_time, full_peak = measure(lambda: whole_table(n_rows))
+        chunked, chunked_time, chunked_peak = measure(lambda: streamed(n_rows))
+        assert len(full) == chunked
+        print(f"{n_rows:>8} rows: whole table peak {full_peak:7.0f} MB in {full_time:5.1f}s | "
+              f"chunked peak {chunked_peak:5.0f} MB in {chunked_time:5.1f}s "
+              f"(transformed rows kept by the driver: {full.memory_usage(deep=True).sum() / 1e6:.0f} MB)")
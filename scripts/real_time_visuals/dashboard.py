@@ -0,0 +1,260 @@
+import argparse
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api_extraction'))
+from recent_earthquakes import build_figure, clean_eq_data
+from poller import FeedPoller, FEED_URL
+
+logger = logging.getLogger(__name__)
+
+PERIOD_SECONDS = {'daily': 24 * 3600, 'weekly': 7 * 24 * 3600, 'monthly': 30 * 24 * 3600}
+CLIENT_QUEUE_SIZE = 100  # messages a viewer may fall behind before it is disconnected (it reloads on reconnect)
+KEEPALIVE_SECONDS = 15
+PLOTTED_COLUMNS = ['latitude', 'longitude', 'mag', 'sub_area']
+
+PAGE = """<!DOCTYPE html>
+<html>
+<head><meta charset="utf-8"><title>Recent Earthquakes</title>
+<script src="https://cdn.plot.ly/plotly-2.35.2.min.js"></script></head>
+<body style="margin:0"><div id="map" style="height:100vh"></div>
+<script>
+const map = document.getElementById('map');
+let shown = null;  // version of the events on the map, null while the figure loads
+let buffered = [];  // events received while it loads
+function extend(events) {
+    Plotly.extendTraces(map, {
+        lat: [events.latitude], lon: [events.longitude], 'marker.size': [events.mag], 'marker.color': [events.mag],
+        hovertext: [events.sub_area], customdata: [events.mag.map(() => [1])]
+    }, [0]);
+}
+function apply(version, events) {
+    // messages at or below the version already drawn are in the figure
+    if (version > shown) {
+        extend(events);
+        shown = version;
+    }
+}
+function load() {
+    shown = null;
+    return fetch('figure').then(response => response.json())
+        .then(fig => Plotly.react(map, fig.data, fig.layout).then(() => {
+            shown = fig.version;
+            buffered.forEach(message => apply(message.version, message.events));
+            buffered = [];
+        }));
+}
+const source = new EventSource('events');
+source.onopen = load;  // first connection and every reconnect start from the full figure
+source.addEventListener('refresh', load);
+source.addEventListener('events', message => {
+    const version = Number(message.lastEventId), events = JSON.parse(message.data);
+    if (shown === null) {
+        buffered.push({version, events});
+    } else {
+        apply(version, events);
+    }
+});
+</script></body></html>
+"""
+
+
+def format_message(event, data, version):
+    return f"event: {event}\nid: {version}\ndata: {data}\n\n".encode()
+
+
+class EventHub:
+    """
+    Latest events of the dashboard, fed by a single upstream poller and shared by every viewer.
+    New events are pushed to each connected viewer's queue as one server-sent event; revisions of events
+    already on the map (moved or re-rated) push a 'refresh' so viewers reload the figure.
+    The figure JSON is rendered once per version, however many viewers ask for it.
+    """
+    def __init__(self, period='daily', region='Worldwide', min_mag=1):
+        self.period = period
+        self.region = region
+        self.min_mag = min_mag
+        self.lock = threading.Lock()
+        self.events = pd.DataFrame()  # indexed by event id
+        self.center = (54, 15)
+        self.version = 0
+        self.clients = set()
+        self.rendered = (None, None)  # (version, figure JSON)
+        self.stats = {'published': 0, 'refreshes': 0, 'dropped_clients': 0}
+
+    def subscribe(self):
+        client = queue.Queue(maxsize=CLIENT_QUEUE_SIZE)
+        with self.lock:
+            self.clients.add(client)
+        return client
+
+    def unsubscribe(self, client):
+        with self.lock:
+            self.clients.discard(client)
+
+    def is_subscribed(self, client):
+        with self.lock:
+            return client in self.clients
+
+    def broadcast(self, message):
+        # called with the lock held; a viewer whose queue is full is cut off instead of slowing the others down
+        for client in list(self.clients):
+            try:
+                client.put_nowait(message)
+            except queue.Full:
+                self.clients.discard(client)
+                self.stats['dropped_clients'] += 1
+
+    def publish(self, raw_events):
+        """
+        Takes new or updated raw feed rows (the FeedPoller callback) and pushes the changes to the viewers.
+        """
+        df, center_lat, center_long = clean_eq_data(raw_events.copy(), period=self.period, min_mag=self.min_mag)
+        if self.region != 'Worldwide':
+            df = df[df['area'] == self.region]
+        df = df.drop_duplicates(subset='id', keep='last').set_index('id')
+        if df.empty:
+            return
+
+        with self.lock:
+            # the window ends at the latest event rather than the wall clock, so replayed feeds work the same
+            latest = df['time'].max() if self.events.empty else max(df['time'].max(), self.events['time'].max())
+            cutoff = latest - pd.Timedelta(seconds=PERIOD_SECONDS.get(self.period, PERIOD_SECONDS['daily']))
+            df = df[df['time'] >= cutoff]
+            if df.empty:
+                return
+            if self.events.empty:
+                self.center = (center_lat, center_long)
+            known = df.index.intersection(self.events.index)
+            new = df.drop(index=known)
+            moved = known[(self.events.loc[known, PLOTTED_COLUMNS].astype(str) != df.loc[known, PLOTTED_COLUMNS].astype(str)).any(axis=1)] \
+                if len(known) else known
+
+            events = pd.concat([self.events.drop(index=known), df]) if len(self.events) else df
+            self.events = events[events['time'] >= cutoff].sort_values('time')
+            self.version += 1
+
+            if len(moved):
+                self.broadcast(format_message('refresh', '{}', self.version))
+                self.stats['refreshes'] += 1
+            elif len(new):
+                payload = {col: new[col].astype(object).where(new[col].notna(), None).tolist() for col in PLOTTED_COLUMNS}
+                payload['id'] = new.index.tolist()
+                payload['updated'] = new['updated'].tolist()
+                self.broadcast(format_message('events', json.dumps(payload), self.version))
+            self.stats['published'] += len(new)
+
+    def figure_json(self):
+        """
+        The current map as plotly JSON with its 'version' (the SSE id of the last change it holds),
+        rendered at most once per version.
+        """
+        with self.lock:
+            version, events, center = self.version, self.events, self.center
+            if self.rendered[0] == version:
+                return self.rendered[1]
+        map_events = events.reset_index() if len(events) else pd.DataFrame({col: pd.Series(dtype=float) for col in PLOTTED_COLUMNS})
+        map_events = map_events.assign(count=1)
+        # the version goes in front of the plotly keys, without parsing the JSON again
+        figure = f'{{"version": {version}, ' + build_figure(map_events, center[0], center[1], None).to_json()[1:]
+        with self.lock:
+            self.rendered = (version, figure)
+        return figure
+
+
+class DashboardHandler(BaseHTTPRequestHandler):
+    def send_body(self, body, content_type):
+        body = body.encode() if isinstance(body, str) else body
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        hub = self.server.hub
+        if self.path == '/':
+            self.send_body(PAGE, 'text/html; charset=utf-8')
+        elif self.path == '/figure':
+            self.send_body(hub.figure_json(), 'application/json')
+        elif self.path == '/status':
+            status = dict(hub.stats, clients=len(hub.clients), events=len(hub.events), version=hub.version)
+            self.send_body(json.dumps(status), 'application/json')
+        elif self.path == '/events':
+            self.stream_events(hub)
+        else:
+            self.send_error(404)
+
+    def stream_events(self, hub):
+        # subscribed before the headers go out: the browser fetches the figure once the stream opens,
+        # and every event published after that render must already reach this viewer's queue
+        client = hub.subscribe()
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            self.wfile.write(b'retry: 2000\n\n')
+            self.wfile.flush()
+            while hub.is_subscribed(client):
+                try:
+                    message = client.get(timeout=KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    message = b': keep-alive\n\n'
+                self.wfile.write(message)
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            hub.unsubscribe(client)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+class DashboardServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, hub):
+        super().__init__(address, DashboardHandler)
+        self.hub = hub
+
+
+def start_dashboard(hub, port=8050, feed_url=FEED_URL, **poller_options):
+    """
+    Starts the upstream poller and the HTTP server on background threads. Returns (server, poller).
+    The poller starts from the feed covering the dashboard period, then polls on its adaptive cadence.
+    """
+    poller = FeedPoller(on_events=hub.publish, url=feed_url, **poller_options)
+    poller.last_poll = time.time() - PERIOD_SECONDS.get(hub.period, PERIOD_SECONDS['daily'])
+    threading.Thread(target=poller.run, daemon=True).start()
+
+    server = DashboardServer(('0.0.0.0', port), hub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"Dashboard on http://localhost:{server.server_port}/ ({hub.period}, {hub.region}, M{hub.min_mag}+)")
+    return server, poller
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Live earthquake map pushed to the browser over server-sent events')
+    parser.add_argument('--port', type=int, default=8050)
+    parser.add_argument('--period', default='daily', choices=list(PERIOD_SECONDS))
+    parser.add_argument('--region', default='Worldwide')
+    parser.add_argument('--min-mag', type=int, default=1)
+    parser.add_argument('--feed-url', default=FEED_URL, help='feed URL template, e.g. a local replay server')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    server, poller = start_dashboard(EventHub(args.period, args.region, args.min_mag), port=args.port, feed_url=args.feed_url)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+import re
+import time
+import numpy as np
+import pandas as pd
+
+FIGURE_CACHE_DIR = os.getenv('FIGURE_CACHE_DIR', '.figure_cache')
+FIGURE_CACHE_TTL = 60  # seconds a cached figure is served without looking at the feed again (USGS updates every minute)
+
+# Low-magnitude events sharing a grid cell within a frame are drawn as one point once there are enough of them
+BIN_BELOW_MAG = 2.5
+GRID_DEGREES = 1.0
+DENSITY_THRESHOLD = 5
+COORDINATE_DECIMALS = 3  # about 100 m, plenty for a world map and a third of the JSON per coordinate
+
+
+# Frame windows: every frame shows its own events (None), everything so far ('cumulative'),
+# or the events of the last n frames (an integer)
+##############################################################################################
+def window_frames(df, frame_col, window=None):
+    """
+    Repeats each event into every frame whose window covers it. Frames keep their order of appearance.
+    """
+    if window is None or df.empty:
+        return df
+
+    positions, frames = pd.factorize(df[frame_col])
+    n_frames = len(frames)
+    span = n_frames if window == 'cumulative' else int(window)
+    copies = np.minimum(span, n_frames - positions)
+
+    rows = np.repeat(np.arange(len(df)), copies)
+    offsets = np.arange(len(rows)) - np.repeat(np.cumsum(copies) - copies, copies)
+    windowed = df.iloc[rows].reset_index(drop=True)
+    windowed[frame_col] = np.asarray(frames, dtype=object)[positions[rows] + offsets]
+    return windowed
+
+
+# Grid binning of dense low-magnitude points
+#############################################
+def bin_dense_points(df, frame_col, bin_below_mag=BIN_BELOW_MAG, grid_degrees=GRID_DEGREES, density_threshold=DENSITY_THRESHOLD):
+    """
+    Replaces the events below bin_below_mag that fall in a grid cell holding at least density_threshold of them
+    (in the same frame) by one point per cell: mean position, largest magnitude and the event count.
+    Every other event stays as it is with a count of 1.
+    """
+    df = df.assign(count=1,
+                   lat_cell=np.floor(df['latitude'] / grid_degrees),
+                   lon_cell=np.floor(df['longitude'] / grid_degrees))
+    keys = [frame_col, 'lat_cell', 'lon_cell']
+    low = df['mag'] < bin_below_mag
+    cell_sizes = df[low].groupby(keys, sort=False)['count'].transform('size')
+    dense = pd.Series(False, index=df.index)
+    dense[cell_sizes.index[cell_sizes >= density_threshold]] = True
+    if not dense.any():
+        return df.drop(columns=['lat_cell', 'lon_cell'])
+
+    binned = df[dense].groupby(keys, sort=False).agg(
+        time=('time', 'min'), latitude=('latitude', 'mean'), longitude=('longitude', 'mean'), mag=('mag', 'max'), count=('count', 'size'),
+    ).reset_index(level=frame_col).reset_index(drop=True)
+    binned['sub_area'] = binned['count'].astype(str) + f' events below M{bin_below_mag}'
+
+    points = pd.concat([df[~dense].drop(columns=['lat_cell', 'lon_cell']), binned], ignore_index=True)
+    # frames must stay in time order for the animation
+    order = pd.factorize(df[frame_col])[1]
+    points['frame_order'] = pd.Index(order).get_indexer(points[frame_col])
+    return points.sort_values(['frame_order', 'time'], kind='stable', ignore_index=True).drop(columns='frame_order')
+
+
+def prepare_map_frames(df, frame_col, window=None, bin_below_mag=BIN_BELOW_MAG, grid_degrees=GRID_DEGREES,
+                       density_threshold=DENSITY_THRESHOLD):
+    """
+    Rendering prep for the animated map: windows the frames, bins dense low-magnitude points
+    and keeps only the columns the figure uses, with rounded coordinates.
+    """
+    df = df[['time', 'latitude', 'longitude', 'mag', 'sub_area', frame_col]].copy()
+    df['sub_area'] = df['sub_area'].astype(object)
+    df = window_frames(df, frame_col, window)
+    df = bin_dense_points(df, frame_col, bin_below_mag, grid_degrees, density_threshold)
+    df[['latitude', 'longitude']] = df[['latitude', 'longitude']].round(COORDINATE_DECIMALS)
+    return df.drop(columns='time')
+
+
+# Figure JSON cache per (period, region, min_mag)
+##################################################
+def cache_path(period, region, min_mag, window=None, cache_dir=FIGURE_CACHE_DIR):
+    name = re.sub(r'[^A-Za-z0-9.-]+', '_', f'{period}_{region}_{min_mag}_{window}')
+    return os.path.join(cache_dir, f'{name}.json')
+
+
+def data_fingerprint(df):
+    """
+    Changes whenever the feed gains, loses or revises an event.
+    """
+    return hashlib.sha1(pd.util.hash_pandas_object(df[['time', 'latitude', 'longitude', 'mag']], index=False).to_numpy().tobytes()).hexdigest()
+
+
+def read_cached_figure(path, fingerprint=None, max_age=None):
+    """
+    Returns the cached figure when it is younger than max_age seconds or was built from data with the same fingerprint.
+    The figure comes back as its JSON dict: rebuilding a validated plotly Figure costs more than building it anew.
+    """
+    if not os.path.exists(path):
+        return None
+    fresh = max_age is not None and time.time() - os.path.getmtime(path) < max_age
+    with open(path) as f:
+        cached = json.load(f)
+    if fresh or (fingerprint is not None and cached['fingerprint'] == fingerprint):
+        if not fresh:
+            # the data is unchanged, so the figure counts as just built
+            os.utime(path)
+        return json.loads(cached['figure'])
+    return None
+
+
+def write_cached_figure(path, fig, fingerprint):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({'fingerprint': fingerprint, 'figure': fig.to_json()}, f)
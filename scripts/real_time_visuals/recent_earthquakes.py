@@ -1,5 +1,12 @@
+import os
+import sys
 import pandas as pd
 import plotly.express as px
+import plotly.io as pio
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api_extraction'))
+from eq_features import add_place_columns, add_frame_column, FRAME_COLUMNS
+from map_frames import prepare_map_frames, cache_path, data_fingerprint, read_cached_figure, write_cached_figure, FIGURE_CACHE_TTL
 
 # Color scale: shades of green and orange
 custom_colors = [
@@ -15,23 +22,6 @@ custom_colors = [
 
 # Data source: https://earthquake.usgs.gov/earthquakes/feed/v1.0/summary/{???}.csv
 
-def extract_subarea(place):
-    return place[0]
-
-def extract_area(place):
-    return place[-1]
-
-def extract_date(time):
-    return str(time).split(' ')[0]
-
-def extract_weekday(time):
-    date = extract_date(time)
-    return date + ' - ' + str(time.weekday())
-
-def extract_hour(time):
-    t = str(time).split(' ')
-    return t[0] + ' - ' + t[1].split(':')[0]
-
 # Fetch data and clean it
 def fetch_eq_data(period='daily', region='Worldwide', min_mag=1):
     url = 'https://earthquake.usgs.gov/earthquakes/feed/v1.0/summary/{}.csv'
@@ -44,12 +34,14 @@ def fetch_eq_data(period='daily', region='Worldwide', min_mag=1):
         new_url = url.format('all_day')
 
     df_earthquake = pd.read_csv(new_url)
-    df_earthquake = df_earthquake[['time', 'latitude', 'longitude', 'mag', 'place']]
 
-    place_list = df_earthquake['place'].str.split(', ')    
-    df_earthquake['sub_area'] = place_list.apply(extract_subarea)
-    df_earthquake['area'] = place_list.apply(extract_area)
-    df_earthquake = df_earthquake.drop(columns=['place'], axis=1)
+    return clean_eq_data(df_earthquake, period=period, region=region, min_mag=min_mag)
+
+# Clean a raw feed, shared by fetch_eq_data and the live dashboard
+def clean_eq_data(df_earthquake, period='daily', region='Worldwide', min_mag=1):
+    df_earthquake = df_earthquake[['id', 'time', 'updated', 'latitude', 'longitude', 'mag', 'place']]
+
+    df_earthquake = add_place_columns(df_earthquake)
 
     if isinstance(min_mag, int) and min_mag > 0:
         df_earthquake = df_earthquake[df_earthquake['mag'] >= min_mag]
@@ -66,31 +58,14 @@ def fetch_eq_data(period='daily', region='Worldwide', min_mag=1):
     else:
         center_lat, center_long = [54, 15]
 
-    if period == 'weekly':
-        animation_frame_col = 'weekday'
-        df_earthquake[animation_frame_col] = df_earthquake['time'].apply(extract_weekday)
-    elif period == 'monthly':
-        animation_frame_col = 'date'
-        df_earthquake[animation_frame_col] = df_earthquake['time'].apply(extract_date)
-    else:
-        animation_frame_col = 'hours'
-        df_earthquake[animation_frame_col] = df_earthquake['time'].apply(extract_hour)
+    add_frame_column(df_earthquake, period)
 
     df_earthquake = df_earthquake.sort_values(by='time')
 
     return df_earthquake, center_lat, center_long
 
 # Create Visualizer 
-def visualize_eq_data(period='daily', region='Worldwide', min_mag=1):
-    df_earthquake, center_lat, center_long = fetch_eq_data(period=period, region=region, min_mag=min_mag)
-
-    if period == 'monthly':
-        animation_frame_col = 'date'
-    elif period == 'weekly':
-        animation_frame_col = 'weekday'
-    else:
-        animation_frame_col = 'hours'
-
+def build_figure(df_earthquake, center_lat, center_long, animation_frame_col):
     fig = px.scatter_mapbox(
         data_frame=df_earthquake,
         lat='latitude',
@@ -99,15 +74,41 @@ def visualize_eq_data(period='daily', region='Worldwide', min_mag=1):
         size='mag',
         color='mag',
         hover_name='sub_area',
+        hover_data={'count': True},
         zoom=1,
         mapbox_style='carto-positron',
         animation_frame=animation_frame_col,
         color_continuous_scale=custom_colors,  # Apply custom color scale
         title='Recent Earthquakes'
     )
+    return fig
+
+
+def visualize_eq_data(period='daily', region='Worldwide', min_mag=1, window=None, show=True):
+    # window: None (events of each frame), 'cumulative' or a number of frames (sliding window)
+    # Returns the figure, as a plotly Figure or as its JSON dict when served from the cache
+    path = cache_path(period, region, min_mag, window)
+
+    # A figure built less than FIGURE_CACHE_TTL ago is served without fetching the feed
+    fig = read_cached_figure(path, max_age=FIGURE_CACHE_TTL)
+    if fig is None:
+        df_earthquake, center_lat, center_long = fetch_eq_data(period=period, region=region, min_mag=min_mag)
+        animation_frame_col = FRAME_COLUMNS.get(period, FRAME_COLUMNS['daily'])
+
+        # Same events as the cached figure: reuse it instead of rebuilding and re-serializing every frame
+        fingerprint = data_fingerprint(df_earthquake)
+        fig = read_cached_figure(path, fingerprint=fingerprint)
+        if fig is None:
+            map_frames = prepare_map_frames(df_earthquake, animation_frame_col, window=window)
+            fig = build_figure(map_frames, center_lat, center_long, animation_frame_col)
+            write_cached_figure(path, fig, fingerprint)
+
+    # cached figures are plain dicts, already validated when they were built
+    if show:
+        pio.show(fig, validate=False)
 
-    fig.show()
+    return fig
 
-    return None
 
-visualize_eq_data(period='monthly', region='Worldwide', min_mag=1)
+if __name__ == "__main__":
+    visualize_eq_data(period='monthly', region='Worldwide', min_mag=1)